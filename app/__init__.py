@@ -2,16 +2,36 @@ from flask import Flask
 from flask_bootstrap import Bootstrap
 from flask_mail import Mail
 from flask_moment import Moment
-from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from flask_pagedown import PageDown
 from config import config
+from .replicas import RoutingSQLAlchemy
+from .rendering import Renderer
+from .email import MailQueue
+from .presence import Presence
+from .tokens import TokenVersions
+from .compression import Compression
+from .search import Search
+from .fragments import FragmentCache
+from .metrics import Metrics
+from .timing import ServerTiming
+from .graph import FollowGraph
 
 bootstrap = Bootstrap()
 mail = Mail()
+mail_queue = MailQueue()
 moment = Moment()
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 pagedown = PageDown()
+renderer = Renderer()
+presence = Presence()
+token_versions = TokenVersions()
+compression = Compression()
+search_index = Search()
+fragment_cache = FragmentCache()
+metrics = Metrics()
+server_timing = ServerTiming()
+follow_graph = FollowGraph()
 
 login_manager = LoginManager()
 login_manager.login_view = 'auth.login'
@@ -24,10 +44,20 @@ def create_app(config_name):
 
     bootstrap.init_app(app)
     mail.init_app(app)
+    mail_queue.init_app(app)
     moment.init_app(app)
     db.init_app(app)
     login_manager.init_app(app)
     pagedown.init_app(app)
+    renderer.init_app(app)
+    presence.init_app(app)
+    token_versions.init_app(app)
+    compression.init_app(app)
+    search_index.init_app(app)
+    fragment_cache.init_app(app)
+    follow_graph.init_app(app)
+    server_timing.init_app(app)
+    metrics.init_app(app)
 
     if app.config['SSL_REDIRECT']:
         from flask_sslify import SSLify
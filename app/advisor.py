@@ -0,0 +1,173 @@
+import re
+from collections import OrderedDict, namedtuple
+from flask import current_app
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+from . import db
+from .models import Follow, Post, Comment, Timeline
+
+Report = namedtuple('Report', 'name plan problems')
+
+
+class Explain(Executable, ClauseElement):
+    """Statement returning the query plan of another statement."""
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(Explain)
+def compile_explain(element, compiler, **kwargs):
+    return 'EXPLAIN ' + compiler.process(element.statement, **kwargs)
+
+
+@compiles(Explain, 'sqlite')
+def compile_explain_sqlite(element, compiler, **kwargs):
+    return 'EXPLAIN QUERY PLAN ' + compiler.process(element.statement,
+                                                     **kwargs)
+
+
+SQLITE_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)( USING .*)?$')
+POSTGRESQL_SCAN = re.compile(r'Seq Scan on (\w+)')
+POSTGRESQL_SORT = re.compile(r'^\s*(?:->\s*)?(?:Incremental )?Sort\b')
+
+
+def sqlite_problems(rows, scans=()):
+    plan = [row[-1] for row in rows]
+    problems = []
+    for line in plan:
+        match = SQLITE_SCAN.match(line)
+        if match:
+            table, index = match.groups()
+            if index is None:
+                problems.append('full scan of {}'.format(table))
+            elif table not in scans:
+                problems.append('full index scan of {}'.format(table))
+        elif line.startswith('USE TEMP B-TREE'):
+            problems.append('temporary sort ({})'.format(
+                line[len('USE TEMP B-TREE '):].lower()))
+    return plan, problems
+
+
+def postgresql_problems(rows, scans=()):
+    plan = [row[0] for row in rows]
+    problems = []
+    for line in plan:
+        match = POSTGRESQL_SCAN.search(line)
+        if match:
+            problems.append('full scan of {}'.format(match.group(1)))
+        elif POSTGRESQL_SORT.match(line):
+            problems.append('temporary sort')
+    return plan, problems
+
+
+def mysql_problems(rows, scans=()):
+    plan, problems = [], []
+    for row in rows:
+        row = dict(row)
+        extra = row.get('Extra') or ''
+        plan.append('{}: type={} key={} {}'.format(
+            row.get('table'), row.get('type'), row.get('key'), extra))
+        if row.get('type') == 'ALL':
+            problems.append('full scan of {}'.format(row.get('table')))
+        elif row.get('type') == 'index' and row.get('table') not in scans:
+            problems.append('full index scan of {}'.format(row.get('table')))
+        if 'Using filesort' in extra or 'Using temporary' in extra:
+            problems.append('temporary sort')
+    return plan, problems
+
+
+class IndexAdvisor(object):
+    """Registry of the hot queries of the application, whose plans on the
+    configured database are checked for full table scans and sorts that
+    an index would avoid.
+
+    Queries are registered as functions returning a query of the same
+    shape as the one the application runs. A scan in index order is only
+    accepted on the tables listed in ``scans``, for queries that read the
+    first rows of a whole table; elsewhere it means the index that would
+    narrow the search is missing. Plans depend on the data, so on a tiny
+    development database the planner of some databases may legitimately
+    prefer a full scan.
+    """
+    dialects = {
+        'sqlite': sqlite_problems,
+        'postgresql': postgresql_problems,
+        'mysql': mysql_problems
+    }
+
+    def __init__(self):
+        self.queries = OrderedDict()
+
+    def register(self, name, scans=()):
+        def decorator(f):
+            self.queries[name] = (f, scans)
+            return f
+        return decorator
+
+    def explain(self, query, scans=()):
+        """Return the plan of ``query`` as a list of lines and the list of
+        problems found in it."""
+        statement = getattr(query, 'statement', query)
+        engine = db.get_engine(current_app._get_current_object())
+        analyze = self.dialects.get(engine.dialect.name)
+        if analyze is None:
+            raise ValueError('Query plans of {} databases are not '
+                             'supported'.format(engine.dialect.name))
+        with engine.connect() as connection:
+            rows = connection.execute(Explain(statement)).fetchall()
+        return analyze(rows, scans)
+
+    def check(self):
+        """Explain every registered query and return a list of reports."""
+        reports = []
+        for name, (f, scans) in self.queries.items():
+            plan, problems = self.explain(f(), scans)
+            reports.append(Report(name, plan, problems))
+        return reports
+
+
+advisor = IndexAdvisor()
+
+
+def per_page(name):
+    return current_app.config['FLASKY_{}_PER_PAGE'.format(name)]
+
+
+@advisor.register('posts', scans=('posts',))
+def posts():
+    return Post.query.order_by(Post.timestamp.desc()).limit(per_page('POSTS'))
+
+
+@advisor.register('followed posts')
+def followed_posts():
+    return Post.query.join(Timeline, Timeline.post_id == Post.id)\
+        .filter(Timeline.user_id == 1)\
+        .order_by(Timeline.timestamp.desc(), Timeline.post_id.desc())\
+        .limit(per_page('POSTS'))
+
+
+@advisor.register('user posts')
+def user_posts():
+    return Post.query.filter(Post.author_id == 1)\
+        .order_by(Post.timestamp.desc(), Post.id.desc())\
+        .limit(per_page('POSTS'))
+
+
+@advisor.register('post comments')
+def post_comments():
+    return Comment.query.filter(Comment.post_id == 1)\
+        .order_by(Comment.timestamp.asc(), Comment.id.asc())\
+        .limit(per_page('COMMENTS'))
+
+
+@advisor.register('comments', scans=('comments',))
+def comments():
+    return Comment.query.order_by(Comment.timestamp.desc())\
+        .limit(per_page('COMMENTS'))
+
+
+@advisor.register('followers')
+def followers():
+    return Follow.query.filter(Follow.followed_id == 1)\
+        .order_by(Follow.timestamp, Follow.follower_id)\
+        .limit(per_page('FOLLOWERS'))
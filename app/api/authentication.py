@@ -1,6 +1,7 @@
 from flask import g, jsonify
 from flask_httpauth import HTTPBasicAuth
 from ..models import User
+from ..timing import timed
 from . import api
 from .errors import unauthorized, forbidden
 
@@ -8,6 +9,7 @@ auth = HTTPBasicAuth()
 
 
 @auth.verify_password
+@timed('auth')
 def verify_password(email_or_token, password):
     if email_or_token == '':
         return False
@@ -0,0 +1,65 @@
+from flask import jsonify, request, current_app
+from .. import db
+from ..exceptions import ValidationError
+
+
+def get_ids():
+    try:
+        ids = [int(id) for id in request.args['ids'].split(',') if id]
+    except ValueError:
+        raise ValidationError('ids must be a comma separated list of '
+                              'integers')
+    if len(ids) > current_app.config['FLASKY_API_BATCH_LIMIT']:
+        raise ValidationError('too many ids')
+    return ids
+
+
+def multi_get(name, model):
+    """Return the resources listed in the ``ids`` argument, fetched with a
+    single query, in the order they were requested."""
+    ids = get_ids()
+    items = {}
+    if ids:
+        items = {item.id: item
+                 for item in model.query.filter(model.id.in_(ids))}
+    return jsonify({
+        name: [items[id].to_json() for id in ids if id in items],
+        'missing': [id for id in ids if id not in items]
+    })
+
+
+def batch_create(name, factory):
+    """Create one resource per element of the JSON list in the request
+    body, in a single transaction.
+
+    ``factory`` builds an unsaved model instance from one element and
+    raises ``ValidationError`` when it is invalid. Invalid elements are
+    reported in the results without preventing the others from being
+    created.
+    """
+    json_items = request.json
+    if not isinstance(json_items, list):
+        raise ValidationError('request body must be a list')
+    if len(json_items) > current_app.config['FLASKY_API_BATCH_LIMIT']:
+        raise ValidationError('too many items')
+    items = []
+    for json_item in json_items:
+        try:
+            if not isinstance(json_item, dict):
+                raise ValidationError('item must be an object')
+            item = factory(json_item)
+        except ValidationError as e:
+            items.append(e)
+        else:
+            db.session.add(item)
+            items.append(item)
+    db.session.flush()
+    results = []
+    for item in items:
+        if isinstance(item, ValidationError):
+            results.append({'status': 400, 'error': 'bad request',
+                            'message': item.args[0]})
+        else:
+            results.append({'status': 201, name: item.to_json()})
+    db.session.commit()
+    return jsonify({'results': results})
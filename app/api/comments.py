@@ -3,10 +3,25 @@ from .. import db
 from ..models import Post, Permission, Comment
 from . import api
 from .decorators import permission_required
+from .cursors import cursor_page
+from ..conditional import conditional
+from .batch import batch_create
+
+
+def comments_version():
+    # read from the end of the updated_at index, comments are never
+    # deleted on their own
+    return db.session.query(db.func.max(Comment.updated_at)).one()
 
 
 @api.route('/comments/')
+@conditional(comments_version)
 def get_comments():
+    if 'cursor' in request.args:
+        return cursor_page(
+            'comments', Comment.query, (Comment.timestamp, Comment.id),
+            'api.get_comments',
+            per_page=current_app.config['FLASKY_COMMENTS_PER_PAGE'])
     page = request.args.get('page', 1, type=int)
     pagination = Comment.query.order_by(Comment.timestamp.desc()).paginate(
         page, per_page=current_app.config['FLASKY_COMMENTS_PER_PAGE'],
@@ -27,14 +42,21 @@ def get_comments():
 
 
 @api.route('/comments/<int:id>')
+@conditional(Comment.version)
 def get_comment(id):
     comment = Comment.query.get_or_404(id)
     return jsonify(comment.to_json())
 
 
 @api.route('/posts/<int:id>/comments/')
+@conditional(Post.version)
 def get_post_comments(id):
     post = Post.query.get_or_404(id)
+    if 'cursor' in request.args:
+        return cursor_page(
+            'comments', post.comments, (Comment.timestamp, Comment.id),
+            'api.get_post_comments', id=id, descending=False,
+            per_page=current_app.config['FLASKY_COMMENTS_PER_PAGE'])
     page = request.args.get('page', 1, type=int)
     pagination = post.comments.order_by(Comment.timestamp.asc()).paginate(
         page, per_page=current_app.config['FLASKY_COMMENTS_PER_PAGE'],
@@ -59,9 +81,22 @@ def get_post_comments(id):
 def new_post_comment(id):
     post = Post.query.get_or_404(id)
     comment = Comment.from_json(request.json)
-    comment.author = g.current_user
+    comment.author_id = g.current_user.id
     comment.post = post
     db.session.add(comment)
     db.session.commit()
     return jsonify(comment.to_json()), 201, \
         {'Location': url_for('api.get_comment', id=comment.id)}
+
+
+@api.route('/posts/<int:id>/comments/batch', methods=['POST'])
+@permission_required(Permission.COMMENT)
+def new_post_comments(id):
+    post = Post.query.get_or_404(id)
+
+    def new_comment(json_comment):
+        comment = Comment.from_json(json_comment)
+        comment.author_id = g.current_user.id
+        comment.post = post
+        return comment
+    return batch_create('comment', new_comment)
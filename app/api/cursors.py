@@ -0,0 +1,26 @@
+from flask import jsonify, request, url_for
+from ..pagination import KeysetPagination
+
+
+def cursor_page(name, query, columns, endpoint, per_page, descending=True,
+                **kwargs):
+    count = request.args.get('count', 0, type=int)
+    pagination = KeysetPagination(
+        query, columns, cursor=request.args.get('cursor'),
+        per_page=per_page, descending=descending, count=bool(count))
+    if count:
+        kwargs['count'] = count
+    prev = None
+    if pagination.has_prev:
+        prev = url_for(endpoint, cursor=pagination.prev_cursor, **kwargs)
+    next = None
+    if pagination.has_next:
+        next = url_for(endpoint, cursor=pagination.next_cursor, **kwargs)
+    json_page = {
+        name: [item.to_json() for item in pagination.items],
+        'prev': prev,
+        'next': next
+    }
+    if pagination.total is not None:
+        json_page['count'] = pagination.total
+    return jsonify(json_page)
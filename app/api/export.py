@@ -0,0 +1,75 @@
+from datetime import datetime
+from flask import request, current_app, stream_with_context, json
+from .. import db
+from ..exceptions import ValidationError
+from ..models import User, Post, Comment
+from ..pagination import encode_cursor, decode_cursor, check_cursor_value
+from . import api
+
+SINCE_FORMATS = ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d')
+
+
+def parse_since(value):
+    for format in SINCE_FORMATS:
+        try:
+            return datetime.strptime(value, format)
+        except ValueError:
+            pass
+    raise ValidationError('invalid since timestamp')
+
+
+def export(model):
+    """Stream every row of ``model`` as newline delimited JSON.
+
+    Rows are read in batches of ``FLASKY_EXPORT_BATCH_SIZE`` ordered by
+    id, and each batch is removed from the session once written, so memory
+    use does not grow with the size of the table. ``since`` restricts the
+    export to rows created or changed after a point in time. Every line
+    carries a ``cursor`` that resumes the export after that row.
+    """
+    query = db.session.query(model)
+    since = request.args.get('since')
+    if since:
+        query = query.filter(model.updated_at >= parse_since(since))
+    last_id = 0
+    cursor = request.args.get('cursor')
+    if cursor:
+        direction, values = decode_cursor(cursor)
+        if direction != 'next' or len(values) != 1:
+            raise ValidationError('invalid cursor')
+        last_id = check_cursor_value(model.id, values[0])
+    batch_size = current_app.config['FLASKY_EXPORT_BATCH_SIZE']
+
+    def generate(last_id):
+        while True:
+            batch = query.filter(model.id > last_id).order_by(model.id)\
+                .limit(batch_size).all()
+            if not batch:
+                return
+            lines = []
+            for item in batch:
+                json_item = item.to_json()
+                json_item['cursor'] = encode_cursor('next', [item.id])
+                lines.append(json.dumps(json_item))
+                db.session.expunge(item)
+            last_id = batch[-1].id
+            yield '\n'.join(lines) + '\n'
+
+    return current_app.response_class(
+        stream_with_context(generate(last_id)),
+        mimetype='application/x-ndjson')
+
+
+@api.route('/posts/export')
+def export_posts():
+    return export(Post)
+
+
+@api.route('/comments/export')
+def export_comments():
+    return export(Comment)
+
+
+@api.route('/users/export')
+def export_users():
+    return export(User)
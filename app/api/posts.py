@@ -4,10 +4,19 @@ from ..models import Post, Permission
 from . import api
 from .decorators import permission_required
 from .errors import forbidden
+from .cursors import cursor_page
+from ..conditional import conditional
+from .batch import multi_get, batch_create
 
 
 @api.route('/posts/')
 def get_posts():
+    if 'ids' in request.args:
+        return multi_get('posts', Post)
+    if 'cursor' in request.args:
+        return cursor_page(
+            'posts', Post.query, (Post.timestamp, Post.id), 'api.get_posts',
+            per_page=current_app.config['FLASKY_POSTS_PER_PAGE'])
     page = request.args.get('page', 1, type=int)
     pagination = Post.query.paginate(
         page, per_page=current_app.config['FLASKY_POSTS_PER_PAGE'],
@@ -28,6 +37,7 @@ def get_posts():
 
 
 @api.route('/posts/<int:id>')
+@conditional(Post.version)
 def get_post(id):
     post = Post.query.get_or_404(id)
     return jsonify(post.to_json())
@@ -37,18 +47,28 @@ def get_post(id):
 @permission_required(Permission.WRITE)
 def new_post():
     post = Post.from_json(request.json)
-    post.author = g.current_user
+    post.author_id = g.current_user.id
     db.session.add(post)
     db.session.commit()
     return jsonify(post.to_json()), 201, \
         {'Location': url_for('api.get_post', id=post.id)}
 
 
+@api.route('/posts/batch', methods=['POST'])
+@permission_required(Permission.WRITE)
+def new_posts():
+    def new_post(json_post):
+        post = Post.from_json(json_post)
+        post.author_id = g.current_user.id
+        return post
+    return batch_create('post', new_post)
+
+
 @api.route('/posts/<int:id>', methods=['PUT'])
 @permission_required(Permission.WRITE)
 def edit_post(id):
     post = Post.query.get_or_404(id)
-    if g.current_user != post.author and \
+    if g.current_user.id != post.author_id and \
             not g.current_user.can(Permission.ADMIN):
         return forbidden('Insufficient permissions')
     post.body = request.json.get('body', post.body)
@@ -0,0 +1,35 @@
+from flask import jsonify, request, url_for, current_app
+from .. import search_index
+from . import api
+
+
+@api.route('/search')
+def search():
+    q = request.args.get('q', '')
+    kind = request.args.get('type')
+    kinds = [kind] if kind in ('post', 'comment') else None
+    count = request.args.get('count', 0, type=int)
+    pagination = search_index.search(
+        q, kinds=kinds, cursor=request.args.get('cursor'),
+        per_page=current_app.config['FLASKY_SEARCH_RESULTS_PER_PAGE'],
+        count=bool(count))
+    kwargs = {'q': q}
+    if kinds:
+        kwargs['type'] = kind
+    if count:
+        kwargs['count'] = count
+    prev = None
+    if pagination.has_prev:
+        prev = url_for('api.search', cursor=pagination.prev_cursor, **kwargs)
+    next = None
+    if pagination.has_next:
+        next = url_for('api.search', cursor=pagination.next_cursor, **kwargs)
+    json_page = {
+        'results': [{'type': kind, kind: item.to_json()}
+                    for kind, item in pagination.results],
+        'prev': prev,
+        'next': next
+    }
+    if pagination.total is not None:
+        json_page['count'] = pagination.total
+    return jsonify(json_page)
@@ -1,9 +1,22 @@
 from flask import jsonify, request, current_app, url_for
 from . import api
-from ..models import User, Post
+from .. import follow_graph
+from ..models import User, Post, Timeline, user_cache
+from .cursors import cursor_page
+from ..conditional import conditional
+from ..exceptions import ValidationError
+from .batch import multi_get
+
+
+@api.route('/users/')
+def get_users():
+    if 'ids' not in request.args:
+        raise ValidationError('ids argument is required')
+    return multi_get('users', User)
 
 
 @api.route('/users/<int:id>')
+@conditional(User.version)
 def get_user(id):
     user = User.query.get_or_404(id)
     return jsonify(user.to_json())
@@ -12,6 +25,11 @@ def get_user(id):
 @api.route('/users/<int:id>/posts/')
 def get_user_posts(id):
     user = User.query.get_or_404(id)
+    if 'cursor' in request.args:
+        return cursor_page(
+            'posts', user.posts, (Post.timestamp, Post.id),
+            'api.get_user_posts', id=id,
+            per_page=current_app.config['FLASKY_POSTS_PER_PAGE'])
     page = request.args.get('page', 1, type=int)
     pagination = user.posts.order_by(Post.timestamp.desc()).paginate(
         page, per_page=current_app.config['FLASKY_POSTS_PER_PAGE'],
@@ -34,8 +52,14 @@ def get_user_posts(id):
 @api.route('/users/<int:id>/timeline/')
 def get_user_followed_posts(id):
     user = User.query.get_or_404(id)
+    if 'cursor' in request.args:
+        return cursor_page(
+            'posts', user.followed_posts,
+            (Timeline.timestamp, Timeline.post_id),
+            'api.get_user_followed_posts', id=id,
+            per_page=current_app.config['FLASKY_POSTS_PER_PAGE'])
     page = request.args.get('page', 1, type=int)
-    pagination = user.followed_posts.order_by(Post.timestamp.desc()).paginate(
+    pagination = user.followed_posts.paginate(
         page, per_page=current_app.config['FLASKY_POSTS_PER_PAGE'],
         error_out=False)
     posts = pagination.items
@@ -51,3 +75,15 @@ def get_user_followed_posts(id):
         'next': next,
         'count': pagination.total
     })
+
+
+@api.route('/users/<int:id>/recommendations/')
+def get_user_recommendations(id):
+    user = User.query.get_or_404(id)
+    recommendations = []
+    for user_id, mutual in follow_graph.recommend(user.id):
+        recommended = user_cache.get(user_id)
+        if recommended is not None:
+            recommendations.append({'user': recommended.to_json(),
+                                    'mutual_follows': mutual})
+    return jsonify({'recommendations': recommendations})
@@ -1,10 +1,12 @@
-from flask import render_template, redirect, request, url_for, flash
+from flask import render_template, redirect, request, url_for, flash, \
+    current_app
 from flask_login import login_user, logout_user, login_required, \
     current_user
 from . import auth
-from .. import db
-from ..models import User
+from .. import db, presence
+from ..models import User, user_cache
 from ..email import send_email
+from ..exceptions import MailQueueFull
 from .forms import LoginForm, RegistrationForm, ChangePasswordForm,\
     PasswordResetRequestForm, PasswordResetForm, ChangeEmailForm
 
@@ -12,7 +14,7 @@ from .forms import LoginForm, RegistrationForm, ChangePasswordForm,\
 @auth.before_app_request
 def before_request():
     if current_user.is_authenticated:
-        current_user.ping()
+        presence.touch(current_user)
         if not current_user.confirmed \
                 and request.endpoint \
                 and request.blueprint != 'auth' \
@@ -20,6 +22,18 @@ def before_request():
             return redirect(url_for('auth.unconfirmed'))
 
 
+def queue_email(*args, **kwargs):
+    """Queue a message, flashing an apology and returning False when the
+    mail queue stays full."""
+    try:
+        send_email(*args, **kwargs)
+    except MailQueueFull:
+        flash('We could not send you an email right now. Please try again '
+              'in a few minutes.')
+        return False
+    return True
+
+
 @auth.route('/unconfirmed')
 def unconfirmed():
     if current_user.is_anonymous or current_user.confirmed:
@@ -60,9 +74,12 @@ def register():
         db.session.add(user)
         db.session.commit()
         token = user.generate_confirmation_token()
-        send_email(user.email, 'Confirm Your Account',
-                   'auth/email/confirm', user=user, token=token)
-        flash('A confirmation email has been sent to you by email.')
+        if queue_email(user.email, 'Confirm Your Account',
+                       'auth/email/confirm', user=user, token=token):
+            flash('A confirmation email has been sent to you by email.')
+        else:
+            flash('Your account has been created. Log in to request a new '
+                  'confirmation email.')
         return redirect(url_for('auth.login'))
     return render_template('auth/register.html', form=form)
 
@@ -84,9 +101,9 @@ def confirm(token):
 @login_required
 def resend_confirmation():
     token = current_user.generate_confirmation_token()
-    send_email(current_user.email, 'Confirm Your Account',
-               'auth/email/confirm', user=current_user, token=token)
-    flash('A new confirmation email has been sent to you by email.')
+    if queue_email(current_user.email, 'Confirm Your Account',
+                   'auth/email/confirm', user=current_user, token=token):
+        flash('A new confirmation email has been sent to you by email.')
     return redirect(url_for('main.index'))
 
 
@@ -115,10 +132,17 @@ def password_reset_request():
         user = User.query.filter_by(email=form.email.data).first()
         if user:
             token = user.generate_reset_token()
-            send_email(user.email, 'Reset Your Password',
-                       'auth/email/reset_password',
-                       user=user, token=token,
-                       next=request.args.get('next'))
+            try:
+                send_email(user.email, 'Reset Your Password',
+                           'auth/email/reset_password',
+                           user=user, token=token,
+                           next=request.args.get('next'))
+            except MailQueueFull:
+                # answering differently would tell which addresses have
+                # an account
+                current_app.logger.warning(
+                    'Dropped the password reset email of user %s, the '
+                    'mail queue is full', user.id)
         flash('An email with instructions to reset your password has been '
               'sent to you.')
         return redirect(url_for('auth.login'))
@@ -148,12 +172,12 @@ def change_email_request():
         if current_user.verify_password(form.password.data):
             new_email = form.email.data
             token = current_user.generate_email_change_token(new_email)
-            send_email(new_email, 'Confirm your email address',
-                       'auth/email/change_email',
-                       user=current_user, token=token)
-            flash('An email with instructions to confirm your new email '
-                  'address has been sent to you.')
-            return redirect(url_for('main.index'))
+            if queue_email(new_email, 'Confirm your email address',
+                           'auth/email/change_email',
+                           user=current_user, token=token):
+                flash('An email with instructions to confirm your new '
+                      'email address has been sent to you.')
+                return redirect(url_for('main.index'))
         else:
             flash('Invalid email or password.')
     return render_template("auth/change_email.html", form=form)
@@ -164,6 +188,7 @@ def change_email_request():
 def change_email(token):
     if current_user.change_email(token):
         db.session.commit()
+        user_cache.invalidate(current_user._get_current_object())
         flash('Your email address has been updated.')
     else:
         flash('Invalid request.')
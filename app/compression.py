@@ -0,0 +1,195 @@
+import threading
+import time
+import zlib
+from werkzeug.http import parse_accept_header, parse_options_header
+from werkzeug.datastructures import Headers
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript',
+                      'application/xml', 'application/x-ndjson',
+                      'image/svg+xml')
+
+
+class _Gzip(object):
+    def __init__(self, level):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED,
+                                           16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def flush(self):
+        return self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self.compressor.flush()
+
+
+class _Brotli(object):
+    def __init__(self, level):
+        self.compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self.compressor.process(data)
+
+    def flush(self):
+        return self.compressor.flush()
+
+    def finish(self):
+        return self.compressor.finish()
+
+
+class _CompressedBody(object):
+    """Iterable that compresses the chunks of a WSGI response as they are
+    produced. Streamed responses are flushed after every chunk so the
+    client receives them without delay."""
+    def __init__(self, middleware, app_iter, compressor, streamed):
+        self.middleware = middleware
+        self.app_iter = app_iter
+        self.compressor = compressor
+        self.streamed = streamed
+
+    def __iter__(self):
+        size = compressed_size = 0
+        seconds = 0.0
+        try:
+            for chunk in self.app_iter:
+                if not chunk:
+                    continue
+                size += len(chunk)
+                start = time.perf_counter()
+                data = self.compressor.compress(chunk)
+                if self.streamed:
+                    data += self.compressor.flush()
+                seconds += time.perf_counter() - start
+                if data:
+                    compressed_size += len(data)
+                    yield data
+            start = time.perf_counter()
+            data = self.compressor.finish()
+            seconds += time.perf_counter() - start
+            compressed_size += len(data)
+            yield data
+        finally:
+            self.middleware.record(size, compressed_size, seconds)
+
+    def close(self):
+        if hasattr(self.app_iter, 'close'):
+            self.app_iter.close()
+
+
+class CompressionMiddleware(object):
+    """WSGI middleware compressing responses with gzip, or with brotli
+    when the ``brotli`` package is installed and the client accepts it.
+
+    Responses that are empty, shorter than ``min_size`` bytes, already
+    encoded, or of a content type that does not compress well are passed
+    through unchanged. ``levels`` maps an encoding to a dictionary of
+    compression levels by content type, with ``'*'`` as the fallback.
+    """
+    def __init__(self, wsgi_app, min_size=500, levels=None):
+        self.wsgi_app = wsgi_app
+        self.min_size = min_size
+        self.levels = {'gzip': {'*': 6}, 'br': {'*': 4}}
+        for encoding, value in (levels or {}).items():
+            self.levels.setdefault(encoding, {}).update(value)
+        self.encodings = ['br', 'gzip'] if brotli is not None else ['gzip']
+        self.responses = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def negotiate(self, environ):
+        accept = parse_accept_header(environ.get('HTTP_ACCEPT_ENCODING'))
+        best, quality = None, 0
+        for encoding in self.encodings:
+            if accept[encoding] > quality:
+                best, quality = encoding, accept[encoding]
+        return best
+
+    def level(self, encoding, mimetype):
+        levels = self.levels[encoding]
+        return levels.get(mimetype, levels['*'])
+
+    def __call__(self, environ, start_response):
+        encoding = self.negotiate(environ)
+        if environ['REQUEST_METHOD'] == 'HEAD':
+            encoding = None
+        state = {}
+
+        def compressing_start_response(status, headers, exc_info=None):
+            headers = Headers(headers)
+            mimetype = parse_options_header(
+                headers.get('Content-Type', ''))[0]
+            if not mimetype.startswith(COMPRESSIBLE_TYPES):
+                return start_response(status, headers.to_wsgi_list(),
+                                      exc_info)
+            vary = headers.get('Vary')
+            if not vary:
+                headers['Vary'] = 'Accept-Encoding'
+            elif 'accept-encoding' not in vary.lower():
+                headers['Vary'] = vary + ', Accept-Encoding'
+            length = headers.get('Content-Length', type=int)
+            if encoding is None or \
+                    int(status.split(None, 1)[0]) in (204, 206, 304) or \
+                    'Content-Encoding' in headers or \
+                    'no-transform' in headers.get('Cache-Control', '') or \
+                    (length is not None and length < self.min_size):
+                return start_response(status, headers.to_wsgi_list(),
+                                      exc_info)
+            headers.remove('Content-Length')
+            headers['Content-Encoding'] = encoding
+            etag = headers.get('ETag')
+            if etag and not etag.startswith('W/'):
+                # the compressed body is no longer byte-for-byte identical
+                headers['ETag'] = 'W/' + etag
+            state['compressor'] = self.compressor(encoding, mimetype)
+            state['streamed'] = length is None
+            return start_response(status, headers.to_wsgi_list(), exc_info)
+
+        app_iter = self.wsgi_app(environ, compressing_start_response)
+        if 'compressor' not in state:
+            return app_iter
+        return _CompressedBody(self, app_iter, state['compressor'],
+                               state['streamed'])
+
+    def compressor(self, encoding, mimetype):
+        level = self.level(encoding, mimetype)
+        if encoding == 'br':
+            return _Brotli(level)
+        return _Gzip(level)
+
+    def record(self, size, compressed_size, seconds):
+        with self._lock:
+            self.responses += 1
+            self.bytes_in += size
+            self.bytes_out += compressed_size
+            self.seconds += seconds
+
+    def stats(self):
+        return {
+            'responses': self.responses,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'ratio': self.bytes_out / self.bytes_in if self.bytes_in else None,
+            'seconds': self.seconds
+        }
+
+
+class Compression(object):
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not app.config['FLASKY_COMPRESSION']:
+            return
+        app.wsgi_app = app.extensions['compression'] = CompressionMiddleware(
+            app.wsgi_app,
+            min_size=app.config['FLASKY_COMPRESSION_MIN_SIZE'],
+            levels=app.config['FLASKY_COMPRESSION_LEVELS'])
@@ -0,0 +1,58 @@
+import hashlib
+from datetime import datetime
+from functools import wraps
+from flask import request, make_response, current_app
+
+
+def make_etag(values):
+    return hashlib.sha1(repr(tuple(values)).encode('utf-8')).hexdigest()
+
+
+def conditional(version, weak=False, when=None, vary=None):
+    """Answer conditional GET requests before the view runs.
+
+    ``version`` is called with the view arguments and returns a row of
+    values that changes whenever the response would, or ``None`` when the
+    resource does not exist. The ETag is a hash of those values and the
+    most recent datetime among them is sent as ``Last-Modified``. When the
+    client's copy is current a 304 is returned without calling the view.
+
+    ``when`` is an optional predicate that must hold for the response to
+    be cacheable, for views whose output also depends on the user.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or \
+                    (when is not None and not when()):
+                return f(*args, **kwargs)
+            values = version(*args, **kwargs)
+            if values is None:
+                return f(*args, **kwargs)
+            etag = make_etag(values)
+            dates = [value for value in values
+                     if isinstance(value, datetime)]
+            last_modified = max(dates).replace(microsecond=0) \
+                if dates else None
+            if not_modified(etag, last_modified):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=weak)
+            if last_modified is not None:
+                response.last_modified = last_modified
+            if vary is not None:
+                response.vary.add(vary)
+            return response
+        return decorated_function
+    return decorator
+
+
+def not_modified(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and last_modified is not None:
+        return last_modified <= request.if_modified_since
+    return False
@@ -1,12 +1,161 @@
-from threading import Thread
+import atexit
+import queue
+import smtplib
+import threading
+import time
+from concurrent.futures import Future
 from flask import current_app, render_template
 from flask_mail import Message
-from . import mail
+from .exceptions import MailQueueFull
 
 
-def send_async_email(app, msg):
-    with app.app_context():
-        mail.send(msg)
+class _Job(object):
+    def __init__(self, msg):
+        self.msg = msg
+        self.future = Future()
+        self.attempts = 0
+
+
+_STOP = object()
+
+
+class MailWorkerPool(object):
+    """A fixed set of worker threads delivering queued messages.
+
+    Each worker keeps its SMTP connection open for as long as messages
+    keep arriving within ``idle_timeout`` seconds, so a burst of messages
+    is sent over a single connection. Transient delivery errors are
+    retried with exponential backoff.
+    """
+    def __init__(self, app, workers=2, queue_size=1000, put_timeout=5,
+                 idle_timeout=5, retries=3, backoff=1):
+        self.app = app
+        self.workers = workers
+        self.put_timeout = put_timeout
+        self.idle_timeout = idle_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.queue = queue.Queue(queue_size)
+        self.threads = []
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.dropped = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self.threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work,
+                                          name='mail-worker-{}'.format(i))
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+            atexit.register(self.shutdown)
+
+    def submit(self, msg):
+        self.start()
+        job = _Job(msg)
+        try:
+            self.queue.put(job, timeout=self.put_timeout)
+        except queue.Full:
+            self.count('dropped')
+            raise MailQueueFull('mail queue is full')
+        return job.future
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            threads, self.threads = self.threads, []
+        for thread in threads:
+            self.queue.put(_STOP)
+        if wait:
+            for thread in threads:
+                thread.join()
+
+    def _next(self):
+        try:
+            return self.queue.get(timeout=self.idle_timeout)
+        except queue.Empty:
+            return None
+
+    def _work(self):
+        with self.app.app_context():
+            job = None
+            while True:
+                if job is None:
+                    job = self.queue.get()
+                if job is _STOP:
+                    return
+                try:
+                    with self.app.extensions['mail'].connect() as conn:
+                        self.count('connections')
+                        while job is not None and job is not _STOP:
+                            conn.send(job.msg)
+                            job.future.set_result(True)
+                            self.count('sent')
+                            job = self._next()
+                except (smtplib.SMTPException, OSError) as e:
+                    if job is None or job is _STOP:
+                        # the connection failed to close cleanly after the
+                        # last message was delivered
+                        continue
+                    job = self._retry(job, e)
+                except Exception as e:
+                    if job is None or job is _STOP:
+                        continue
+                    self._fail(job, e)
+                    job = None
+
+    def _retry(self, job, error):
+        job.attempts += 1
+        if isinstance(error, smtplib.SMTPRecipientsRefused) or \
+                job.attempts > self.retries:
+            self._fail(job, error)
+            return None
+        self.count('retried')
+        time.sleep(self.backoff * 2 ** (job.attempts - 1))
+        return job
+
+    def _fail(self, job, error):
+        self.count('failed')
+        self.app.logger.error('Could not deliver mail to %s: %s',
+                              ', '.join(job.msg.recipients), error)
+        job.future.set_exception(error)
+
+    def count(self, name):
+        # the workers update the counters concurrently
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queued': self.queue.qsize(),
+                'sent': self.sent,
+                'failed': self.failed,
+                'retried': self.retried,
+                'dropped': self.dropped,
+                'connections': self.connections
+            }
+
+
+class MailQueue(object):
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['mail_queue'] = MailWorkerPool(
+            app,
+            workers=app.config['FLASKY_MAIL_WORKERS'],
+            queue_size=app.config['FLASKY_MAIL_QUEUE_SIZE'],
+            put_timeout=app.config['FLASKY_MAIL_QUEUE_TIMEOUT'],
+            idle_timeout=app.config['FLASKY_MAIL_IDLE_TIMEOUT'],
+            retries=app.config['FLASKY_MAIL_RETRIES'],
+            backoff=app.config['FLASKY_MAIL_RETRY_BACKOFF'])
 
 
 def send_email(to, subject, template, **kwargs):
@@ -15,6 +164,4 @@ def send_email(to, subject, template, **kwargs):
                   sender=app.config['FLASKY_MAIL_SENDER'], recipients=[to])
     msg.body = render_template(template + '.txt', **kwargs)
     msg.html = render_template(template + '.html', **kwargs)
-    thr = Thread(target=send_async_email, args=[app, msg])
-    thr.start()
-    return thr
+    return app.extensions['mail_queue'].submit(msg)
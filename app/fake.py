@@ -1,37 +1,326 @@
-from random import randint
-from sqlalchemy.exc import IntegrityError
-from faker import Faker
-from . import db
-from .models import User, Post
-
-
-def users(count=100):
-    fake = Faker()
-    i = 0
-    while i < count:
-        u = User(email=fake.email(),
-                 username=fake.user_name(),
-                 password='password',
-                 confirmed=True,
-                 name=fake.name(),
-                 location=fake.city(),
-                 about_me=fake.text(),
-                 member_since=fake.past_date())
-        db.session.add(u)
-        try:
+import hashlib
+import itertools
+import random
+from collections import Counter
+from datetime import datetime, timedelta
+from sqlalchemy import bindparam
+from werkzeug.security import generate_password_hash
+from . import db, renderer, search_index
+from .models import User, Follow, Post, Comment, Role, Timeline, \
+    role_table
+
+PASSWORD = 'password'
+START = datetime(2017, 1, 1)
+FIRST_NAMES = ('ada', 'alan', 'barbara', 'brian', 'claude', 'dennis',
+               'donald', 'edsger', 'frances', 'grace', 'guido', 'hedy',
+               'john', 'ken', 'linus', 'margaret', 'niklaus', 'radia',
+               'richard', 'shafi', 'sophie', 'tim', 'tony', 'whitfield')
+LAST_NAMES = ('allen', 'backus', 'berners', 'dijkstra', 'hamilton',
+              'hopper', 'kay', 'kernighan', 'knuth', 'lamarr', 'liskov',
+              'lovelace', 'mccarthy', 'perlman', 'ritchie', 'rossum',
+              'shannon', 'stallman', 'thompson', 'torvalds', 'turing',
+              'wilson', 'wirth')
+WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do '
+         'eiusmod tempor incididunt ut labore et dolore magna aliqua enim ad '
+         'minim veniam quis nostrud exercitation ullamco laboris nisi aliquip '
+         'ex ea commodo consequat duis aute irure in reprehenderit voluptate '
+         'velit esse cillum eu fugiat nulla pariatur excepteur sint occaecat '
+         'cupidatat non proident sunt culpa qui officia deserunt mollit anim '
+         'id est laborum').split()
+
+
+def zipf(ids, rng, exponent=1.0):
+    """Cumulative weights giving the ids, in a random order, a popularity
+    that follows a power law: the k-th most popular id is chosen about
+    ``1 / k ** exponent`` times as often as the first."""
+    ids = list(ids)
+    rng.shuffle(ids)
+    weights = itertools.accumulate(1.0 / (rank + 1) ** exponent
+                                   for rank in range(len(ids)))
+    return ids, list(weights)
+
+
+class Generator(object):
+    """Fast generation of large, realistic datasets.
+
+    Rows are written with batched Core inserts of ``batch_size`` rows and
+    given explicit ids following the existing ones, so nothing is read
+    back. Model events do not fire for Core inserts, so the counters they
+    would maintain are tallied as rows are generated, and ``finish`` must
+    be called at the end to write them, to fan out the new posts and
+    follows to the timelines and to index the new posts and comments.
+    Only the rows this generator inserted are touched, so a batch can be
+    appended to a live dataset. The data only depends on ``seed`` and the
+    order of the calls.
+
+    Rendering Markdown is by far the slowest part, so with
+    ``distinct_bodies`` set posts and comments reuse that many different
+    bodies, each rendered once.
+    """
+    def __init__(self, seed=0, batch_size=10000, distinct_bodies=None):
+        self.rng = random.Random(seed)
+        # bodies are generated a batch ahead of the rows that use them, so
+        # they get their own generator to make the data independent of
+        # the batch size
+        self.body_rng = random.Random('bodies-{}'.format(seed))
+        self.batch_size = batch_size
+        self.distinct_bodies = distinct_bodies
+        self.counters = {
+            User: {'post_count': Counter(), 'comment_count': Counter(),
+                   'followers_count': Counter(),
+                   'followed_count': Counter()},
+            Post: {'comment_count': Counter()}
+        }
+        # id ranges of the inserted rows, and of the followers given new
+        # follows, for finish
+        self.inserted = {User: [], Post: [], Comment: []}
+        self.followers = []
+
+    @staticmethod
+    def next_id(model):
+        return (db.session.query(db.func.max(model.id)).scalar() or 0) + 1
+
+    def execute(self, statement, rows):
+        count = 0
+        while True:
+            batch = list(itertools.islice(rows, self.batch_size))
+            if not batch:
+                return count
+            db.session.execute(statement, batch)
+            db.session.commit()
+            count += len(batch)
+
+    def insert(self, table, rows):
+        return self.execute(table.insert(), rows)
+
+    def chunks(self, ranges):
+        """Yield the first and last ids of ``batch_size`` ids at a time
+        of ``ranges``."""
+        for ids in ranges:
+            for start in range(ids.start, ids.stop, self.batch_size):
+                yield start, min(start + self.batch_size, ids.stop) - 1
+
+    def text(self, sentences=3, min_words=4, max_words=16, rng=None):
+        rng = rng or self.rng
+        parts = []
+        for i in range(rng.randint(1, sentences)):
+            words = [rng.choice(WORDS) for j in range(rng.randint(
+                min_words, max_words))]
+            if rng.random() < 0.2:
+                words[0] = '*{}*'.format(words[0])
+            parts.append(' '.join(words).capitalize() + '.')
+        return ' '.join(parts)
+
+    def bodies(self, count, sentences, allowed_tags):
+        """Yield ``count`` pairs of body and rendered body, rendering a
+        batch at a time."""
+        rng = self.body_rng
+        if self.distinct_bodies:
+            texts = [self.text(sentences, rng=rng)
+                     for i in range(min(self.distinct_bodies, count))]
+            pool = list(zip(texts, renderer.render_many(texts,
+                                                        allowed_tags)))
+            for i in range(count):
+                yield rng.choice(pool)
+            return
+        for start in range(0, count, self.batch_size):
+            texts = [self.text(sentences, rng=rng)
+                     for i in range(min(self.batch_size, count - start))]
+            for pair in zip(texts, renderer.render_many(texts,
+                                                        allowed_tags)):
+                yield pair
+
+    def users(self, count):
+        """Create ``count`` confirmed users with the default role, all
+        with the password ``PASSWORD``. The roles are created if they do
+        not exist yet. Returns their ids."""
+        rng = self.rng
+        if role_table.default() is None:
+            Role.insert_roles()
+        start = self.next_id(User)
+        ids = range(start, start + count)
+        password_hash = generate_password_hash(PASSWORD)
+        role_id = role_table.default().id
+
+        def rows():
+            for id in ids:
+                first = rng.choice(FIRST_NAMES)
+                last = rng.choice(LAST_NAMES)
+                username = '{}.{}{}'.format(first, last, id)
+                email = '{}@example.com'.format(username)
+                member_since = START + timedelta(minutes=id)
+                yield {
+                    'id': id, 'username': username, 'email': email,
+                    'password_hash': password_hash, 'role_id': role_id,
+                    'confirmed': True,
+                    'name': '{} {}'.format(first.capitalize(),
+                                           last.capitalize()),
+                    'location': rng.choice(WORDS).capitalize(),
+                    'about_me': self.text(2),
+                    'member_since': member_since, 'last_seen': member_since,
+                    'updated_at': member_since,
+                    'avatar_hash': hashlib.md5(
+                        email.encode('utf-8')).hexdigest(),
+                    'token_version': 0
+                }
+
+        self.insert(User.__table__, rows())
+        self.inserted[User].append(ids)
+        return ids
+
+    def follows(self, follower_ids, user_ids, average=20):
+        """Make each of ``follower_ids`` follow itself and on average
+        ``average`` of ``user_ids``.
+
+        The number of users followed has a heavy tail, and users are
+        followed with a power law popularity, so a few have a very large
+        number of followers. Returns the number of follows created.
+        """
+        rng = self.rng
+        population, weights = zipf(user_ids, rng)
+        limit = len(population) - 1
+        followers = self.counters[User]['followers_count']
+        followed_counts = self.counters[User]['followed_count']
+
+        def rows():
+            for follower_id in follower_ids:
+                yield {'follower_id': follower_id,
+                       'followed_id': follower_id, 'timestamp': START}
+                # the mean of this Pareto distribution is 2
+                count = min(int(rng.paretovariate(2.0) * average / 2), limit)
+                followed = set()
+                # unpopular users are rarely drawn, so settle for fewer
+                # follows than asked for rather than retrying forever
+                for attempt in range(10):
+                    if len(followed) >= count:
+                        break
+                    followed.update(rng.choices(
+                        population, cum_weights=weights,
+                        k=count - len(followed)))
+                    followed.discard(follower_id)
+                followed_counts[follower_id] += len(followed) + 1
+                followers[follower_id] += 1
+                followers.update(followed)
+                for followed_id in sorted(followed):
+                    yield {'follower_id': follower_id,
+                           'followed_id': followed_id, 'timestamp': START}
+
+        count = self.insert(Follow.__table__, rows())
+        if follower_ids:
+            self.followers.append(range(min(follower_ids),
+                                        max(follower_ids) + 1))
+        return count
+
+    def posts(self, count, author_ids):
+        """Create ``count`` posts, written by ``author_ids`` with a power
+        law activity. Returns their ids."""
+        rng = self.rng
+        start = self.next_id(Post)
+        ids = range(start, start + count)
+        population, weights = zipf(author_ids, rng)
+        post_counts = self.counters[User]['post_count']
+
+        def rows():
+            bodies = self.bodies(count, 6, Post.allowed_tags)
+            for id, (body, body_html) in zip(ids, bodies):
+                timestamp = START + timedelta(minutes=id)
+                author_id = rng.choices(population, cum_weights=weights)[0]
+                post_counts[author_id] += 1
+                yield {'id': id, 'body': body, 'body_html': body_html,
+                       'timestamp': timestamp, 'updated_at': timestamp,
+                       'author_id': author_id, 'comment_count': 0}
+
+        self.insert(Post.__table__, rows())
+        self.inserted[Post].append(ids)
+        return ids
+
+    def comments(self, count, author_ids, post_ids):
+        """Create ``count`` comments, by ``author_ids`` with a power law
+        activity, on ``post_ids`` with a power law popularity. Returns
+        their ids."""
+        rng = self.rng
+        start = self.next_id(Comment)
+        ids = range(start, start + count)
+        authors, author_weights = zipf(author_ids, rng)
+        posts, post_weights = zipf(post_ids, rng)
+        user_counts = self.counters[User]['comment_count']
+        post_counts = self.counters[Post]['comment_count']
+
+        def rows():
+            bodies = self.bodies(count, 2, Comment.allowed_tags)
+            for id, (body, body_html) in zip(ids, bodies):
+                timestamp = START + timedelta(minutes=id)
+                author_id = rng.choices(authors,
+                                        cum_weights=author_weights)[0]
+                post_id = rng.choices(posts, cum_weights=post_weights)[0]
+                user_counts[author_id] += 1
+                post_counts[post_id] += 1
+                yield {'id': id, 'body': body, 'body_html': body_html,
+                       'timestamp': timestamp, 'updated_at': timestamp,
+                       'disabled': False, 'author_id': author_id,
+                       'post_id': post_id}
+
+        if post_ids:
+            self.insert(Comment.__table__, rows())
+            self.inserted[Comment].append(ids)
+            return ids
+        return range(0)
+
+    def finish(self):
+        """Update the data derived from the inserted rows."""
+        for model, counters in self.counters.items():
+            table = model.__table__
+            statement = table.update().where(
+                table.c.id == bindparam('_id')).values(
+                {name: table.c[name] + bindparam('_' + name)
+                 for name in counters})
+            ids = sorted(set().union(*counters.values()))
+            self.execute(statement, (dict(
+                {'_' + name: counter[id]
+                 for name, counter in counters.items()}, _id=id)
+                for id in ids))
+            for counter in counters.values():
+                counter.clear()
+        for column, ranges in ((Follow.follower_id, self.followers),
+                               (Post.id, self.inserted[Post])):
+            for start, end in self.chunks(ranges):
+                db.session.execute(Timeline.insert_missing(
+                    column.between(start, end)))
+                db.session.commit()
+        for model in (Post, Comment):
+            for ids in self.inserted[model]:
+                if ids:
+                    search_index.reindex(model, ids.start, ids.stop - 1,
+                                         self.batch_size)
+        if db.engine.dialect.name == 'postgresql':
+            # the explicit ids did not advance the sequences
+            for model, ranges in self.inserted.items():
+                if ranges:
+                    table = model.__table__
+                    db.session.execute(db.select([db.func.setval(
+                        db.func.pg_get_serial_sequence(table.name, 'id'),
+                        db.select([db.func.max(table.c.id)]).as_scalar())]))
             db.session.commit()
-            i += 1
-        except IntegrityError:
-            db.session.rollback()
-
-
-def posts(count=100):
-    fake = Faker()
-    user_count = User.query.count()
-    for i in range(count):
-        u = User.query.offset(randint(0, user_count - 1)).first()
-        p = Post(body=fake.text(),
-                 timestamp=fake.past_date(),
-                 author=u)
-        db.session.add(p)
-    db.session.commit()
+        self.followers = []
+        for ranges in self.inserted.values():
+            del ranges[:]
+
+
+def generate(users=100, follows=20, posts=1000, comments=2000, seed=0,
+             batch_size=10000, distinct_bodies=None):
+    """Add a dataset to the database and return the number of rows
+    created. The same arguments always produce the same data on an empty
+    database."""
+    generator = Generator(seed, batch_size, distinct_bodies)
+    user_ids = generator.users(users)
+    follow_count = generator.follows(user_ids, user_ids, follows)
+    post_ids = generator.posts(posts, user_ids)
+    comment_ids = generator.comments(comments, user_ids, post_ids)
+    generator.finish()
+    return {
+        'seed': seed,
+        'users': len(user_ids),
+        'follows': follow_count,
+        'posts': len(post_ids),
+        'comments': len(comment_ids)
+    }
@@ -0,0 +1,33 @@
+from flask import current_app, render_template
+from jinja2 import Markup
+from .cache import LRUCache
+
+
+class FragmentCache(object):
+    """In-process cache of rendered HTML fragments.
+
+    Keys must include everything the fragment depends on, such as the
+    versions of the rows it displays, so that stale entries are never
+    looked up again and simply age out of the cache.
+    """
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['fragment_cache'] = LRUCache(
+            maxsize=app.config['FLASKY_FRAGMENT_CACHE_SIZE'])
+
+    @property
+    def cache(self):
+        return current_app.extensions['fragment_cache']
+
+    def get_or_render(self, key, template, **context):
+        html = self.cache.get(key)
+        if html is None:
+            html = Markup(render_template(template, **context))
+            self.cache.set(key, html)
+        return html
+
+    def stats(self):
+        return self.cache.stats()
@@ -0,0 +1,229 @@
+import heapq
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from flask import current_app
+from sqlalchemy import func, select
+from sqlalchemy.orm import object_session
+
+
+class FollowSnapshot(object):
+    """The follow graph in compressed sparse row form.
+
+    The users followed by user ``id`` are ``targets[offsets[id]:offsets[id
+    + 1]]``, sorted, with self-follows left out. ``followers[id]`` is the
+    number of followers of ``id``. Follows added or removed after the
+    snapshot was loaded are kept in small overlays until the next rebuild.
+    """
+    def __init__(self, offsets, targets, followers):
+        self.offsets = offsets
+        self.targets = targets
+        self.followers = followers
+        self.added = {}
+        self.removed = {}
+        self.log = []
+        self.built = time.time()
+
+    @classmethod
+    def load(cls, connection, follows, batch_size=10000):
+        max_ids = connection.execute(select([
+            func.max(follows.c.follower_id),
+            func.max(follows.c.followed_id)])).first()
+        size = max(max_ids[0] or 0, max_ids[1] or 0) + 1
+        counts = array('i', [0]) * (size + 1)
+        targets = array('i')
+        followers = array('i', [0]) * size
+        result = connection.execution_options(stream_results=True).execute(
+            follows.select().with_only_columns(
+                [follows.c.follower_id, follows.c.followed_id])
+            .where(follows.c.follower_id != follows.c.followed_id)
+            .order_by(follows.c.follower_id, follows.c.followed_id))
+        while True:
+            rows = result.fetchmany(batch_size)
+            if not rows:
+                break
+            for follower_id, followed_id in rows:
+                if follower_id >= size or followed_id >= size:
+                    # followed after the maximum was read
+                    continue
+                counts[follower_id + 1] += 1
+                targets.append(followed_id)
+                followers[followed_id] += 1
+        for i in range(1, size + 1):
+            counts[i] += counts[i - 1]
+        return cls(counts, targets, followers)
+
+    def row(self, id):
+        if id + 1 >= len(self.offsets):
+            return array('i')
+        return self.targets[self.offsets[id]:self.offsets[id + 1]]
+
+    def following(self, id):
+        """Return the ids of the users followed by ``id``."""
+        row = self.row(id)
+        removed = self.removed.get(id)
+        added = self.added.get(id)
+        if not removed and not added:
+            return row
+        ids = [i for i in row if i not in removed] if removed else list(row)
+        for i in added or ():
+            j = bisect_left(row, i)
+            if j == len(row) or row[j] != i:
+                ids.append(i)
+        return ids
+
+    def follower_count(self, id):
+        return self.followers[id] if id < len(self.followers) else 0
+
+    def follow(self, follower_id, followed_id):
+        if follower_id == followed_id:
+            return
+        self.log.append((True, follower_id, followed_id))
+        self.removed.get(follower_id, set()).discard(followed_id)
+        self.added.setdefault(follower_id, set()).add(followed_id)
+
+    def unfollow(self, follower_id, followed_id):
+        if follower_id == followed_id:
+            return
+        self.log.append((False, follower_id, followed_id))
+        self.added.get(follower_id, set()).discard(followed_id)
+        self.removed.setdefault(follower_id, set()).add(followed_id)
+
+    def replay(self, changes):
+        for followed, follower_id, followed_id in changes:
+            if followed:
+                self.follow(follower_id, followed_id)
+            else:
+                self.unfollow(follower_id, followed_id)
+
+    def recommend(self, id, limit=5):
+        """Return up to ``limit`` ``(user_id, mutual)`` pairs of users
+        not followed by ``id`` but followed by ``mutual`` of the users it
+        follows, most mutual follows first and then most followers."""
+        followed = self.following(id)
+        scores = Counter()
+        for i in followed:
+            scores.update(self.following(i))
+        for i in followed:
+            scores.pop(i, None)
+        scores.pop(id, None)
+        candidates = scores.items()
+        if len(scores) > limit > 0:
+            # only break ties among the best scores
+            threshold = scores.most_common(limit)[-1][1]
+            candidates = [item for item in candidates if item[1] >= threshold]
+        return heapq.nsmallest(limit, candidates, key=lambda item: (
+            -item[1], -self.follower_count(item[0]), item[0]))
+
+
+class FollowGraph(object):
+    """Who-to-follow recommendations computed from an in-memory snapshot
+    of the follow graph.
+
+    The snapshot is loaded in a background thread on first use, with no
+    recommendations until it is ready, and rebuilt the same way once it
+    is older than ``FLASKY_FOLLOW_GRAPH_TTL`` seconds or has accumulated
+    ``FLASKY_FOLLOW_GRAPH_MAX_CHANGES`` changes. Follows made
+    through this process are recorded in the session and applied to the
+    snapshot when it commits, or dropped if it rolls back; those made by
+    other processes show up after the next rebuild.
+    """
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self.rebuilding = False
+        # changes committed while the first snapshot loads
+        self.pending = []
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['follow_graph'] = None
+
+    @staticmethod
+    def load(app):
+        db = app.extensions['sqlalchemy'].db
+        with db.get_engine(app).connect() as connection:
+            return FollowSnapshot.load(connection,
+                                       db.metadata.tables['follows'])
+
+    def rebuild(self, app=None):
+        app = app or current_app._get_current_object()
+        with self._lock:
+            self.rebuilding = True
+            old = app.extensions['follow_graph']
+            start = len(old.log) if old is not None else 0
+        snapshot = self.load(app)
+        with self._lock:
+            # keep what changed while the snapshot was loading
+            if old is not None:
+                snapshot.replay(old.log[start:])
+            snapshot.replay(self.pending)
+            self.pending = []
+            app.extensions['follow_graph'] = snapshot
+            self.rebuilding = False
+        return snapshot
+
+    def _rebuild_in_background(self, app):
+        try:
+            with app.app_context():
+                self.rebuild(app)
+        except Exception:
+            self.rebuilding = False
+            app.logger.exception('Could not rebuild the follow graph')
+
+    @property
+    def snapshot(self):
+        """The current snapshot, or ``None`` while the first one loads."""
+        app = current_app._get_current_object()
+        snapshot = app.extensions['follow_graph']
+        if snapshot is None or \
+                time.time() - snapshot.built > \
+                app.config['FLASKY_FOLLOW_GRAPH_TTL'] or \
+                len(snapshot.log) > \
+                app.config['FLASKY_FOLLOW_GRAPH_MAX_CHANGES']:
+            with self._lock:
+                if not self.rebuilding:
+                    self.rebuilding = True
+                    thread = threading.Thread(
+                        target=self._rebuild_in_background, args=(app,),
+                        name='follow-graph-rebuild')
+                    thread.daemon = True
+                    thread.start()
+        return snapshot
+
+    def recommend(self, user_id, limit=None):
+        if limit is None:
+            limit = current_app.config['FLASKY_RECOMMENDATIONS']
+        snapshot = self.snapshot
+        if snapshot is None:
+            return []
+        return snapshot.recommend(user_id, limit)
+
+    @staticmethod
+    def changes(target):
+        return object_session(target).info.setdefault('follow_changes', [])
+
+    def on_followed(self, mapper, connection, target):
+        self.changes(target).append(
+            (True, target.follower_id, target.followed_id))
+
+    def on_unfollowed(self, mapper, connection, target):
+        self.changes(target).append(
+            (False, target.follower_id, target.followed_id))
+
+    def on_commit(self, session):
+        changes = session.info.pop('follow_changes', None)
+        if not changes:
+            return
+        with self._lock:
+            snapshot = current_app.extensions.get('follow_graph')
+            if snapshot is not None:
+                snapshot.replay(changes)
+            elif self.rebuilding:
+                self.pending.extend(changes)
+
+    @staticmethod
+    def on_rollback(session):
+        session.info.pop('follow_changes', None)
@@ -1,11 +1,30 @@
 from flask import Blueprint
+from flask_login import current_user
 
 main = Blueprint('main', __name__)
 
 from . import views, errors
+from .. import fragment_cache
 from ..models import Permission
 
 
+def viewer_class(post):
+    if current_user.is_authenticated and current_user.id == post.author_id:
+        return 'author'
+    if current_user.is_administrator():
+        return 'admin'
+    return 'other'
+
+
+def render_post(post):
+    """Render one entry of a post list, reusing the cached HTML while the
+    post and its author are unchanged."""
+    viewer = viewer_class(post)
+    key = ('post', post.id, post.updated_at, post.author.updated_at, viewer)
+    return fragment_cache.get_or_render(key, '_post.html', post=post,
+                                        viewer=viewer)
+
+
 @main.app_context_processor
 def inject_permissions():
-    return dict(Permission=Permission)
+    return dict(Permission=Permission, render_post=render_post)
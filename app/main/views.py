@@ -1,13 +1,17 @@
 from flask import render_template, redirect, url_for, abort, flash, request,\
-    current_app, make_response
+    current_app, make_response, session
 from flask_login import login_required, current_user
 from flask_sqlalchemy import get_debug_queries
 from . import main
 from .forms import EditProfileForm, EditProfileAdminForm, PostForm,\
     CommentForm
-from .. import db
-from ..models import Permission, Role, User, Post, Comment
+from .. import db, search_index, server_timing, follow_graph
+from ..models import Permission, Role, User, Post, Comment, Follow, \
+    user_cache
+from ..pagination import KeysetPagination
+from ..exceptions import ValidationError
 from ..decorators import admin_required, permission_required
+from ..conditional import conditional
 
 
 @main.after_app_request
@@ -21,6 +25,14 @@ def after_request(response):
     return response
 
 
+def keyset_paginate(query, columns, cursor, per_page, **kwargs):
+    try:
+        return KeysetPagination(query, columns, cursor=cursor,
+                                per_page=per_page, **kwargs)
+    except ValidationError:
+        abort(400)
+
+
 @main.route('/shutdown')
 def server_shutdown():
     if not current_app.testing:
@@ -48,8 +60,8 @@ def index():
     if show_followed:
         query = current_user.followed_posts
     else:
-        query = Post.query
-    pagination = query.order_by(Post.timestamp.desc()).paginate(
+        query = Post.query.order_by(Post.timestamp.desc())
+    pagination = query.options(db.joinedload('author')).paginate(
         page, per_page=current_app.config['FLASKY_POSTS_PER_PAGE'],
         error_out=False)
     posts = pagination.items
@@ -59,14 +71,41 @@ def index():
 
 @main.route('/user/<username>')
 def user(username):
-    user = User.query.filter_by(username=username).first_or_404()
+    user = user_cache.get_by_username(username)
+    if user is None:
+        abort(404)
     page = request.args.get('page', 1, type=int)
-    pagination = user.posts.order_by(Post.timestamp.desc()).paginate(
-        page, per_page=current_app.config['FLASKY_POSTS_PER_PAGE'],
-        error_out=False)
+    pagination = user.posts.order_by(Post.timestamp.desc())\
+        .options(db.joinedload('author')).paginate(
+            page, per_page=current_app.config['FLASKY_POSTS_PER_PAGE'],
+            error_out=False)
     posts = pagination.items
+    recommendations = []
+    if user == current_user and current_user.can(Permission.FOLLOW):
+        for id, mutual in follow_graph.recommend(user.id):
+            recommended = user_cache.get(id)
+            if recommended is not None:
+                recommendations.append((recommended, mutual))
     return render_template('user.html', user=user, posts=posts,
-                           pagination=pagination)
+                           pagination=pagination,
+                           recommendations=recommendations)
+
+
+@main.route('/search')
+def search():
+    q = request.args.get('q', '')
+    kind = request.args.get('type', 'post')
+    if kind not in ('post', 'comment'):
+        kind = 'post'
+    try:
+        pagination = search_index.search(
+            q, kinds=[kind], cursor=request.args.get('cursor'),
+            per_page=current_app.config['FLASKY_SEARCH_RESULTS_PER_PAGE'])
+    except ValidationError:
+        abort(400)
+    items = [item for _, item in pagination.results]
+    return render_template('search.html', q=q, type=kind, posts=items,
+                           comments=items, pagination=pagination)
 
 
 @main.route('/edit-profile', methods=['GET', 'POST'])
@@ -79,6 +118,7 @@ def edit_profile():
         current_user.about_me = form.about_me.data
         db.session.add(current_user._get_current_object())
         db.session.commit()
+        user_cache.invalidate(current_user._get_current_object())
         flash('Your profile has been updated.')
         return redirect(url_for('.user', username=current_user.username))
     form.name.data = current_user.name
@@ -103,6 +143,7 @@ def edit_profile_admin(id):
         user.about_me = form.about_me.data
         db.session.add(user)
         db.session.commit()
+        user_cache.invalidate(user)
         flash('The profile has been updated.')
         return redirect(url_for('.user', username=user.username))
     form.email.data = user.email
@@ -115,9 +156,26 @@ def edit_profile_admin(id):
     return render_template('edit_profile.html', form=form, user=user)
 
 
+def post_page_version(id):
+    # the page also shows the names and avatars of the post and comment
+    # authors
+    commenters = db.session.query(Comment.author_id)\
+        .filter(Comment.post_id == Post.id)
+    authors = db.session.query(db.func.max(User.updated_at)).filter(
+        db.or_(User.id == Post.author_id, User.id.in_(commenters)))
+    return db.session.query(Post.id, Post.updated_at, authors.as_scalar())\
+        .filter(Post.id == id).first()
+
+
+def anonymous_page():
+    return current_user.is_anonymous and not session.get('_flashes')
+
+
 @main.route('/post/<int:id>', methods=['GET', 'POST'])
+@conditional(post_page_version, weak=True, when=anonymous_page,
+             vary='Cookie')
 def post(id):
-    post = Post.query.get_or_404(id)
+    post = Post.query.options(db.joinedload('author')).get_or_404(id)
     form = CommentForm()
     if form.validate_on_submit():
         comment = Comment(body=form.body.data,
@@ -129,11 +187,12 @@ def post(id):
         return redirect(url_for('.post', id=post.id, page=-1))
     page = request.args.get('page', 1, type=int)
     if page == -1:
-        page = (post.comments.count() - 1) // \
+        page = (post.comment_count - 1) // \
             current_app.config['FLASKY_COMMENTS_PER_PAGE'] + 1
-    pagination = post.comments.order_by(Comment.timestamp.asc()).paginate(
-        page, per_page=current_app.config['FLASKY_COMMENTS_PER_PAGE'],
-        error_out=False)
+    pagination = post.comments.order_by(Comment.timestamp.asc())\
+        .options(db.joinedload('author')).paginate(
+            page, per_page=current_app.config['FLASKY_COMMENTS_PER_PAGE'],
+            error_out=False)
     comments = pagination.items
     return render_template('post.html', posts=[post], form=form,
                            comments=comments, pagination=pagination)
@@ -161,7 +220,7 @@ def edit(id):
 @login_required
 @permission_required(Permission.FOLLOW)
 def follow(username):
-    user = User.query.filter_by(username=username).first()
+    user = user_cache.get_by_username(username)
     if user is None:
         flash('Invalid user.')
         return redirect(url_for('.index'))
@@ -178,7 +237,7 @@ def follow(username):
 @login_required
 @permission_required(Permission.FOLLOW)
 def unfollow(username):
-    user = User.query.filter_by(username=username).first()
+    user = user_cache.get_by_username(username)
     if user is None:
         flash('Invalid user.')
         return redirect(url_for('.index'))
@@ -193,14 +252,21 @@ def unfollow(username):
 
 @main.route('/followers/<username>')
 def followers(username):
-    user = User.query.filter_by(username=username).first()
+    user = user_cache.get_by_username(username)
     if user is None:
         flash('Invalid user.')
         return redirect(url_for('.index'))
-    page = request.args.get('page', 1, type=int)
-    pagination = user.followers.paginate(
-        page, per_page=current_app.config['FLASKY_FOLLOWERS_PER_PAGE'],
-        error_out=False)
+    cursor = request.args.get('cursor')
+    if cursor is not None:
+        pagination = keyset_paginate(
+            user.followers, (Follow.timestamp, Follow.follower_id),
+            cursor, current_app.config['FLASKY_FOLLOWERS_PER_PAGE'],
+            key=lambda item: (item.timestamp, item.follower_id))
+    else:
+        page = request.args.get('page', 1, type=int)
+        pagination = user.followers.paginate(
+            page, per_page=current_app.config['FLASKY_FOLLOWERS_PER_PAGE'],
+            error_out=False)
     follows = [{'user': item.follower, 'timestamp': item.timestamp}
                for item in pagination.items]
     return render_template('followers.html', user=user, title="Followers of",
@@ -210,14 +276,21 @@ def followers(username):
 
 @main.route('/followed_by/<username>')
 def followed_by(username):
-    user = User.query.filter_by(username=username).first()
+    user = user_cache.get_by_username(username)
     if user is None:
         flash('Invalid user.')
         return redirect(url_for('.index'))
-    page = request.args.get('page', 1, type=int)
-    pagination = user.followed.paginate(
-        page, per_page=current_app.config['FLASKY_FOLLOWERS_PER_PAGE'],
-        error_out=False)
+    cursor = request.args.get('cursor')
+    if cursor is not None:
+        pagination = keyset_paginate(
+            user.followed, (Follow.timestamp, Follow.followed_id),
+            cursor, current_app.config['FLASKY_FOLLOWERS_PER_PAGE'],
+            key=lambda item: (item.timestamp, item.followed_id))
+    else:
+        page = request.args.get('page', 1, type=int)
+        pagination = user.followed.paginate(
+            page, per_page=current_app.config['FLASKY_FOLLOWERS_PER_PAGE'],
+            error_out=False)
     follows = [{'user': item.followed, 'timestamp': item.timestamp}
                for item in pagination.items]
     return render_template('followers.html', user=user, title="Followed by",
@@ -241,17 +314,33 @@ def show_followed():
     return resp
 
 
+@main.route('/slow-requests')
+@login_required
+@admin_required
+def slow_requests():
+    return render_template('slow_requests.html',
+                           requests=server_timing.slow_requests())
+
+
 @main.route('/moderate')
 @login_required
 @permission_required(Permission.MODERATE)
 def moderate():
     page = request.args.get('page', 1, type=int)
-    pagination = Comment.query.order_by(Comment.timestamp.desc()).paginate(
-        page, per_page=current_app.config['FLASKY_COMMENTS_PER_PAGE'],
-        error_out=False)
+    cursor = request.args.get('cursor')
+    query = Comment.query.options(db.joinedload('author'))
+    if cursor is not None:
+        pagination = keyset_paginate(
+            query, (Comment.timestamp, Comment.id), cursor,
+            current_app.config['FLASKY_COMMENTS_PER_PAGE'])
+    else:
+        pagination = query.order_by(Comment.timestamp.desc())\
+            .paginate(page,
+                      per_page=current_app.config['FLASKY_COMMENTS_PER_PAGE'],
+                      error_out=False)
     comments = pagination.items
     return render_template('moderate.html', comments=comments,
-                           pagination=pagination, page=page)
+                           pagination=pagination, page=page, cursor=cursor)
 
 
 @main.route('/moderate/enable/<int:id>')
@@ -263,7 +352,8 @@ def moderate_enable(id):
     db.session.add(comment)
     db.session.commit()
     return redirect(url_for('.moderate',
-                            page=request.args.get('page', 1, type=int)))
+                            page=request.args.get('page', 1, type=int),
+                            cursor=request.args.get('cursor')))
 
 
 @main.route('/moderate/disable/<int:id>')
@@ -275,4 +365,5 @@ def moderate_disable(id):
     db.session.add(comment)
     db.session.commit()
     return redirect(url_for('.moderate',
-                            page=request.args.get('page', 1, type=int)))
+                            page=request.args.get('page', 1, type=int),
+                            cursor=request.args.get('cursor')))
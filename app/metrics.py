@@ -0,0 +1,460 @@
+import atexit
+import glob
+import ipaddress
+import json
+import os
+import resource
+import threading
+import time
+from flask import current_app, g, request, abort, before_render_template, \
+    template_rendered
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+
+
+class Metric(object):
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    def key(self, labels):
+        return json.dumps([labels[label] for label in self.labels])
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self._lock:
+            self.samples[key] = self.samples.get(key, 0) + amount
+
+    def set_total(self, value, **labels):
+        """Mirror a count maintained by another component."""
+        with self._lock:
+            self.samples[self.key(labels)] = value
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self.samples[self.key(labels)] = value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self._lock:
+            sample = self.samples.get(key)
+            if sample is None:
+                sample = self.samples[key] = {
+                    'buckets': [0] * len(self.buckets), 'sum': 0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    sample['buckets'][i] += 1
+            sample['sum'] += value
+            sample['count'] += 1
+
+
+class Registry(object):
+    """The metrics of one process.
+
+    Counters and histograms add up across processes. Gauges describe a
+    single process and are reported with a ``pid`` label, and only while
+    that process is alive. ``collectors`` are called before every snapshot
+    to update metrics that are read from other components, such as cache
+    statistics.
+    """
+    def __init__(self):
+        self.metrics = {}
+        self.collectors = []
+        self.started = time.time()
+
+    def add(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.add(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self.add(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.add(Histogram(name, help, labels, buckets))
+
+    def snapshot(self):
+        for collector in self.collectors:
+            collector(self)
+        snapshot = {'pid': os.getpid(), 'metrics': {}}
+        for metric in self.metrics.values():
+            with metric._lock:
+                samples = json.loads(json.dumps(metric.samples))
+            snapshot['metrics'][metric.name] = {
+                'type': metric.type,
+                'help': metric.help,
+                'labels': list(metric.labels),
+                'buckets': list(getattr(metric, 'buckets', ())),
+                'samples': samples
+            }
+        return snapshot
+
+
+def merge(snapshots):
+    """Combine the snapshots of several processes into one."""
+    merged = {}
+    for snapshot in snapshots:
+        for name, metric in snapshot['metrics'].items():
+            target = merged.setdefault(name, dict(metric, samples={}))
+            for key, value in metric['samples'].items():
+                if metric['type'] == 'gauge':
+                    labels = json.loads(key) + [snapshot['pid']]
+                    target['samples'][json.dumps(labels)] = value
+                elif metric['type'] == 'counter':
+                    target['samples'][key] = \
+                        target['samples'].get(key, 0) + value
+                else:
+                    sample = target['samples'].setdefault(key, {
+                        'buckets': [0] * len(value['buckets']),
+                        'sum': 0, 'count': 0})
+                    sample['buckets'] = [a + b for a, b in zip(
+                        sample['buckets'], value['buckets'])]
+                    sample['sum'] += value['sum']
+                    sample['count'] += value['count']
+    for metric in merged.values():
+        if metric['type'] == 'gauge':
+            metric['labels'] = metric['labels'] + ['pid']
+    return merged
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n')\
+        .replace('"', r'\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, _escape(value))
+                          for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def exposition(metrics):
+    """Render merged metrics in the Prometheus text format."""
+    lines = []
+    for name in sorted(metrics):
+        metric = metrics[name]
+        lines.append('# HELP {} {}'.format(name, metric['help']))
+        lines.append('# TYPE {} {}'.format(name, metric['type']))
+        for key in sorted(metric['samples']):
+            values = json.loads(key)
+            sample = metric['samples'][key]
+            if metric['type'] != 'histogram':
+                lines.append('{}{} {}'.format(
+                    name, _labels(metric['labels'], values), _number(sample)))
+                continue
+            for bound, count in zip(metric['buckets'], sample['buckets']):
+                lines.append('{}_bucket{} {}'.format(
+                    name, _labels(metric['labels'], values,
+                                  ('le', _number(float(bound)))), count))
+            lines.append('{}_bucket{} {}'.format(
+                name, _labels(metric['labels'], values, ('le', '+Inf')),
+                sample['count']))
+            lines.append('{}_sum{} {}'.format(
+                name, _labels(metric['labels'], values),
+                _number(float(sample['sum']))))
+            lines.append('{}_count{} {}'.format(
+                name, _labels(metric['labels'], values), sample['count']))
+    return '\n'.join(lines) + '\n'
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def prune(directory):
+    """Remove the snapshots of workers that are no longer running, and
+    the one an earlier process with the same pid as this one left."""
+    for path in glob.glob(os.path.join(directory, 'metrics-*.json')):
+        try:
+            with open(path) as f:
+                pid = json.load(f)['pid']
+        except (OSError, ValueError, KeyError):
+            continue
+        if pid == os.getpid() or not _alive(pid):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+class Metrics(object):
+    """Request, database, connection pool, template, cache, compression
+    and worker metrics, served in the Prometheus text format at
+    ``/metrics``.
+
+    With several worker processes each one writes its snapshot to a file
+    in ``FLASKY_METRICS_DIR`` at most every ``FLASKY_METRICS_FLUSH_INTERVAL``
+    seconds and when it exits; ``/metrics`` combines the files of all
+    workers, so any worker can answer the scrape. The files of workers
+    that are no longer running are removed when the application starts.
+    Only clients in ``FLASKY_METRICS_ALLOWED_NETWORKS`` can read them.
+    """
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not app.config['FLASKY_METRICS']:
+            return
+        registry = app.extensions['metrics'] = Registry()
+        registry.app = app
+        registry.directory = app.config['FLASKY_METRICS_DIR']
+        registry.flush_interval = app.config['FLASKY_METRICS_FLUSH_INTERVAL']
+        registry.flushed = 0
+        networks = app.config['FLASKY_METRICS_ALLOWED_NETWORKS']
+        registry.allowed = None if networks is None else \
+            [ipaddress.ip_network(network) for network in networks]
+        registry.requests = registry.counter(
+            'flasky_requests_total', 'Requests handled.',
+            ('endpoint', 'method', 'status'))
+        registry.request_duration = registry.histogram(
+            'flasky_request_duration_seconds', 'Request latency.',
+            ('endpoint',))
+        registry.db_queries = registry.histogram(
+            'flasky_db_queries_per_request',
+            'Database queries issued per request.', ('endpoint',),
+            buckets=QUERY_COUNT_BUCKETS)
+        registry.db_duration = registry.histogram(
+            'flasky_db_duration_seconds',
+            'Time spent in database queries per request.', ('endpoint',))
+        registry.template_duration = registry.histogram(
+            'flasky_template_render_seconds', 'Template render time.',
+            ('template',))
+        registry.collectors.append(collect_caches)
+        registry.collectors.append(collect_worker)
+        registry.counter('flasky_cache_hits_total', 'Cache hits.',
+                         ('cache',))
+        registry.counter('flasky_cache_misses_total', 'Cache misses.',
+                         ('cache',))
+        registry.gauge('flasky_cache_entries', 'Entries in a cache.',
+                       ('cache',))
+        registry.gauge('flasky_worker_uptime_seconds',
+                       'Time since the worker started.')
+        registry.gauge('flasky_worker_max_rss_bytes',
+                       'Peak resident memory of the worker.')
+        registry.gauge('flasky_worker_threads', 'Threads in the worker.')
+        registry.gauge('flasky_mail_queue_length', 'Messages waiting to be '
+                       'sent.')
+        registry.counter('flasky_mail_dropped_total', 'Messages not sent '
+                         'because the mail queue was full.')
+        registry.gauge('flasky_last_seen_pending', 'Buffered last seen '
+                       'updates.')
+        registry.collectors.append(collect_compression)
+        registry.counter('flasky_compression_responses_total',
+                         'Responses compressed.')
+        registry.counter('flasky_compression_bytes_in_total',
+                         'Size of the responses before compression.')
+        registry.counter('flasky_compression_bytes_out_total',
+                         'Size of the responses after compression.')
+        registry.counter('flasky_compression_cpu_seconds_total',
+                         'Time spent compressing responses.')
+        registry.collectors.append(collect_pools)
+        registry.gauge('flasky_db_pool_checked_out',
+                       'Database connections in use.', ('database',))
+        registry.gauge('flasky_db_pool_size', 'Connections kept open by '
+                       'the pool.', ('database',))
+        registry.gauge('flasky_db_pool_max_overflow', 'Connections the pool '
+                       'opens beyond its size when busy.', ('database',))
+        registry.counter('flasky_db_pool_checkouts_total',
+                         'Connections taken from the pool.', ('database',))
+        registry.counter('flasky_db_pool_wait_seconds_total',
+                         'Time spent getting a connection from the pool.',
+                         ('database',))
+        registry.counter('flasky_db_pool_overflows_total',
+                         'Connections opened beyond the pool size.',
+                         ('database',))
+        registry.counter('flasky_db_pool_timeouts_total',
+                         'Requests for a connection that timed out.',
+                         ('database',))
+        registry.counter('flasky_db_pool_disconnects_total',
+                         'Dead connections found by the liveness check.',
+                         ('database',))
+
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.add_url_rule('/metrics', 'metrics', self.view)
+        before_render_template.connect(self.before_render, app)
+        template_rendered.connect(self.after_render, app)
+        if registry.directory:
+            prune(registry.directory)
+            atexit.register(self.write, registry)
+
+    @staticmethod
+    def before_request():
+        g.metrics_start = time.time()
+
+    def after_request(self, response):
+        start = g.pop('metrics_start', None)
+        if start is None:
+            return response
+        registry = current_app.extensions['metrics']
+        endpoint = request.endpoint or 'none'
+        registry.requests.inc(endpoint=endpoint, method=request.method,
+                              status=response.status_code)
+        registry.request_duration.observe(time.time() - start,
+                                          endpoint=endpoint)
+        # database time is collected by the server timing breakdown
+        db_time, db_queries = g.get('server_timing', {}).get('db', (0.0, 0))
+        registry.db_queries.observe(db_queries, endpoint=endpoint)
+        registry.db_duration.observe(db_time, endpoint=endpoint)
+        if registry.directory and \
+                time.time() - registry.flushed > registry.flush_interval:
+            self.write(registry)
+        return response
+
+    @staticmethod
+    def before_render(app, template, context):
+        g.setdefault('metrics_templates', []).append(time.time())
+
+    @staticmethod
+    def after_render(app, template, context):
+        starts = g.get('metrics_templates')
+        if starts:
+            app.extensions['metrics'].template_duration.observe(
+                time.time() - starts.pop(), template=template.name)
+
+    @staticmethod
+    def write(registry):
+        registry.flushed = time.time()
+        path = os.path.join(registry.directory,
+                            'metrics-{}.json'.format(os.getpid()))
+        with open(path + '.tmp', 'w') as f:
+            json.dump(registry.snapshot(), f)
+        os.replace(path + '.tmp', path)
+
+    def collect(self):
+        registry = current_app.extensions['metrics']
+        if not registry.directory:
+            return merge([registry.snapshot()])
+        self.write(registry)
+        snapshots = []
+        for path in glob.glob(os.path.join(registry.directory,
+                                           'metrics-*.json')):
+            try:
+                with open(path) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if not _alive(snapshot['pid']):
+                # the totals of workers that exited still count
+                for metric in snapshot['metrics'].values():
+                    if metric['type'] == 'gauge':
+                        metric['samples'] = {}
+            snapshots.append(snapshot)
+        return merge(snapshots)
+
+    def view(self):
+        allowed = current_app.extensions['metrics'].allowed
+        if allowed is not None:
+            address = ipaddress.ip_address(request.remote_addr)
+            if not any(address in network for network in allowed):
+                abort(404)
+        return current_app.response_class(
+            exposition(self.collect()),
+            mimetype='text/plain; version=0.0.4')
+
+
+def collect_caches(registry):
+    app = registry.app
+    caches = {name: app.extensions[name].stats()
+              for name in ('user_cache', 'token_versions', 'fragment_cache',
+                           'renderer') if app.extensions.get(name)}
+    for name, stats in caches.items():
+        registry.metrics['flasky_cache_hits_total'].set_total(
+            stats['hits'], cache=name)
+        registry.metrics['flasky_cache_misses_total'].set_total(
+            stats['misses'], cache=name)
+        registry.metrics['flasky_cache_entries'].set(stats['size'],
+                                                     cache=name)
+
+
+def collect_worker(registry):
+    app = registry.app
+    registry.metrics['flasky_worker_uptime_seconds'].set(
+        time.time() - registry.started)
+    # ru_maxrss is in kilobytes on Linux
+    registry.metrics['flasky_worker_max_rss_bytes'].set(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024)
+    registry.metrics['flasky_worker_threads'].set(threading.active_count())
+    if 'mail_queue' in app.extensions:
+        stats = app.extensions['mail_queue'].stats()
+        registry.metrics['flasky_mail_queue_length'].set(stats['queued'])
+        registry.metrics['flasky_mail_dropped_total'].set_total(
+            stats['dropped'])
+    if 'presence' in app.extensions:
+        registry.metrics['flasky_last_seen_pending'].set(
+            app.extensions['presence'].stats()['pending'])
+
+
+def collect_compression(registry):
+    compression = registry.app.extensions.get('compression')
+    if compression is None:
+        return
+    stats = compression.stats()
+    for name, key in (('responses', 'responses'),
+                      ('bytes_in', 'bytes_in'),
+                      ('bytes_out', 'bytes_out'),
+                      ('cpu_seconds', 'seconds')):
+        registry.metrics['flasky_compression_{}_total'.format(name)]\
+            .set_total(stats[key])
+
+
+def collect_pools(registry):
+    pools = registry.app.extensions.get('db_pools') or {}
+    for database, monitor in list(pools.items()):
+        stats = monitor.stats()
+        registry.metrics['flasky_db_pool_checked_out'].set(
+            stats['checked_out'], database=database)
+        if stats['size'] is not None:
+            registry.metrics['flasky_db_pool_size'].set(
+                stats['size'], database=database)
+            registry.metrics['flasky_db_pool_max_overflow'].set(
+                stats['max_overflow'], database=database)
+        for name, key in (('checkouts', 'checkouts'),
+                          ('wait_seconds', 'wait_time'),
+                          ('overflows', 'overflows'),
+                          ('timeouts', 'timeouts'),
+                          ('disconnects', 'disconnects')):
+            registry.metrics['flasky_db_pool_{}_total'.format(name)]\
+                .set_total(stats[key], database=database)
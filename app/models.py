@@ -1,13 +1,18 @@
+from collections import namedtuple
 from datetime import datetime
 import hashlib
+import time
 from werkzeug.security import generate_password_hash, check_password_hash
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
-from markdown import markdown
-import bleach
 from flask import current_app, request, url_for
 from flask_login import UserMixin, AnonymousUserMixin
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
 from app.exceptions import ValidationError
-from . import db, login_manager
+from app.cache import LRUCache
+from app.timing import timed
+from . import db, login_manager, renderer, token_versions, search_index, \
+    follow_graph
 
 
 class Permission:
@@ -18,6 +23,47 @@ class Permission:
     ADMIN = 16
 
 
+def after_transaction(f, *args):
+    """Call ``f(*args)`` once the transaction of the session commits or
+    rolls back.
+
+    Caches dropped during a flush can be refilled before the commit,
+    from rows other connections do not see yet or from rows that will be
+    rolled back, so they are dropped again at the end of the transaction.
+    """
+    db.session().info.setdefault('after_transaction', set()).add((f, args))
+
+
+def run_after_transaction(session):
+    for f, args in session.info.pop('after_transaction', ()):
+        f(*args)
+
+
+db.event.listen(db.session, 'after_commit', run_after_transaction)
+db.event.listen(db.session, 'after_rollback', run_after_transaction)
+
+
+# counters shown in representations that are cached or exported by
+# updated_at; the others change too often to invalidate them
+PUBLISHED_COUNTERS = {'users': {'post_count'}, 'posts': {'comment_count'}}
+
+
+def update_counters(connection, table, id, **deltas):
+    if id is None:
+        return
+    values = {table.c[name]: table.c[name] + delta
+              for name, delta in deltas.items()}
+    if PUBLISHED_COUNTERS.get(table.name, set()).intersection(deltas):
+        values[table.c.updated_at] = datetime.utcnow()
+    else:
+        # keep the column out of its onupdate default
+        values[table.c.updated_at] = table.c.updated_at
+    connection.execute(table.update().where(table.c.id == id).values(values))
+    if table.name == 'users':
+        user_cache.invalidate(id)
+        after_transaction(user_cache.invalidate, id)
+
+
 class Role(db.Model):
     __tablename__ = 'roles'
     id = db.Column(db.Integer, primary_key=True)
@@ -33,6 +79,8 @@ class Role(db.Model):
 
     @staticmethod
     def insert_roles():
+        """Create or update the roles. Returns ``False`` without writing
+        anything when they are already up to date."""
         roles = {
             'User': [Permission.FOLLOW, Permission.COMMENT, Permission.WRITE],
             'Moderator': [Permission.FOLLOW, Permission.COMMENT,
@@ -42,6 +90,13 @@ class Role(db.Model):
                               Permission.ADMIN],
         }
         default_role = 'User'
+        expected = {(r, sum(perms), r == default_role)
+                    for r, perms in roles.items()}
+        current = set(db.session.query(Role.name, Role.permissions,
+                                       Role.default)
+                      .filter(Role.name.in_(roles)))
+        if current == expected:
+            return False
         for r in roles:
             role = Role.query.filter_by(name=r).first()
             if role is None:
@@ -52,6 +107,25 @@ class Role(db.Model):
             role.default = (role.name == default_role)
             db.session.add(role)
         db.session.commit()
+        return True
+
+    @staticmethod
+    def on_changed(mapper, connection, target):
+        after_transaction(role_table.invalidate)
+
+    @staticmethod
+    def on_updated(mapper, connection, target):
+        state = db.inspect(target)
+        # roles are also flushed when only their users backref changed
+        if state.session.is_modified(target, include_collections=False):
+            after_transaction(role_table.invalidate)
+        if state.attrs.permissions.history.has_changes():
+            users = User.__table__
+            connection.execute(users.update().where(
+                users.c.role_id == target.id).values(
+                token_version=users.c.token_version + 1))
+            token_versions.invalidate()
+            after_transaction(token_versions.invalidate)
 
     def add_permission(self, perm):
         if not self.has_permission(perm):
@@ -71,6 +145,69 @@ class Role(db.Model):
         return '<Role %r>' % self.name
 
 
+db.event.listen(Role, 'after_insert', Role.on_changed)
+db.event.listen(Role, 'after_delete', Role.on_changed)
+db.event.listen(Role, 'after_update', Role.on_updated)
+
+
+RoleEntry = namedtuple('RoleEntry', ['id', 'name', 'default', 'permissions'])
+
+
+class RoleTable(object):
+    """Read-only snapshot of the ``roles`` table.
+
+    The snapshot is loaded on first use and dropped when a transaction
+    that inserted, updated or deleted a role ends, so permission checks
+    are dictionary lookups that never touch the database. Changes made by
+    other processes are picked up after ``FLASKY_ROLE_TABLE_TTL`` seconds.
+    """
+    @property
+    def snapshot(self):
+        snapshot = current_app.extensions.get('role_table')
+        ttl = current_app.config['FLASKY_ROLE_TABLE_TTL']
+        if snapshot is None or \
+                (ttl is not None and snapshot[0] + ttl < time.time()):
+            roles = db.session.query(Role.id, Role.name, Role.default,
+                                     Role.permissions).all()
+            by_id = {role.id: RoleEntry(*role) for role in roles}
+            snapshot = current_app.extensions['role_table'] = (
+                time.time(), by_id,
+                {role.name: role for role in by_id.values()})
+        return snapshot
+
+    def get(self, id):
+        return self.snapshot[1].get(id)
+
+    def find(self, name):
+        return self.snapshot[2].get(name)
+
+    def default(self):
+        for role in self.snapshot[1].values():
+            if role.default:
+                return role
+
+    def permissions(self, id):
+        role = self.get(id)
+        return role.permissions or 0 if role is not None else 0
+
+    def role(self, entry):
+        """Return the ``Role`` for a table entry, attached to the current
+        session without a query."""
+        if entry is None:
+            return None
+        role = Role.__mapper__.class_manager.new_instance()
+        for key, value in entry._asdict().items():
+            set_committed_value(role, key, value)
+        make_transient_to_detached(role)
+        return db.session.merge(role, load=False)
+
+    def invalidate(self):
+        current_app.extensions.pop('role_table', None)
+
+
+role_table = RoleTable()
+
+
 class Follow(db.Model):
     __tablename__ = 'follows'
     follower_id = db.Column(db.Integer, db.ForeignKey('users.id'),
@@ -78,6 +215,34 @@ class Follow(db.Model):
     followed_id = db.Column(db.Integer, db.ForeignKey('users.id'),
                             primary_key=True)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    __table_args__ = (
+        db.Index('ix_follows_followed_timestamp', 'followed_id', 'timestamp',
+                 'follower_id'),
+    )
+
+    @staticmethod
+    def on_inserted(mapper, connection, target):
+        users = User.__table__
+        update_counters(connection, users, target.follower_id,
+                        followed_count=1)
+        update_counters(connection, users, target.followed_id,
+                        followers_count=1)
+
+    @staticmethod
+    def on_deleted(mapper, connection, target):
+        users = User.__table__
+        update_counters(connection, users, target.follower_id,
+                        followed_count=-1)
+        update_counters(connection, users, target.followed_id,
+                        followers_count=-1)
+
+
+db.event.listen(Follow, 'after_insert', Follow.on_inserted)
+db.event.listen(Follow, 'after_delete', Follow.on_deleted)
+db.event.listen(Follow, 'after_insert', follow_graph.on_followed)
+db.event.listen(Follow, 'after_delete', follow_graph.on_unfollowed)
+db.event.listen(db.session, 'after_commit', follow_graph.on_commit)
+db.event.listen(db.session, 'after_rollback', follow_graph.on_rollback)
 
 
 class User(UserMixin, db.Model):
@@ -94,6 +259,13 @@ class User(UserMixin, db.Model):
     member_since = db.Column(db.DateTime(), default=datetime.utcnow)
     last_seen = db.Column(db.DateTime(), default=datetime.utcnow)
     avatar_hash = db.Column(db.String(32))
+    post_count = db.Column(db.Integer, default=0)
+    comment_count = db.Column(db.Integer, default=0)
+    followers_count = db.Column(db.Integer, default=0)
+    followed_count = db.Column(db.Integer, default=0)
+    token_version = db.Column(db.Integer, default=0)
+    updated_at = db.Column(db.DateTime(), default=datetime.utcnow,
+                           onupdate=datetime.utcnow)
     posts = db.relationship('Post', backref='author', lazy='dynamic')
     followed = db.relationship('Follow',
                                foreign_keys=[Follow.follower_id],
@@ -108,20 +280,78 @@ class User(UserMixin, db.Model):
     comments = db.relationship('Comment', backref='author', lazy='dynamic')
 
     @staticmethod
-    def add_self_follows():
-        for user in User.query.all():
-            if not user.is_following(user):
-                user.follow(user)
-                db.session.add(user)
-                db.session.commit()
+    def add_self_follows(chunk_size=10000):
+        """Make users who do not follow themselves do so, updating their
+        counters and timelines as ``follow`` would, with a few set based
+        statements per ``chunk_size`` users. Returns the number of users
+        fixed, after a single query when there is nothing to do."""
+        users = User.__table__
+        timelines = Timeline.__table__
+        unfollowed = ~db.exists().where(db.and_(
+            Follow.follower_id == users.c.id,
+            Follow.followed_id == users.c.id))
+        if db.session.execute(db.select([users.c.id]).where(unfollowed)
+                              .limit(1)).first() is None:
+            return 0
+        fixed = 0
+        max_id = db.session.query(db.func.max(User.id)).scalar() or 0
+        for start in range(0, max_id + 1, chunk_size):
+            chunk = users.c.id.between(start, start + chunk_size - 1)
+            now = datetime.utcnow()
+            # counters first, while the missing follows can still be told
+            # apart
+            fixed += db.session.execute(users.update().where(
+                db.and_(chunk, unfollowed)).values({
+                    users.c.followers_count: users.c.followers_count + 1,
+                    users.c.followed_count: users.c.followed_count + 1,
+                    users.c.updated_at: now})).rowcount
+            db.session.execute(Follow.__table__.insert().from_select(
+                ['follower_id', 'followed_id', 'timestamp'],
+                db.select([users.c.id, users.c.id.label('followed_id'),
+                           db.literal(now, db.DateTime)])
+                .where(db.and_(chunk, unfollowed))))
+            db.session.execute(Timeline.insert_from(
+                Timeline.fan_out_query().where(db.and_(
+                    Follow.follower_id.between(start,
+                                               start + chunk_size - 1),
+                    Follow.followed_id == Follow.follower_id,
+                    ~db.exists().where(db.and_(
+                        timelines.c.user_id == Follow.follower_id,
+                        timelines.c.post_id == Post.id))))))
+            db.session.commit()
+        if fixed:
+            user_cache.cache.clear()
+        return fixed
+
+    @staticmethod
+    def version(id):
+        return db.session.query(User.id, User.updated_at, User.last_seen)\
+            .filter_by(id=id).first()
+
+    @staticmethod
+    def recount(chunk_size=1000):
+        count = db.select([db.func.count()])
+        counts = {
+            'post_count': count.where(Post.author_id == User.id),
+            'comment_count': count.where(Comment.author_id == User.id),
+            'followers_count': count.where(Follow.followed_id == User.id),
+            'followed_count': count.where(Follow.follower_id == User.id)
+        }
+        values = {name: query.as_scalar() for name, query in counts.items()}
+        max_id = db.session.query(db.func.max(User.id)).scalar() or 0
+        for start in range(0, max_id + 1, chunk_size):
+            db.session.execute(User.__table__.update().where(
+                User.id.between(start, start + chunk_size - 1))
+                .values(values))
+            db.session.commit()
 
     def __init__(self, **kwargs):
         super(User, self).__init__(**kwargs)
-        if self.role is None:
+        if self.role is None and self.role_id is None:
+            entry = None
             if self.email == current_app.config['FLASKY_ADMIN']:
-                self.role = Role.query.filter_by(name='Administrator').first()
-            if self.role is None:
-                self.role = Role.query.filter_by(default=True).first()
+                entry = role_table.find('Administrator')
+            self.role = role_table.role(entry or role_table.default())
         if self.email is not None and self.avatar_hash is None:
             self.avatar_hash = self.gravatar_hash()
         self.follow(self)
@@ -194,8 +424,17 @@ class User(UserMixin, db.Model):
         db.session.add(self)
         return True
 
+    @property
+    def permissions(self):
+        # a role assigned in this transaction takes precedence over the
+        # role_id column, which is only updated on flush
+        if 'role' in self.__dict__:
+            role = self.__dict__['role']
+            return role.permissions or 0 if role is not None else 0
+        return role_table.permissions(self.role_id)
+
     def can(self, perm):
-        return self.role is not None and self.role.has_permission(perm)
+        return self.permissions & perm == perm
 
     def is_administrator(self):
         return self.can(Permission.ADMIN)
@@ -237,9 +476,11 @@ class User(UserMixin, db.Model):
 
     @property
     def followed_posts(self):
-        return Post.query.join(Follow, Follow.followed_id == Post.author_id)\
-            .filter(Follow.follower_id == self.id)
+        return Post.query.join(Timeline, Timeline.post_id == Post.id)\
+            .filter(Timeline.user_id == self.id)\
+            .order_by(Timeline.timestamp.desc(), Timeline.post_id.desc())
 
+    @timed('serialize')
     def to_json(self):
         json_user = {
             'url': url_for('api.get_user', id=self.id),
@@ -249,14 +490,19 @@ class User(UserMixin, db.Model):
             'posts_url': url_for('api.get_user_posts', id=self.id),
             'followed_posts_url': url_for('api.get_user_followed_posts',
                                           id=self.id),
-            'post_count': self.posts.count()
+            'post_count': self.post_count
         }
         return json_user
 
     def generate_auth_token(self, expiration):
         s = Serializer(current_app.config['SECRET_KEY'],
                        expires_in=expiration)
-        return s.dumps({'id': self.id}).decode('utf-8')
+        return s.dumps({
+            'id': self.id,
+            'confirmed': bool(self.confirmed),
+            'permissions': self.permissions,
+            'version': self.token_version or 0
+        }).decode('utf-8')
 
     @staticmethod
     def verify_auth_token(token):
@@ -265,12 +511,41 @@ class User(UserMixin, db.Model):
             data = s.loads(token)
         except:
             return None
-        return User.query.get(data['id'])
+        if 'version' not in data:
+            return User.query.get(data['id'])
+        version = token_versions.get(data['id'], User.load_token_version)
+        if version is None or version != data['version']:
+            return None
+        return TokenUser(data)
+
+    @staticmethod
+    def load_token_version(id):
+        return db.session.query(User.token_version).filter_by(id=id)\
+            .scalar()
+
+    @staticmethod
+    def on_update(mapper, connection, target):
+        state = db.inspect(target)
+        for attr in ('role', 'role_id', 'confirmed', 'password_hash'):
+            if state.attrs[attr].history.has_changes():
+                target.token_version = (target.token_version or 0) + 1
+                return
+
+    @staticmethod
+    def on_updated(mapper, connection, target):
+        token_versions.invalidate(target.id)
+        user_cache.invalidate(target)
+        after_transaction(token_versions.invalidate, target.id)
+        after_transaction(user_cache.invalidate, target.id)
 
     def __repr__(self):
         return '<User %r>' % self.username
 
 
+db.event.listen(User, 'before_update', User.on_update)
+db.event.listen(User, 'after_update', User.on_updated)
+
+
 class AnonymousUser(AnonymousUserMixin):
     def can(self, permissions):
         return False
@@ -281,9 +556,118 @@ class AnonymousUser(AnonymousUserMixin):
 login_manager.anonymous_user = AnonymousUser
 
 
+class TokenUser(object):
+    """Identity and permissions carried by a verified API token.
+
+    Permission checks are answered from the token itself. Any other
+    attribute is delegated to the ``User`` row, which is only loaded when
+    one is accessed.
+    """
+    is_anonymous = False
+    is_authenticated = True
+
+    def __init__(self, data):
+        self.id = data['id']
+        self.confirmed = data['confirmed']
+        self.permissions = data['permissions']
+        self._user = None
+
+    def can(self, perm):
+        return self.permissions & perm == perm
+
+    def is_administrator(self):
+        return self.can(Permission.ADMIN)
+
+    def _get_current_object(self):
+        if self._user is None:
+            self._user = User.query.get(self.id)
+        return self._user
+
+    def __getattr__(self, name):
+        return getattr(self._get_current_object(), name)
+
+    def __eq__(self, other):
+        return isinstance(other, (User, TokenUser)) and other.id == self.id
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self.id)
+
+
+class UserCache(object):
+    """Per-process TTL and LRU cache of user rows, addressable by id,
+    username or email.
+
+    Only column values are cached. Lookups return a ``User`` merged into
+    the current session without emitting a query, so the result behaves
+    like a freshly loaded user.
+    """
+    @property
+    def cache(self):
+        cache = current_app.extensions.get('user_cache')
+        if cache is None:
+            cache = current_app.extensions['user_cache'] = LRUCache(
+                maxsize=current_app.config['FLASKY_USER_CACHE_SIZE'],
+                ttl=current_app.config['FLASKY_USER_CACHE_TTL'])
+        return cache
+
+    def get(self, id):
+        data = self.cache.get(id)
+        if data is None:
+            return self._store(User.query.get(id))
+        user = User.__mapper__.class_manager.new_instance()
+        for key, value in data.items():
+            set_committed_value(user, key, value)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+    def get_by_username(self, username):
+        return self._get_by('username', username)
+
+    def get_by_email(self, email):
+        return self._get_by('email', email)
+
+    def _get_by(self, attr, value):
+        id = self.cache.get((attr, value))
+        if id is not None:
+            return self.get(id)
+        return self._store(User.query.filter_by(**{attr: value}).first())
+
+    def _store(self, user):
+        if user is not None:
+            state = db.inspect(user)
+            if state.modified:
+                return user
+            self.cache.set(user.id, {
+                attr.key: state.dict[attr.key]
+                for attr in User.__mapper__.column_attrs
+                if attr.key in state.dict})
+            self.cache.set(('username', user.username), user.id)
+            self.cache.set(('email', user.email), user.id)
+        return user
+
+    def invalidate(self, user):
+        id = getattr(user, 'id', user)
+        data = self.cache.peek(id)
+        self.cache.delete(id)
+        for attr in ('username', 'email'):
+            for owner in (data, getattr(user, '__dict__', None)):
+                if owner and owner.get(attr) is not None:
+                    self.cache.delete((attr, owner[attr]))
+
+    def stats(self):
+        return self.cache.stats()
+
+
+user_cache = UserCache()
+
+
 @login_manager.user_loader
+@timed('auth')
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return user_cache.get(int(user_id))
 
 
 class Post(db.Model):
@@ -293,17 +677,50 @@ class Post(db.Model):
     body_html = db.Column(db.Text)
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     author_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    comment_count = db.Column(db.Integer, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow,
+                           onupdate=datetime.utcnow)
     comments = db.relationship('Comment', backref='post', lazy='dynamic')
+    __table_args__ = (
+        db.Index('ix_posts_author_timestamp', 'author_id', 'timestamp', 'id'),
+    )
+    allowed_tags = ['a', 'abbr', 'acronym', 'b', 'blockquote', 'code',
+                    'em', 'i', 'li', 'ol', 'pre', 'strong', 'ul',
+                    'h1', 'h2', 'h3', 'p']
 
     @staticmethod
     def on_changed_body(target, value, oldvalue, initiator):
-        allowed_tags = ['a', 'abbr', 'acronym', 'b', 'blockquote', 'code',
-                        'em', 'i', 'li', 'ol', 'pre', 'strong', 'ul',
-                        'h1', 'h2', 'h3', 'p']
-        target.body_html = bleach.linkify(bleach.clean(
-            markdown(value, output_format='html'),
-            tags=allowed_tags, strip=True))
+        if value == oldvalue and target.body_html is not None:
+            return
+        target.body_html = renderer.render(value, Post.allowed_tags)
+
+    @staticmethod
+    def on_inserted(mapper, connection, target):
+        update_counters(connection, User.__table__, target.author_id,
+                        post_count=1)
+
+    @staticmethod
+    def on_deleted(mapper, connection, target):
+        update_counters(connection, User.__table__, target.author_id,
+                        post_count=-1)
+
+    @staticmethod
+    def version(id):
+        return db.session.query(Post.id, Post.updated_at)\
+            .filter_by(id=id).first()
 
+    @staticmethod
+    def recount(chunk_size=1000):
+        comment_count = db.select([db.func.count()])\
+            .where(Comment.post_id == Post.id).as_scalar()
+        max_id = db.session.query(db.func.max(Post.id)).scalar() or 0
+        for start in range(0, max_id + 1, chunk_size):
+            db.session.execute(Post.__table__.update().where(
+                Post.id.between(start, start + chunk_size - 1))
+                .values(comment_count=comment_count))
+            db.session.commit()
+
+    @timed('serialize')
     def to_json(self):
         json_post = {
             'url': url_for('api.get_post', id=self.id),
@@ -312,7 +729,7 @@ class Post(db.Model):
             'timestamp': self.timestamp,
             'author_url': url_for('api.get_user', id=self.author_id),
             'comments_url': url_for('api.get_post_comments', id=self.id),
-            'comment_count': self.comments.count()
+            'comment_count': self.comment_count
         }
         return json_post
 
@@ -324,7 +741,91 @@ class Post(db.Model):
         return Post(body=body)
 
 
-db.event.listen(Post.body, 'set', Post.on_changed_body)
+db.event.listen(Post.body, 'set', Post.on_changed_body,
+                active_history=True)
+db.event.listen(Post, 'after_insert', Post.on_inserted)
+db.event.listen(Post, 'after_delete', Post.on_deleted)
+
+
+class Timeline(db.Model):
+    __tablename__ = 'timelines'
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'),
+                        primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'),
+                        primary_key=True)
+    timestamp = db.Column(db.DateTime)
+    __table_args__ = (
+        db.Index('ix_timelines_user_timestamp', 'user_id', 'timestamp',
+                 'post_id'),
+    )
+
+    @staticmethod
+    def fan_out_query():
+        return db.select([Follow.follower_id, Post.id, Post.timestamp])\
+            .where(Follow.followed_id == Post.author_id)
+
+    @staticmethod
+    def insert_from(query):
+        return Timeline.__table__.insert().from_select(
+            ['user_id', 'post_id', 'timestamp'], query)
+
+    @staticmethod
+    def insert_missing(condition):
+        """Insert the timeline rows of the posts and follows matching
+        ``condition`` that are not there yet."""
+        timelines = Timeline.__table__
+        return Timeline.insert_from(Timeline.fan_out_query().where(db.and_(
+            condition,
+            ~db.exists().where(db.and_(
+                timelines.c.user_id == Follow.follower_id,
+                timelines.c.post_id == Post.id)))))
+
+    @staticmethod
+    def on_post_inserted(mapper, connection, target):
+        connection.execute(Timeline.insert_from(
+            Timeline.fan_out_query().where(Post.id == target.id)))
+
+    @staticmethod
+    def on_post_deleted(mapper, connection, target):
+        connection.execute(Timeline.__table__.delete().where(
+            Timeline.post_id == target.id))
+
+    @staticmethod
+    def on_follow_inserted(mapper, connection, target):
+        connection.execute(Timeline.insert_from(
+            Timeline.fan_out_query().where(db.and_(
+                Follow.follower_id == target.follower_id,
+                Follow.followed_id == target.followed_id))))
+
+    @staticmethod
+    def on_follow_deleted(mapper, connection, target):
+        posts = db.select([Post.id]).where(
+            Post.author_id == target.followed_id)
+        connection.execute(Timeline.__table__.delete().where(db.and_(
+            Timeline.user_id == target.follower_id,
+            Timeline.post_id.in_(posts))))
+
+    @staticmethod
+    def rebuild(chunk_size=1000):
+        """Recompute the timelines ``chunk_size`` users at a time. Each
+        chunk is replaced in its own transaction, so the other users keep
+        their timelines meanwhile, and rows fanned out concurrently by new
+        posts and follows are left alone."""
+        timelines = Timeline.__table__
+        max_id = db.session.query(db.func.max(User.id)).scalar() or 0
+        for start in range(0, max_id + 1, chunk_size):
+            end = start + chunk_size - 1
+            db.session.execute(timelines.delete().where(
+                timelines.c.user_id.between(start, end)))
+            db.session.execute(Timeline.insert_missing(
+                Follow.follower_id.between(start, end)))
+            db.session.commit()
+
+
+db.event.listen(Post, 'after_insert', Timeline.on_post_inserted)
+db.event.listen(Post, 'after_delete', Timeline.on_post_deleted)
+db.event.listen(Follow, 'after_insert', Timeline.on_follow_inserted)
+db.event.listen(Follow, 'after_delete', Timeline.on_follow_deleted)
 
 
 class Comment(db.Model):
@@ -336,15 +837,25 @@ class Comment(db.Model):
     disabled = db.Column(db.Boolean)
     author_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     post_id = db.Column(db.Integer, db.ForeignKey('posts.id'))
+    updated_at = db.Column(db.DateTime, index=True, default=datetime.utcnow,
+                           onupdate=datetime.utcnow)
+    __table_args__ = (
+        db.Index('ix_comments_post_timestamp', 'post_id', 'timestamp', 'id'),
+    )
+    allowed_tags = ['a', 'abbr', 'acronym', 'b', 'code', 'em', 'i', 'strong']
+
+    @staticmethod
+    def version(id):
+        return db.session.query(Comment.id, Comment.updated_at)\
+            .filter_by(id=id).first()
 
     @staticmethod
     def on_changed_body(target, value, oldvalue, initiator):
-        allowed_tags = ['a', 'abbr', 'acronym', 'b', 'code', 'em', 'i',
-                        'strong']
-        target.body_html = bleach.linkify(bleach.clean(
-            markdown(value, output_format='html'),
-            tags=allowed_tags, strip=True))
+        if value == oldvalue and target.body_html is not None:
+            return
+        target.body_html = renderer.render(value, Comment.allowed_tags)
 
+    @timed('serialize')
     def to_json(self):
         json_comment = {
             'url': url_for('api.get_comment', id=self.id),
@@ -363,5 +874,38 @@ class Comment(db.Model):
             raise ValidationError('comment does not have a body')
         return Comment(body=body)
 
+    @staticmethod
+    def on_inserted(mapper, connection, target):
+        update_counters(connection, User.__table__, target.author_id,
+                        comment_count=1)
+        update_counters(connection, Post.__table__, target.post_id,
+                        comment_count=1)
+
+    @staticmethod
+    def on_deleted(mapper, connection, target):
+        update_counters(connection, User.__table__, target.author_id,
+                        comment_count=-1)
+        update_counters(connection, Post.__table__, target.post_id,
+                        comment_count=-1)
 
-db.event.listen(Comment.body, 'set', Comment.on_changed_body)
+    @staticmethod
+    def on_updated(mapper, connection, target):
+        # the post page shows its comments, so moderating a comment
+        # changes the post as well
+        if db.inspect(target).session.is_modified(
+                target, include_collections=False):
+            posts = Post.__table__
+            connection.execute(posts.update().where(
+                posts.c.id == target.post_id).values(
+                updated_at=datetime.utcnow()))
+
+
+db.event.listen(Comment.body, 'set', Comment.on_changed_body,
+                active_history=True)
+db.event.listen(Comment, 'after_insert', Comment.on_inserted)
+db.event.listen(Comment, 'after_delete', Comment.on_deleted)
+db.event.listen(Comment, 'after_update', Comment.on_updated)
+
+
+search_index.register(Post, 'post')
+search_index.register(Comment, 'comment', lambda: Comment.disabled.isnot(True))
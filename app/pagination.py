@@ -0,0 +1,125 @@
+import base64
+import json
+from datetime import datetime
+from app.exceptions import ValidationError
+from . import db
+
+CURSOR_TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def encode_cursor(direction, values):
+    key = []
+    for value in values:
+        if isinstance(value, datetime):
+            key.append({'t': value.strftime(CURSOR_TIMESTAMP_FORMAT)})
+        else:
+            key.append(value)
+    data = json.dumps([direction, key], separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode(
+        'ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        data = base64.urlsafe_b64decode(
+            (cursor + '=' * (-len(cursor) % 4)).encode('ascii'))
+        direction, key = json.loads(data.decode('utf-8'))
+        values = []
+        for value in key:
+            if isinstance(value, dict):
+                value = datetime.strptime(value['t'],
+                                          CURSOR_TIMESTAMP_FORMAT)
+            values.append(value)
+    except (ValueError, TypeError, KeyError, UnicodeError):
+        raise ValidationError('invalid cursor')
+    if direction not in ('next', 'prev'):
+        raise ValidationError('invalid cursor')
+    return direction, values
+
+
+def check_cursor_value(column, value):
+    """Return ``value`` as the Python type of ``column``, raising
+    ``ValidationError`` if a decoded cursor value does not fit it."""
+    if isinstance(value, bool) or \
+            not isinstance(value, (int, float, str, datetime)):
+        raise ValidationError('invalid cursor')
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return value
+    if python_type is float and isinstance(value, int):
+        return float(value)
+    if not isinstance(value, python_type):
+        raise ValidationError('invalid cursor')
+    return value
+
+
+class KeysetPagination(object):
+    """Pagination over a query ordered by a unique key such as
+    ``(timestamp, id)``.
+
+    Instead of an offset the position in the result set is carried in an
+    opaque cursor, so every page is fetched with the same indexed range
+    scan regardless of how deep into the results it is. The total number
+    of items is only counted when ``count`` is set.
+    """
+    is_keyset = True
+
+    def __init__(self, query, columns, cursor=None, per_page=20,
+                 descending=True, key=None, count=False):
+        self.columns = columns
+        self.descending = descending
+        self.per_page = per_page
+        self.key = key or (lambda item: (item.timestamp, item.id))
+        self.total = query.order_by(None).count() if count else None
+
+        direction, values = 'next', None
+        if cursor:
+            direction, values = decode_cursor(cursor)
+            if len(values) != len(columns):
+                raise ValidationError('invalid cursor')
+            values = [check_cursor_value(column, value)
+                      for column, value in zip(columns, values)]
+        backwards = direction == 'prev'
+        query = query.order_by(None).order_by(*self._ordering(backwards))
+        if values is not None:
+            query = query.filter(self._after(values, backwards))
+        items = query.limit(per_page + 1).all()
+        more = len(items) > per_page
+        self.items = items[:per_page]
+        if backwards:
+            self.items.reverse()
+            self.has_prev = more
+            self.has_next = bool(self.items)
+        else:
+            self.has_prev = values is not None and bool(self.items)
+            self.has_next = more
+
+    def _ordering(self, backwards):
+        if self.descending != backwards:
+            return [column.desc() for column in self.columns]
+        return [column.asc() for column in self.columns]
+
+    def _after(self, values, backwards):
+        before = self.descending != backwards
+        clauses = []
+        for i, column in enumerate(self.columns):
+            clause = [c == v for c, v in zip(self.columns[:i], values[:i])]
+            if before:
+                clause.append(column < values[i])
+            else:
+                clause.append(column > values[i])
+            clauses.append(db.and_(*clause))
+        return db.or_(*clauses)
+
+    @property
+    def next_cursor(self):
+        if not self.has_next:
+            return None
+        return encode_cursor('next', self.key(self.items[-1]))
+
+    @property
+    def prev_cursor(self):
+        if not self.has_prev:
+            return None
+        return encode_cursor('prev', self.key(self.items[0]))
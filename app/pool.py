@@ -0,0 +1,110 @@
+import threading
+import time
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+
+
+class PoolMonitor(object):
+    """Statistics of the connection pool of one database, and a cheap
+    liveness check of the connections taken from it.
+
+    With ``pre_ping`` a connection that sat in the pool for more than
+    ``ping_after`` seconds runs ``SELECT 1`` when it is checked out. If
+    that fails the pool replaces it, instead of handing out a connection
+    that a database failover or an idle timeout closed. Connections in
+    constant use are not pinged.
+    """
+    def __init__(self, pre_ping=True, ping_after=10, size=None,
+                 max_overflow=None):
+        self.pre_ping = pre_ping
+        self.ping_after = ping_after
+        self.size = size
+        self.max_overflow = max_overflow
+        self.checked_out = 0
+        self.checkouts = 0
+        self.wait_time = 0.0
+        self.overflows = 0
+        self.timeouts = 0
+        self.disconnects = 0
+        self._lock = threading.Lock()
+
+    def events(self):
+        """Pool event listeners, as expected by the ``pool_events``
+        argument of ``create_engine``."""
+        return [(self.on_checkout, 'checkout'), (self.on_checkin, 'checkin')]
+
+    def on_checkout(self, dbapi_connection, connection_record,
+                    connection_proxy):
+        checked_in = connection_record.info.get('checked_in')
+        if self.pre_ping and checked_in is not None and \
+                time.time() - checked_in > self.ping_after:
+            self.ping(dbapi_connection)
+        with self._lock:
+            self.checked_out += 1
+            self.checkouts += 1
+
+    def on_checkin(self, dbapi_connection, connection_record):
+        connection_record.info['checked_in'] = time.time()
+        with self._lock:
+            self.checked_out -= 1
+
+    def ping(self, dbapi_connection):
+        try:
+            cursor = dbapi_connection.cursor()
+            cursor.execute('SELECT 1')
+            cursor.close()
+        except Exception:
+            with self._lock:
+                self.disconnects += 1
+            # the pool discards the connection and checks out another one
+            raise exc.DisconnectionError()
+
+    def waited(self, seconds, overflow=False):
+        with self._lock:
+            self.wait_time += seconds
+            if overflow:
+                self.overflows += 1
+
+    def timed_out(self, seconds):
+        with self._lock:
+            self.wait_time += seconds
+            self.timeouts += 1
+
+    def stats(self):
+        with self._lock:
+            return {'checked_out': self.checked_out,
+                    'checkouts': self.checkouts,
+                    'wait_time': self.wait_time,
+                    'overflows': self.overflows,
+                    'timeouts': self.timeouts,
+                    'disconnects': self.disconnects,
+                    'size': self.size,
+                    'max_overflow': self.max_overflow}
+
+
+class MonitoredQueuePool(QueuePool):
+    """``QueuePool`` telling a ``PoolMonitor`` how long getting each
+    connection took, opening a new one included, whether it had to go
+    beyond ``pool_size`` and when it timed out."""
+    def __init__(self, creator, monitor=None, **kwargs):
+        QueuePool.__init__(self, creator, **kwargs)
+        self.monitor = monitor
+
+    def recreate(self):
+        pool = QueuePool.recreate(self)
+        pool.monitor = self.monitor
+        return pool
+
+    def _do_get(self):
+        if self.monitor is None:
+            return QueuePool._do_get(self)
+        start = time.perf_counter()
+        overflow = self.overflow()
+        try:
+            connection = QueuePool._do_get(self)
+        except exc.TimeoutError:
+            self.monitor.timed_out(time.perf_counter() - start)
+            raise
+        self.monitor.waited(time.perf_counter() - start,
+                            self.overflow() > max(overflow, 0))
+        return connection
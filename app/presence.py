@@ -0,0 +1,117 @@
+import atexit
+import threading
+import time
+from datetime import datetime, timedelta
+from flask import current_app, has_app_context
+from sqlalchemy import bindparam
+from .cache import LRUCache
+
+
+class LastSeenTracker(object):
+    """Write-behind buffer for ``User.last_seen``.
+
+    Requests only record the time a user was seen in memory, and only when
+    the stored value is more than ``granularity`` seconds old. A
+    background thread writes the buffered timestamps to the database every
+    ``interval`` seconds with batched UPDATE statements.
+    """
+    def __init__(self, app, granularity=60, interval=10, batch_size=500):
+        self.app = app
+        self.granularity = timedelta(seconds=granularity)
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pending = {}
+        self.flushed = LRUCache(maxsize=100000)
+        self.writes = 0
+        self.thread = None
+        self._lock = threading.Lock()
+
+    def touch(self, user):
+        now = datetime.utcnow()
+        with self._lock:
+            if user.id in self.pending:
+                self.pending[user.id] = now
+                return
+        last_seen = self.flushed.get(user.id) or user.last_seen
+        if last_seen is not None and now - last_seen < self.granularity:
+            return
+        with self._lock:
+            self.pending[user.id] = now
+        self.start()
+
+    def start(self):
+        with self._lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self._run,
+                                           name='last-seen-flusher')
+            self.thread.daemon = True
+            self.thread.start()
+        atexit.register(self._safe_flush)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self._safe_flush()
+
+    def _safe_flush(self):
+        try:
+            self.flush()
+        except Exception:
+            self.app.logger.exception('Could not update last seen times')
+
+    def flush(self):
+        with self._lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return 0
+        db = self.app.extensions['sqlalchemy'].db
+        users = db.metadata.tables['users']
+        stmt = users.update().where(users.c.id == bindparam('_id'))\
+            .values(last_seen=bindparam('_last_seen'))
+        rows = [{'_id': id, '_last_seen': last_seen}
+                for id, last_seen in pending.items()]
+        if has_app_context():
+            engine = db.get_engine(self.app)
+        else:
+            # flushes from the timer thread and at exit run outside of the
+            # application context that looking up the engine may need
+            with self.app.app_context():
+                engine = db.get_engine(self.app)
+        try:
+            with engine.begin() as conn:
+                for i in range(0, len(rows), self.batch_size):
+                    conn.execute(stmt, rows[i:i + self.batch_size])
+        except Exception:
+            # put the timestamps back unless newer ones were recorded
+            with self._lock:
+                for id, last_seen in pending.items():
+                    self.pending.setdefault(id, last_seen)
+            raise
+        for id, last_seen in pending.items():
+            self.flushed.set(id, last_seen)
+        self.writes += len(rows)
+        return len(rows)
+
+    def stats(self):
+        return {'pending': len(self.pending), 'writes': self.writes}
+
+
+class Presence(object):
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['presence'] = LastSeenTracker(
+            app,
+            granularity=app.config['FLASKY_LAST_SEEN_GRANULARITY'],
+            interval=app.config['FLASKY_LAST_SEEN_FLUSH_INTERVAL'],
+            batch_size=app.config['FLASKY_LAST_SEEN_BATCH_SIZE'])
+
+    @property
+    def tracker(self):
+        return current_app.extensions['presence']
+
+    def touch(self, user):
+        self.tracker.touch(user)
@@ -0,0 +1,105 @@
+import hashlib
+from markdown import markdown, Markdown
+import bleach
+from bleach.linkifier import Linker
+from bleach.sanitizer import Cleaner
+from werkzeug.urls import url_parse
+from .cache import LRUCache
+from .timing import timed
+
+
+def shared_cache(url):
+    """Build a cache shared between processes from a URL such as
+    ``redis://localhost:6379/0`` or ``memcached://localhost:11211``."""
+    from werkzeug.contrib.cache import RedisCache, MemcachedCache
+    url = url_parse(url)
+    if url.scheme == 'redis':
+        return RedisCache(host=url.host or 'localhost',
+                          port=url.port or 6379,
+                          password=url.password,
+                          db=int(url.path.strip('/') or 0),
+                          key_prefix='flasky-render:', default_timeout=0)
+    if url.scheme == 'memcached':
+        return MemcachedCache(
+            ['{}:{}'.format(url.host or 'localhost', url.port or 11211)],
+            key_prefix='flasky-render:', default_timeout=0)
+    raise ValueError('unsupported render cache URL: ' + url.to_url())
+
+
+class Renderer(object):
+    """Markdown to sanitized HTML rendering with a content-addressed cache.
+
+    Rendered HTML is keyed by a hash of the source text and the set of
+    allowed tags, so a body is only rendered once per process no matter
+    how many times it is assigned. An optional shared backend lets
+    processes reuse each other's work.
+    """
+    def __init__(self, app=None):
+        self.cache = LRUCache()
+        self.backend = None
+        self.backend_hits = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['renderer'] = self
+        self.cache = LRUCache(app.config['FLASKY_RENDER_CACHE_SIZE'])
+        self.backend = None
+        self.backend_hits = 0
+        if app.config['FLASKY_RENDER_CACHE_URL']:
+            self.backend = shared_cache(app.config['FLASKY_RENDER_CACHE_URL'])
+
+    @staticmethod
+    def cache_key(body, allowed_tags):
+        data = '\0'.join(sorted(allowed_tags)) + '\0\0' + body
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+    def render(self, body, allowed_tags):
+        key = self.cache_key(body, allowed_tags)
+        html = self.cache.get(key)
+        if html is not None:
+            return html
+        if self.backend is not None:
+            try:
+                html = self.backend.get(key)
+            except Exception:
+                html = None
+            if html is not None:
+                self.backend_hits += 1
+                self.cache.set(key, html)
+                return html
+        with timed('markdown'):
+            html = bleach.linkify(bleach.clean(
+                markdown(body, output_format='html'),
+                tags=allowed_tags, strip=True))
+        self.cache.set(key, html)
+        if self.backend is not None:
+            try:
+                self.backend.set(key, html)
+            except Exception:
+                pass
+        return html
+
+    def render_many(self, bodies, allowed_tags):
+        """Render a batch of bodies, sharing one Markdown converter and
+        one sanitizer between them instead of building new ones for each
+        body as ``render`` does."""
+        converter = Markdown(output_format='html')
+        cleaner = Cleaner(tags=allowed_tags, strip=True)
+        linker = Linker()
+        results = []
+        for body in bodies:
+            key = self.cache_key(body, allowed_tags)
+            html = self.cache.get(key)
+            if html is None:
+                with timed('markdown'):
+                    html = linker.linkify(cleaner.clean(
+                        converter.reset().convert(body)))
+                self.cache.set(key, html)
+            results.append(html)
+        return results
+
+    def stats(self):
+        stats = self.cache.stats()
+        stats['backend_hits'] = self.backend_hits
+        return stats
@@ -0,0 +1,127 @@
+import random
+import time
+from flask import g, has_request_context, request, session
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import event, orm
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.sql.expression import SelectBase, UpdateBase
+from .cache import LRUCache
+from .pool import PoolMonitor, MonitoredQueuePool
+
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class RoutingSession(SignallingSession):
+    """Session that sends the reads of read-only requests to a replica.
+
+    ``FLASKY_READ_REPLICAS`` lists the keys of the replica databases in
+    ``SQLALCHEMY_BINDS``. Queries only go to a replica while handling a
+    GET, HEAD or OPTIONS request; writes, other requests and code running
+    outside of a request always use the primary. Writing also makes the
+    client stick to the primary for ``FLASKY_REPLICA_LAG`` seconds, for
+    the rest of the request and the requests that follow, so that users
+    see their own changes even while the replicas are behind.
+
+    Authenticated users, including API clients that keep no cookies, are
+    remembered by id in ``app.extensions['db_writers']``, a cache of this
+    process; anonymous clients get a timestamp in their session cookie.
+    """
+    def get_bind(self, mapper=None, clause=None):
+        if isinstance(clause, UpdateBase):
+            self.wrote()
+        elif isinstance(clause, SelectBase) and self.reads_from_replica(
+                mapper):
+            return self.replica()
+        return SignallingSession.get_bind(self, mapper, clause)
+
+    def reads_from_replica(self, mapper=None):
+        if not self.app.config['FLASKY_READ_REPLICAS'] or \
+                not has_request_context() or \
+                request.method not in READ_METHODS:
+            return False
+        if mapper is not None and \
+                mapper.mapped_table.info.get('bind_key') is not None:
+            return False
+        user_id = self.user_id()
+        if user_id is not None and \
+                self.app.extensions['db_writers'].get(user_id):
+            return False
+        return session.get('_primary_until', 0) < time.time()
+
+    @staticmethod
+    def user_id():
+        user = g.get('current_user')
+        if user is not None:
+            return None if user.is_anonymous else user.id
+        # set by Flask-Login, readable before the user is loaded
+        user_id = session.get('user_id')
+        return int(user_id) if user_id is not None else None
+
+    def replica(self):
+        replicas = self.app.config['FLASKY_READ_REPLICAS']
+        key = self.info.get('replica')
+        if key not in replicas:
+            # one replica per session, for consistent reads
+            key = self.info['replica'] = random.choice(replicas)
+        return get_state(self.app).db.get_engine(self.app, bind=key)
+
+    def wrote(self):
+        if not self.app.config['FLASKY_READ_REPLICAS'] or \
+                not has_request_context():
+            return
+        user_id = self.user_id()
+        if user_id is not None:
+            self.app.extensions['db_writers'].set(user_id, True)
+        else:
+            session['_primary_until'] = time.time() + \
+                self.app.config['FLASKY_REPLICA_LAG']
+
+
+@event.listens_for(RoutingSession, 'before_flush')
+def _before_flush(db_session, flush_context, instances):
+    db_session.wrote()
+
+
+def bind_name(app, url):
+    """Return the key of the database at ``url`` in ``SQLALCHEMY_BINDS``,
+    or ``'primary'``."""
+    uri = app.config['SQLALCHEMY_DATABASE_URI']
+    if uri is not None and make_url(uri) == url:
+        return 'primary'
+    for key, uri in (app.config.get('SQLALCHEMY_BINDS') or {}).items():
+        if make_url(uri) == url:
+            return key
+    return url.database or url.drivername
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy with replica routing sessions and monitored
+    connection pools. The ``PoolMonitor`` of each database is kept in
+    ``app.extensions['db_pools']`` under its bind name."""
+    def init_app(self, app):
+        app.extensions['db_pools'] = {}
+        app.extensions['db_writers'] = LRUCache(
+            maxsize=app.config['FLASKY_REPLICA_WRITERS'],
+            ttl=app.config['FLASKY_REPLICA_LAG'])
+        SQLAlchemy.init_app(self, app)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, info, options):
+        name = bind_name(app, info)
+        if info.drivername.startswith('sqlite'):
+            # SQLite connections cannot be shared between threads, so
+            # SQLite keeps the pools Flask-SQLAlchemy picks for it
+            for key in ('pool_size', 'max_overflow', 'pool_timeout'):
+                options.pop(key, None)
+        SQLAlchemy.apply_driver_hacks(self, app, info, options)
+        monitor = PoolMonitor(app.config['FLASKY_POOL_PRE_PING'],
+                              app.config['FLASKY_POOL_PING_IDLE_TIME'])
+        if 'poolclass' not in options:
+            options['poolclass'] = MonitoredQueuePool
+            options['monitor'] = monitor
+            monitor.size = options.setdefault('pool_size', 5)
+            monitor.max_overflow = options.setdefault('max_overflow', 5)
+        options['pool_events'] = monitor.events()
+        app.extensions['db_pools'][name] = monitor
@@ -0,0 +1,194 @@
+import re
+from flask import current_app
+from sqlalchemy import DDL, event, func, literal, literal_column, select, \
+    table, column, union_all, Float
+
+
+def parse_terms(q):
+    return re.findall(r'\w+', q or '', re.UNICODE)
+
+
+class FTS5Backend(object):
+    """Search backed by one SQLite FTS5 virtual table per indexed model,
+    named ``<table>_search``, keyed by the row id of the model and ranked
+    with bm25."""
+    name = 'fts5'
+
+    def table(self, model):
+        return table('{}_search'.format(model.__tablename__),
+                     column('rowid'), column('body'))
+
+    def index(self, connection, model, id, body):
+        index = self.table(model)
+        connection.execute(index.delete().where(index.c.rowid == id))
+        if body:
+            connection.execute(index.insert().values(rowid=id, body=body))
+
+    def remove(self, connection, model, id):
+        index = self.table(model)
+        connection.execute(index.delete().where(index.c.rowid == id))
+
+    def select(self, model, kind, terms, where=None):
+        index = self.table(model)
+        match = ' '.join('"{}"'.format(term) for term in terms)
+        query = select([literal(kind).label('kind'),
+                        index.c.rowid.label('id'),
+                        func.bm25(literal_column(index.name)).label('rank')])\
+            .where(literal_column(index.name).op('MATCH')(match))
+        if where is not None:
+            query = query.where(index.c.rowid.in_(
+                select([model.id]).where(where)))
+        return query
+
+    def rebuild(self, connection, model, start, end):
+        index = self.table(model)
+        connection.execute(index.delete().where(
+            index.c.rowid.between(start, end)))
+        connection.execute(index.insert().from_select(
+            ['rowid', 'body'],
+            select([model.id, model.body]).where(
+                model.id.between(start, end))))
+
+
+class LikeBackend(object):
+    """Fallback for databases without a full-text index. Every term must
+    appear in the body; results are not ranked."""
+    name = 'like'
+
+    def index(self, connection, model, id, body):
+        pass
+
+    def remove(self, connection, model, id):
+        pass
+
+    def select(self, model, kind, terms, where=None):
+        query = select([literal(kind).label('kind'), model.id.label('id'),
+                        literal(0.0, Float).label('rank')])
+        for term in terms:
+            term = term.replace('\\', '\\\\').replace('%', '\\%') \
+                .replace('_', '\\_')
+            query = query.where(
+                model.body.ilike('%{}%'.format(term), escape='\\'))
+        if where is not None:
+            query = query.where(where)
+        return query
+
+    def rebuild(self, connection, model, start, end):
+        pass
+
+
+class Search(object):
+    """Full-text search over the ``body`` of registered models.
+
+    The backend is chosen with ``FLASKY_SEARCH_BACKEND``; by default FTS5
+    is used on SQLite and the LIKE fallback everywhere else. Further
+    backends can be added to ``backends``. Index entries are written on
+    the flush connection whenever a registered body changes, so the index
+    commits or rolls back together with the rows.
+    """
+    backends = {'fts5': FTS5Backend, 'like': LikeBackend}
+
+    def __init__(self, app=None):
+        self.models = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['search'] = None
+
+    @property
+    def backend(self):
+        backend = current_app.extensions['search']
+        if backend is None:
+            name = current_app.config['FLASKY_SEARCH_BACKEND']
+            if name is None:
+                db = current_app.extensions['sqlalchemy'].db
+                name = 'fts5' if db.get_engine().dialect.name == 'sqlite' \
+                    else 'like'
+            backend = current_app.extensions['search'] = \
+                self.backends[name]()
+        return backend
+
+    def register(self, model, kind, where=None):
+        """Index ``model.body`` under ``kind``. ``where`` is an optional
+        callable returning a clause that search results must satisfy."""
+        self.models[kind] = (model, where)
+        name = '{}_search'.format(model.__tablename__)
+        event.listen(model.__table__, 'after_create', DDL(
+            "CREATE VIRTUAL TABLE {} USING fts5(body, "
+            "tokenize='porter unicode61')".format(name)).execute_if(
+            dialect='sqlite'))
+        event.listen(model.__table__, 'before_drop', DDL(
+            'DROP TABLE IF EXISTS {}'.format(name)).execute_if(
+            dialect='sqlite'))
+        event.listen(model.body, 'set', self.on_changed_body)
+        event.listen(model, 'after_insert', self.on_flushed)
+        event.listen(model, 'after_update', self.on_flushed)
+        event.listen(model, 'after_delete', self.on_deleted)
+
+    @staticmethod
+    def on_changed_body(target, value, oldvalue, initiator):
+        if value != oldvalue:
+            target._search_changed = True
+
+    def on_flushed(self, mapper, connection, target):
+        if target.__dict__.pop('_search_changed', False):
+            self.backend.index(connection, mapper.class_, target.id,
+                               target.body)
+
+    def on_deleted(self, mapper, connection, target):
+        self.backend.remove(connection, mapper.class_, target.id)
+
+    def search(self, q, kinds=None, cursor=None, per_page=20, count=False):
+        """Return a ``KeysetPagination`` of ``(rank, kind, id)`` rows
+        matching all the words in ``q``, best matches first, with the
+        matching objects in its ``results`` attribute as ``(kind, object)``
+        pairs."""
+        from .pagination import KeysetPagination
+        db = current_app.extensions['sqlalchemy'].db
+        terms = parse_terms(q)
+        kinds = kinds or sorted(self.models)
+        selects = []
+        for kind in kinds:
+            model, where = self.models[kind]
+            if not terms:
+                selects.append(select([
+                    literal(kind).label('kind'), model.id.label('id'),
+                    literal(0.0, Float).label('rank')]).where(literal(False)))
+                continue
+            selects.append(self.backend.select(
+                model, kind, terms, where() if where is not None else None))
+        results = union_all(*selects).alias('results') \
+            if len(selects) > 1 else selects[0].alias('results')
+        columns = (results.c.rank, results.c.kind, results.c.id)
+        pagination = KeysetPagination(
+            db.session.query(*columns), columns, cursor=cursor,
+            per_page=per_page, descending=False,
+            key=lambda row: (row.rank, row.kind, row.id), count=count)
+        objects = {}
+        for kind in kinds:
+            model = self.models[kind][0]
+            ids = [row.id for row in pagination.items if row.kind == kind]
+            if ids:
+                objects.update(((kind, item.id), item) for item in
+                               model.query.filter(model.id.in_(ids))
+                               .options(db.joinedload('author')))
+        pagination.results = [(row.kind, objects[row.kind, row.id])
+                              for row in pagination.items
+                              if (row.kind, row.id) in objects]
+        return pagination
+
+    def rebuild(self, chunk_size=1000):
+        db = current_app.extensions['sqlalchemy'].db
+        for model, where in self.models.values():
+            max_id = db.session.query(func.max(model.id)).scalar() or 0
+            self.reindex(model, 0, max_id, chunk_size)
+
+    def reindex(self, model, start, end, chunk_size=1000):
+        """Index the rows of ``model`` with ids from ``start`` to ``end``
+        again, ``chunk_size`` rows at a time."""
+        db = current_app.extensions['sqlalchemy'].db
+        for first in range(start, end + 1, chunk_size):
+            self.backend.rebuild(db.session.connection(), model, first,
+                                 min(first + chunk_size - 1, end))
+            db.session.commit()
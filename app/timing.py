@@ -0,0 +1,157 @@
+import time
+from collections import deque
+from datetime import datetime
+from functools import wraps
+from flask import current_app, g, request, has_app_context, \
+    before_render_template, template_rendered
+from flask_login import current_user
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+def record(name, seconds, count=1):
+    """Add time spent on ``name`` to the breakdown of the current
+    request."""
+    if not has_app_context():
+        return
+    timings = g.get('server_timing')
+    if timings is not None:
+        entry = timings.setdefault(name, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += count
+
+
+class timed(object):
+    """Record the time spent in a block or function under ``name``.
+
+    Can be used as ``with timed('name'):`` or as a decorator.
+    """
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record(self.name, time.perf_counter() - self.start)
+
+    def __call__(self, f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            with timed(self.name):
+                return f(*args, **kwargs)
+        return decorated_function
+
+
+def timed_encoder(base):
+    class TimedJSONEncoder(base):
+        def encode(self, o):
+            with timed('serialize'):
+                return super(TimedJSONEncoder, self).encode(o)
+    return TimedJSONEncoder
+
+
+class ServerTiming(object):
+    """Per-request breakdown of where time was spent.
+
+    Authentication, database queries, template rendering, Markdown
+    rendering and JSON serialization are timed for every request. The
+    breakdown is sent in a ``Server-Timing`` header to everyone when
+    ``FLASKY_SERVER_TIMING`` is set and to administrators otherwise.
+    Requests slower than ``FLASKY_SLOW_REQUEST_TIME`` seconds are kept in
+    a buffer of the last ``FLASKY_SLOW_REQUEST_LOG_SIZE`` entries, which
+    is off when the size is 0. The buffer keeps the URL rule and the
+    names of the query arguments rather than the URL, which can carry
+    confirmation and reset tokens. Phases can overlap, since templates
+    may issue queries.
+    """
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['slow_requests'] = deque(
+            maxlen=app.config['FLASKY_SLOW_REQUEST_LOG_SIZE'])
+        app.json_encoder = timed_encoder(app.json_encoder)
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        before_render_template.connect(self.before_render, app)
+        template_rendered.connect(self.after_render, app)
+
+    @staticmethod
+    def before_request():
+        g.server_timing_start = time.perf_counter()
+        g.server_timing = {}
+
+    @staticmethod
+    def before_render(app, template, context):
+        g.setdefault('server_timing_templates', []).append(
+            time.perf_counter())
+
+    @staticmethod
+    def after_render(app, template, context):
+        starts = g.get('server_timing_templates')
+        if starts:
+            # included templates are part of the outer render
+            start = starts.pop()
+            if not starts:
+                record('template', time.perf_counter() - start)
+
+    def after_request(self, response):
+        start = g.get('server_timing_start')
+        if start is None:
+            return response
+        total = time.perf_counter() - start
+        timings = g.server_timing
+        if current_app.config['FLASKY_SERVER_TIMING'] or \
+                self.is_administrator():
+            response.headers['Server-Timing'] = self.header(timings, total)
+        if current_app.config['FLASKY_SLOW_REQUEST_LOG_SIZE'] and \
+                total >= current_app.config['FLASKY_SLOW_REQUEST_TIME']:
+            rule = request.url_rule
+            current_app.extensions['slow_requests'].append({
+                'timestamp': datetime.utcnow(),
+                'method': request.method,
+                'path': rule.rule if rule is not None else None,
+                'args': sorted(request.args),
+                'endpoint': request.endpoint,
+                'status': response.status_code,
+                'duration': total,
+                'timings': dict(timings)
+            })
+        return response
+
+    @staticmethod
+    def is_administrator():
+        user = g.get('current_user') or current_user
+        return user.is_administrator()
+
+    @staticmethod
+    def header(timings, total):
+        entries = []
+        for name in sorted(timings):
+            seconds, count = timings[name]
+            entries.append('{};desc="{} calls";dur={:.2f}'.format(
+                name, count, seconds * 1000))
+        entries.append('total;dur={:.2f}'.format(total * 1000))
+        return ', '.join(entries)
+
+    @staticmethod
+    def slow_requests():
+        return list(reversed(current_app.extensions['slow_requests']))
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    conn.info.setdefault('server_timing_start', []).append(
+        time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    starts = conn.info.get('server_timing_start')
+    if starts:
+        record('db', time.perf_counter() - starts.pop())
@@ -0,0 +1,39 @@
+from flask import current_app
+from .cache import LRUCache
+
+
+class TokenVersions(object):
+    """Per-process cache of the ``token_version`` of each user.
+
+    Stateless API tokens embed the version current when they were issued.
+    Verifying a token only needs the version, which is cached here for
+    ``FLASKY_TOKEN_VERSION_TTL`` seconds and dropped as soon as this
+    process changes it, so most API requests authenticate without
+    touching the database.
+    """
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['token_versions'] = LRUCache(
+            maxsize=app.config['FLASKY_TOKEN_VERSION_CACHE_SIZE'],
+            ttl=app.config['FLASKY_TOKEN_VERSION_TTL'])
+
+    @property
+    def cache(self):
+        return current_app.extensions['token_versions']
+
+    def get(self, user_id, loader):
+        version = self.cache.get(user_id)
+        if version is None:
+            version = loader(user_id)
+            if version is not None:
+                self.cache.set(user_id, version)
+        return version
+
+    def invalidate(self, user_id=None):
+        if user_id is None:
+            self.cache.clear()
+        else:
+            self.cache.delete(user_id)
@@ -0,0 +1,293 @@
+import http.client
+import json
+import math
+import os
+import platform
+import random
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+from base64 import b64encode
+from collections import namedtuple
+from app import db
+from app.fake import PASSWORD
+from app.models import User, Post
+
+Scenario = namedtuple('Scenario', 'name path auth')
+
+# ``session`` requests are logged in to the web pages with the followed
+# posts selected, ``basic`` requests authenticate to the API
+SCENARIOS = (
+    Scenario('index', '/', None),
+    Scenario('user', '/user/{username}', None),
+    Scenario('post', '/post/{post_id}', None),
+    Scenario('followed', '/', 'session'),
+    Scenario('api_posts', '/api/v1/posts/', 'basic'),
+    Scenario('api_user_posts', '/api/v1/users/{user_id}/posts/', 'basic'),
+    Scenario('api_comments', '/api/v1/comments/', 'basic'),
+    Scenario('api_timeline', '/api/v1/users/{user_id}/timeline/', 'basic'),
+)
+
+SERVER_TIMING_DB = re.compile(r'(?:^|, )db;desc="(\d+) calls"')
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of a sorted list."""
+    if not values:
+        return None
+    rank = int(math.ceil(p / 100.0 * len(values)))
+    return values[min(max(rank, 1), len(values)) - 1]
+
+
+def summarize(latencies, queries, errors, elapsed):
+    latencies = sorted(latencies)
+    stats = {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput': round(len(latencies) / elapsed, 2) if elapsed else None,
+        'queries_per_request': round(sum(queries) / len(queries), 2)
+        if queries else None
+    }
+    for p in (50, 95, 99):
+        value = percentile(latencies, p)
+        stats['p{}_ms'.format(p)] = round(value * 1000, 2) \
+            if value is not None else None
+    return stats
+
+
+class Benchmark(object):
+    """Drive the key pages and API endpoints of an application whose
+    database was filled by ``app.fake.generate``.
+
+    The same deterministic sequence of requests is sent through the WSGI
+    test client and, optionally, through HTTP to a server started with
+    several worker processes. Logged in requests are made as the user
+    who follows the most users. Queries per request are read from the
+    ``Server-Timing`` header, so ``FLASKY_SERVER_TIMING`` must be set.
+    """
+    def __init__(self, app, requests=200, warmup=10, seed=0):
+        self.app = app
+        self.requests = requests
+        self.warmup = warmup
+        self.seed = seed
+        with app.app_context():
+            user = User.query.order_by(User.followed_count.desc(),
+                                       User.id).first()
+            self.usernames = [row.username for row in db.session.query(
+                User.username).order_by(User.id)]
+            self.user_ids = [row.id for row in db.session.query(
+                User.id).order_by(User.id)]
+            self.post_ids = [row.id for row in db.session.query(
+                Post.id).order_by(Post.id)]
+            self.database = db.engine.dialect.name
+            serializer = app.session_interface.get_signing_serializer(app)
+            session = serializer.dumps({'user_id': str(user.id),
+                                        '_fresh': True})
+            credentials = '{}:{}'.format(user.email, PASSWORD)
+        self.headers = {
+            None: {},
+            'session': {'Cookie': '{}={}; show_followed=1'.format(
+                app.session_cookie_name, session)},
+            'basic': {
+                'Accept': 'application/json',
+                'Authorization': 'Basic ' + b64encode(
+                    credentials.encode('utf-8')).decode('utf-8')}
+        }
+
+    def paths(self, scenario, count):
+        rng = random.Random('{}-{}'.format(self.seed, scenario.name))
+        return [scenario.path.format(
+            username=rng.choice(self.usernames),
+            user_id=rng.choice(self.user_ids),
+            post_id=rng.choice(self.post_ids) if self.post_ids else 0)
+            for i in range(count)]
+
+    @staticmethod
+    def queries(headers):
+        match = SERVER_TIMING_DB.search(headers.get('Server-Timing') or '')
+        return int(match.group(1)) if match else 0
+
+    def run_client(self, scenarios=SCENARIOS):
+        """Send the requests of each scenario one at a time through the
+        test client."""
+        client = self.app.test_client()
+        results = {}
+        for scenario in scenarios:
+            headers = self.headers[scenario.auth]
+            for path in self.paths(scenario, self.warmup):
+                client.get(path, headers=headers)
+            latencies, queries, errors = [], [], 0
+            started = time.perf_counter()
+            for path in self.paths(scenario, self.requests):
+                start = time.perf_counter()
+                response = client.get(path, headers=headers)
+                latencies.append(time.perf_counter() - start)
+                queries.append(self.queries(response.headers))
+                if response.status_code != 200:
+                    errors += 1
+            results[scenario.name] = summarize(
+                latencies, queries, errors, time.perf_counter() - started)
+        return results
+
+    def run_server(self, address, concurrency=8, scenarios=SCENARIOS):
+        """Send the requests of each scenario over HTTP to ``address``
+        from ``concurrency`` threads."""
+        results = {}
+        for scenario in scenarios:
+            headers = self.headers[scenario.auth]
+            for path in self.paths(scenario, self.warmup):
+                self.fetch(address, path, headers)
+            pending = iter(self.paths(scenario, self.requests))
+            lock = threading.Lock()
+            latencies, queries, errors = [], [], []
+
+            def worker():
+                while True:
+                    with lock:
+                        path = next(pending, None)
+                    if path is None:
+                        return
+                    start = time.perf_counter()
+                    try:
+                        status, response_headers = self.fetch(
+                            address, path, headers)
+                    except (OSError, http.client.HTTPException):
+                        errors.append(path)
+                        continue
+                    latencies.append(time.perf_counter() - start)
+                    queries.append(self.queries(response_headers))
+                    if status != 200:
+                        errors.append(path)
+
+            threads = [threading.Thread(target=worker)
+                       for i in range(concurrency)]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            results[scenario.name] = summarize(
+                latencies, queries, len(errors),
+                time.perf_counter() - started)
+        return results
+
+    @staticmethod
+    def fetch(address, path, headers):
+        connection = http.client.HTTPConnection(*address, timeout=30)
+        try:
+            connection.request('GET', path, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            return response.status, response.headers
+        finally:
+            connection.close()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def server_command(port, workers):
+    """Serve with gunicorn, as in production, or with the forking
+    development server when gunicorn is not installed."""
+    try:
+        import gunicorn  # noqa: F401
+    except ImportError:
+        return [sys.executable, '-m', 'benchmarks.server', '--port',
+                str(port), '--workers', str(workers)]
+    return [sys.executable, '-m', 'gunicorn', '--workers', str(workers),
+            '--bind', '127.0.0.1:{}'.format(port), '--log-level',
+            'warning', 'flasky:app']
+
+
+class Server(object):
+    """Context manager that runs the application in a separate server
+    process, with the ``benchmark`` configuration and the given
+    database."""
+    def __init__(self, database_url, workers=4, timeout=30):
+        self.database_url = database_url
+        self.workers = workers
+        self.timeout = timeout
+
+    def __enter__(self):
+        port = free_port()
+        self.address = ('127.0.0.1', port)
+        env = dict(os.environ, FLASK_CONFIG='benchmark',
+                   BENCHMARK_DATABASE_URL=self.database_url)
+        self.process = subprocess.Popen(
+            server_command(port, self.workers), env=env,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        deadline = time.time() + self.timeout
+        while True:
+            try:
+                socket.create_connection(self.address, timeout=1).close()
+                return self
+            except OSError:
+                if self.process.poll() is not None or \
+                        time.time() > deadline:
+                    self.__exit__(None, None, None)
+                    raise RuntimeError('benchmark server did not start')
+                time.sleep(0.1)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.process.terminate()
+        try:
+            self.process.wait(self.timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+def commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report(benchmark, dataset, results, settings):
+    """Build the machine-readable report. Keys are sorted when written so
+    that reports of two commits can be compared with ``diff``."""
+    return {
+        'commit': commit(),
+        'python': platform.python_version(),
+        'database': benchmark.database,
+        'dataset': dataset,
+        'settings': dict(settings, requests=benchmark.requests,
+                         warmup=benchmark.warmup),
+        'results': results
+    }
+
+
+def write(report, path):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def compare(old, new):
+    """Return lines comparing the latency, throughput and query counts of
+    two reports."""
+    lines = []
+    for driver in sorted(new['results']):
+        for name in sorted(new['results'][driver]):
+            before = old.get('results', {}).get(driver, {}).get(name)
+            after = new['results'][driver][name]
+            if before is None:
+                continue
+            changes = []
+            for key in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput',
+                        'queries_per_request'):
+                if before.get(key) and after.get(key) is not None:
+                    changes.append('{} {:+.1f}%'.format(
+                        key, (after[key] - before[key]) * 100.0 /
+                        before[key]))
+            lines.append('{}/{}: {}'.format(driver, name, ', '.join(changes)))
+    return lines
@@ -0,0 +1,22 @@
+"""Serve the application with the forking development server, for
+benchmarks on machines without gunicorn."""
+import argparse
+import logging
+import os
+import sys
+from werkzeug.serving import run_simple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from app import create_app  # noqa: E402
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    app = create_app(os.getenv('FLASK_CONFIG') or 'benchmark')
+    run_simple('127.0.0.1', args.port, app, processes=args.workers)
@@ -13,13 +13,71 @@ class Config:
     FLASKY_MAIL_SUBJECT_PREFIX = '[Flasky]'
     FLASKY_MAIL_SENDER = 'Flasky Admin <flasky@example.com>'
     FLASKY_ADMIN = os.environ.get('FLASKY_ADMIN')
+    FLASKY_MAIL_WORKERS = int(os.environ.get('MAIL_WORKERS', '2'))
+    FLASKY_MAIL_QUEUE_SIZE = 1000
+    FLASKY_MAIL_QUEUE_TIMEOUT = 5
+    FLASKY_MAIL_IDLE_TIMEOUT = 5
+    FLASKY_MAIL_RETRIES = 3
+    FLASKY_MAIL_RETRY_BACKOFF = 1
     SSL_REDIRECT = False
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SQLALCHEMY_RECORD_QUERIES = True
+    SQLALCHEMY_BINDS = {
+        'replica{}'.format(i): url for i, url in
+        enumerate(os.environ.get('DATABASE_REPLICA_URLS', '').split())
+    }
+    FLASKY_READ_REPLICAS = sorted(SQLALCHEMY_BINDS)
+    FLASKY_REPLICA_LAG = 10
+    FLASKY_REPLICA_WRITERS = 10000
+    # each worker process holds up to pool size + overflow connections
+    SQLALCHEMY_POOL_SIZE = int(os.environ.get('DATABASE_POOL_SIZE', '5'))
+    SQLALCHEMY_MAX_OVERFLOW = int(os.environ.get('DATABASE_MAX_OVERFLOW',
+                                                 '5'))
+    SQLALCHEMY_POOL_TIMEOUT = int(os.environ.get('DATABASE_POOL_TIMEOUT',
+                                                 '10'))
+    SQLALCHEMY_POOL_RECYCLE = int(os.environ.get('DATABASE_POOL_RECYCLE',
+                                                 '1800'))
+    FLASKY_POOL_PRE_PING = True
+    FLASKY_POOL_PING_IDLE_TIME = 10
     FLASKY_POSTS_PER_PAGE = 20
     FLASKY_FOLLOWERS_PER_PAGE = 50
     FLASKY_COMMENTS_PER_PAGE = 30
+    FLASKY_EXPORT_BATCH_SIZE = 1000
+    FLASKY_API_BATCH_LIMIT = 100
+    FLASKY_SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND')
+    FLASKY_SEARCH_RESULTS_PER_PAGE = 20
     FLASKY_SLOW_DB_QUERY_TIME = 0.5
+    FLASKY_USER_CACHE_SIZE = 10000
+    FLASKY_USER_CACHE_TTL = 60
+    FLASKY_ROLE_TABLE_TTL = 300
+    FLASKY_TOKEN_VERSION_TTL = 30
+    FLASKY_TOKEN_VERSION_CACHE_SIZE = 10000
+    FLASKY_LAST_SEEN_GRANULARITY = 60
+    FLASKY_LAST_SEEN_FLUSH_INTERVAL = 10
+    FLASKY_LAST_SEEN_BATCH_SIZE = 500
+    FLASKY_RENDER_CACHE_SIZE = 4096
+    FLASKY_RENDER_CACHE_URL = os.environ.get('RENDER_CACHE_URL')
+    FLASKY_FRAGMENT_CACHE_SIZE = 4096
+    FLASKY_FOLLOW_GRAPH_TTL = 300
+    FLASKY_FOLLOW_GRAPH_MAX_CHANGES = 10000
+    FLASKY_RECOMMENDATIONS = 5
+    FLASKY_METRICS = True
+    FLASKY_METRICS_DIR = os.environ.get('METRICS_DIR')
+    FLASKY_METRICS_FLUSH_INTERVAL = 5
+    # networks allowed to scrape /metrics, or None for everyone
+    FLASKY_METRICS_ALLOWED_NETWORKS = os.environ.get(
+        'METRICS_ALLOWED_NETWORKS', '127.0.0.0/8 ::1/128').split()
+    FLASKY_SERVER_TIMING = os.environ.get('SERVER_TIMING', 'false').lower() \
+        in ['true', 'on', '1']
+    FLASKY_SLOW_REQUEST_TIME = 0.5
+    FLASKY_SLOW_REQUEST_LOG_SIZE = int(os.environ.get(
+        'SLOW_REQUEST_LOG_SIZE', '100'))
+    FLASKY_COMPRESSION = True
+    FLASKY_COMPRESSION_MIN_SIZE = 500
+    FLASKY_COMPRESSION_LEVELS = {
+        'gzip': {'*': 6, 'application/json': 5},
+        'br': {'*': 4, 'application/json': 5}
+    }
 
     @staticmethod
     def init_app(app):
@@ -39,6 +97,13 @@ class TestingConfig(Config):
     WTF_CSRF_ENABLED = False
 
 
+class BenchmarkConfig(Config):
+    SQLALCHEMY_DATABASE_URI = os.environ.get('BENCHMARK_DATABASE_URL') or \
+        'sqlite:///' + os.path.join(basedir, 'data-benchmark.sqlite')
+    SQLALCHEMY_RECORD_QUERIES = False
+    FLASKY_SERVER_TIMING = True
+
+
 class ProductionConfig(Config):
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'data.sqlite')
@@ -115,6 +180,7 @@ class UnixConfig(ProductionConfig):
 config = {
     'development': DevelopmentConfig,
     'testing': TestingConfig,
+    'benchmark': BenchmarkConfig,
     'production': ProductionConfig,
     'heroku': HerokuConfig,
     'docker': DockerConfig,
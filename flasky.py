@@ -12,19 +12,30 @@ if os.environ.get('FLASK_COVERAGE'):
     COV.start()
 
 import sys
+import time
+from contextlib import contextmanager
 import click
 from flask_migrate import Migrate, upgrade
-from app import create_app, db
-from app.models import User, Follow, Role, Permission, Post, Comment
+from app import create_app, db, search_index
+from app.models import User, Follow, Role, Permission, Post, Comment, \
+    Timeline
 
 app = create_app(os.getenv('FLASK_CONFIG') or 'default')
 migrate = Migrate(app, db)
 
 
+@contextmanager
+def step(name):
+    start = time.time()
+    yield
+    print('{}: {:.2f}s'.format(name, time.time() - start))
+
+
 @app.shell_context_processor
 def make_shell_context():
     return dict(db=db, User=User, Follow=Follow, Role=Role,
-                Permission=Permission, Post=Post, Comment=Comment)
+                Permission=Permission, Post=Post, Comment=Comment,
+                Timeline=Timeline)
 
 
 @app.cli.command()
@@ -66,13 +77,162 @@ def profile(length, profile_dir):
 
 
 @app.cli.command()
-def deploy():
+@click.option('--users', default=1000, help='Number of users to create.')
+@click.option('--follows', default=20,
+              help='Average number of users each user follows.')
+@click.option('--posts', default=10000, help='Number of posts to create.')
+@click.option('--comments', default=20000,
+              help='Number of comments to create.')
+@click.option('--seed', default=0, help='Seed of the generated data.')
+@click.option('--batch-size', default=10000,
+              help='Number of rows written per insert.')
+@click.option('--distinct-bodies', default=10000,
+              help='Number of different post and comment bodies, or 0 for '
+              'all different.')
+def fake(users, follows, posts, comments, seed, batch_size,
+         distinct_bodies):
+    """Add generated users, follows, posts and comments."""
+    from app.fake import Generator
+    generator = Generator(seed, batch_size, distinct_bodies or None)
+    with step('users'):
+        user_ids = generator.users(users)
+    with step('follows'):
+        generator.follows(user_ids, user_ids, follows)
+    with step('posts'):
+        post_ids = generator.posts(posts, user_ids)
+    with step('comments'):
+        generator.comments(comments, user_ids, post_ids)
+    with step('timelines, counters and search index'):
+        generator.finish()
+
+
+@app.cli.command()
+@click.option('--users', default=500, help='Number of users to create.')
+@click.option('--follows', default=20,
+              help='Average number of users each user follows.')
+@click.option('--posts', default=5000, help='Number of posts to create.')
+@click.option('--comments', default=10000,
+              help='Number of comments to create.')
+@click.option('--seed', default=0, help='Seed of the generated data.')
+@click.option('--reuse-data/--no-reuse-data', default=False,
+              help='Benchmark the data left by a previous run.')
+@click.option('--requests', default=200,
+              help='Number of requests sent to each endpoint.')
+@click.option('--warmup', default=10,
+              help='Requests sent to each endpoint before measuring.')
+@click.option('--server/--no-server', default=True,
+              help='Also benchmark a multi-worker HTTP server.')
+@click.option('--workers', default=4, help='Number of server workers.')
+@click.option('--concurrency', default=8,
+              help='Number of concurrent clients of the server.')
+@click.option('--output', default='benchmark.json',
+              help='File where the report is written.')
+@click.option('--compare', default=None, type=click.Path(exists=True),
+              help='Report of a previous run to compare with.')
+def benchmark(users, follows, posts, comments, seed, reuse_data, requests,
+              warmup, server, workers, concurrency, output, compare):
+    """Measure latency, throughput and queries per request."""
+    import json
+    from app.fake import generate
+    from benchmarks import runner
+    bench_app = create_app('benchmark')
+    database_url = bench_app.config['SQLALCHEMY_DATABASE_URI']
+    with bench_app.app_context():
+        if reuse_data:
+            info = {'seed': seed, 'users': User.query.count(),
+                    'follows': Follow.query.filter(
+                        Follow.follower_id != Follow.followed_id).count(),
+                    'posts': Post.query.count(),
+                    'comments': Comment.query.count()}
+        else:
+            db.drop_all()
+            db.create_all()
+            Role.insert_roles()
+            info = generate(users, follows, posts, comments, seed)
+        db.session.remove()
+    bench = runner.Benchmark(bench_app, requests, warmup, seed)
+    results = {'client': bench.run_client()}
+    if server:
+        with runner.Server(database_url, workers) as http_server:
+            results['server'] = bench.run_server(http_server.address,
+                                                 concurrency)
+    report = runner.report(bench, info, results,
+                           {'workers': workers, 'concurrency': concurrency})
+    runner.write(report, output)
+    for driver in sorted(results):
+        for name, stats in sorted(results[driver].items()):
+            print('{}/{}: p50 {p50_ms}ms p95 {p95_ms}ms p99 {p99_ms}ms, '
+                  '{throughput} req/s, {queries_per_request} queries, '
+                  '{errors} errors'.format(driver, name, **stats))
+    if compare:
+        with open(compare) as f:
+            print('\n'.join(runner.compare(json.load(f), report)))
+
+
+def migrations_pending():
+    from alembic.migration import MigrationContext
+    from alembic.script import ScriptDirectory
+    script = ScriptDirectory.from_config(migrate.get_config(None))
+    with db.engine.connect() as connection:
+        context = MigrationContext.configure(connection)
+        return set(context.get_current_heads()) != set(script.get_heads())
+
+
+@app.cli.command()
+@click.option('--chunk-size', default=10000,
+              help='Number of users checked per statement for self-follows.')
+def deploy(chunk_size):
     """Run deployment tasks."""
     # migrate database to latest revision
-    upgrade()
+    with step('migrations'):
+        if migrations_pending():
+            upgrade()
+        else:
+            print('already at head')
 
     # create or update user roles
-    Role.insert_roles()
+    with step('roles'):
+        if not Role.insert_roles():
+            print('roles unchanged')
 
     # ensure all users are following themselves
-    User.add_self_follows()
+    with step('self-follows'):
+        print('{} users fixed'.format(User.add_self_follows(chunk_size)))
+
+
+@app.cli.command('rebuild-timelines')
+def rebuild_timelines():
+    """Rebuild the materialized timelines from the follows table."""
+    Timeline.rebuild()
+
+
+@app.cli.command()
+def recount():
+    """Recompute the denormalized post, comment and follow counters."""
+    User.recount()
+    Post.recount()
+
+
+@app.cli.command()
+@click.option('--chunk-size', default=1000,
+              help='Number of rows indexed per transaction.')
+def reindex(chunk_size):
+    """Rebuild the full-text search index."""
+    search_index.rebuild(chunk_size)
+
+
+@app.cli.command('check-indexes')
+def check_indexes():
+    """Explain the hot queries and flag full scans and sorts."""
+    from app.advisor import advisor
+    failed = False
+    for report in advisor.check():
+        print('{}: {}'.format(report.name,
+                              'FAIL' if report.problems else 'ok'))
+        for line in report.plan:
+            print('    ' + line)
+        for problem in report.problems:
+            print('  ! ' + problem)
+        failed = failed or bool(report.problems)
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,36 @@
+"""materialized timelines
+
+Revision ID: 3a1f6c2e9b47
+Revises: 51f5ccfba190
+Create Date: 2026-10-18 09:12:31.402281
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3a1f6c2e9b47'
+down_revision = '51f5ccfba190'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('timelines',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('post_id', sa.Integer(), nullable=False),
+    sa.Column('timestamp', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['post_id'], ['posts.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'post_id')
+    )
+    op.create_index('ix_timelines_user_timestamp', 'timelines',
+                    ['user_id', 'timestamp', 'post_id'], unique=False)
+    op.execute('INSERT INTO timelines (user_id, post_id, timestamp) '
+               'SELECT follows.follower_id, posts.id, posts.timestamp '
+               'FROM follows JOIN posts '
+               'ON follows.followed_id = posts.author_id')
+
+
+def downgrade():
+    op.drop_index('ix_timelines_user_timestamp', 'timelines')
+    op.drop_table('timelines')
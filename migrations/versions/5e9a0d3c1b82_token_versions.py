@@ -0,0 +1,23 @@
+"""token versions
+
+Revision ID: 5e9a0d3c1b82
+Revises: 8c4d2b7e5f10
+Create Date: 2026-10-18 14:05:47.730412
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5e9a0d3c1b82'
+down_revision = '8c4d2b7e5f10'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('users', sa.Column('token_version', sa.Integer(),
+                                     server_default='0', nullable=True))
+
+
+def downgrade():
+    op.drop_column('users', 'token_version')
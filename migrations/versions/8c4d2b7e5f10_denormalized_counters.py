@@ -0,0 +1,47 @@
+"""denormalized counters
+
+Revision ID: 8c4d2b7e5f10
+Revises: 3a1f6c2e9b47
+Create Date: 2026-10-18 11:40:02.118734
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '8c4d2b7e5f10'
+down_revision = '3a1f6c2e9b47'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('users', sa.Column('post_count', sa.Integer(),
+                                     server_default='0', nullable=True))
+    op.add_column('users', sa.Column('comment_count', sa.Integer(),
+                                     server_default='0', nullable=True))
+    op.add_column('users', sa.Column('followers_count', sa.Integer(),
+                                     server_default='0', nullable=True))
+    op.add_column('users', sa.Column('followed_count', sa.Integer(),
+                                     server_default='0', nullable=True))
+    op.add_column('posts', sa.Column('comment_count', sa.Integer(),
+                                     server_default='0', nullable=True))
+    op.execute('UPDATE users SET '
+               'post_count = (SELECT count(*) FROM posts '
+               'WHERE posts.author_id = users.id), '
+               'comment_count = (SELECT count(*) FROM comments '
+               'WHERE comments.author_id = users.id), '
+               'followers_count = (SELECT count(*) FROM follows '
+               'WHERE follows.followed_id = users.id), '
+               'followed_count = (SELECT count(*) FROM follows '
+               'WHERE follows.follower_id = users.id)')
+    op.execute('UPDATE posts SET '
+               'comment_count = (SELECT count(*) FROM comments '
+               'WHERE comments.post_id = posts.id)')
+
+
+def downgrade():
+    op.drop_column('posts', 'comment_count')
+    op.drop_column('users', 'followed_count')
+    op.drop_column('users', 'followers_count')
+    op.drop_column('users', 'comment_count')
+    op.drop_column('users', 'post_count')
@@ -0,0 +1,32 @@
+"""row update times
+
+Revision ID: b7d41e6a2c93
+Revises: 5e9a0d3c1b82
+Create Date: 2026-10-18 15:12:09.184337
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'b7d41e6a2c93'
+down_revision = '5e9a0d3c1b82'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('users', sa.Column('updated_at', sa.DateTime(),
+                                     nullable=True))
+    op.add_column('posts', sa.Column('updated_at', sa.DateTime(),
+                                     nullable=True))
+    op.add_column('comments', sa.Column('updated_at', sa.DateTime(),
+                                        nullable=True))
+    op.execute('UPDATE users SET updated_at = member_since')
+    op.execute('UPDATE posts SET updated_at = timestamp')
+    op.execute('UPDATE comments SET updated_at = timestamp')
+
+
+def downgrade():
+    op.drop_column('comments', 'updated_at')
+    op.drop_column('posts', 'updated_at')
+    op.drop_column('users', 'updated_at')
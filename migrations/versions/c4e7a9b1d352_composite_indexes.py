@@ -0,0 +1,29 @@
+"""composite indexes
+
+Revision ID: c4e7a9b1d352
+Revises: e2c8a5f17d04
+Create Date: 2026-10-18 14:05:12.718342
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'c4e7a9b1d352'
+down_revision = 'e2c8a5f17d04'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_index('ix_posts_author_timestamp', 'posts',
+                    ['author_id', 'timestamp', 'id'], unique=False)
+    op.create_index('ix_comments_post_timestamp', 'comments',
+                    ['post_id', 'timestamp', 'id'], unique=False)
+    op.create_index('ix_follows_followed_timestamp', 'follows',
+                    ['followed_id', 'timestamp', 'follower_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_follows_followed_timestamp', 'follows')
+    op.drop_index('ix_comments_post_timestamp', 'comments')
+    op.drop_index('ix_posts_author_timestamp', 'posts')
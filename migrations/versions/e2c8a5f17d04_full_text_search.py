@@ -0,0 +1,32 @@
+"""full text search
+
+Revision ID: e2c8a5f17d04
+Revises: b7d41e6a2c93
+Create Date: 2026-10-18 16:02:51.509816
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'e2c8a5f17d04'
+down_revision = 'b7d41e6a2c93'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # other databases use the LIKE search backend, which needs no index
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for table in ('posts', 'comments'):
+        op.execute("CREATE VIRTUAL TABLE {0}_search USING fts5(body, "
+                   "tokenize='porter unicode61')".format(table))
+        op.execute('INSERT INTO {0}_search (rowid, body) '
+                   'SELECT id, body FROM {0}'.format(table))
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for table in ('posts', 'comments'):
+        op.execute('DROP TABLE {0}_search'.format(table))
@@ -0,0 +1,23 @@
+"""comments updated_at index
+
+Revision ID: f3b8d2c6a417
+Revises: c4e7a9b1d352
+Create Date: 2026-10-18 20:12:41.503118
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'f3b8d2c6a417'
+down_revision = 'c4e7a9b1d352'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_index('ix_comments_updated_at', 'comments',
+                    ['updated_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_comments_updated_at', 'comments')
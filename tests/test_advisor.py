@@ -0,0 +1,42 @@
+import unittest
+from app import create_app, db
+from app.advisor import advisor, sqlite_problems
+from app.models import Role
+
+
+class IndexAdvisorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_hot_queries(self):
+        reports = advisor.check()
+        self.assertEqual([r.name for r in reports], list(advisor.queries))
+        for report in reports:
+            self.assertTrue(report.plan)
+            self.assertEqual(report.problems, [], report.name)
+
+    def test_missing_index(self):
+        db.session.execute('DROP INDEX ix_posts_author_timestamp')
+        db.session.commit()
+        problems = {r.name: r.problems for r in advisor.check()}
+        self.assertEqual(problems['user posts'],
+                         ['full index scan of posts'])
+        self.assertEqual(problems['posts'], [])
+
+    def test_sqlite_problems(self):
+        plan, problems = sqlite_problems([
+            (2, 0, 0, 'SCAN TABLE follows'),
+            (7, 0, 0, 'SEARCH users USING INTEGER PRIMARY KEY (rowid=?)'),
+            (9, 0, 0, 'USE TEMP B-TREE FOR ORDER BY')])
+        self.assertEqual(len(plan), 3)
+        self.assertEqual(problems, ['full scan of follows',
+                                    'temporary sort (for order by)'])
@@ -2,8 +2,11 @@ import unittest
 import json
 import re
 from base64 import b64encode
+from datetime import datetime, timedelta
 from app import create_app, db
-from app.models import User, Role, Post, Comment
+from app.models import User, Role, Post, Comment, Permission
+from app.pagination import encode_cursor
+from tests.utils import QueryCounter
 
 
 class APITestCase(unittest.TestCase):
@@ -86,6 +89,56 @@ class APITestCase(unittest.TestCase):
             headers=self.get_api_headers(token, ''))
         self.assertEqual(response.status_code, 200)
 
+    def test_stateless_token(self):
+        # add a user
+        r = Role.query.filter_by(name='User').first()
+        self.assertIsNotNone(r)
+        u = User(email='john@example.com', password='cat', confirmed=True,
+                 role=r)
+        db.session.add(u)
+        db.session.commit()
+        response = self.client.post(
+            '/api/v1/tokens/',
+            headers=self.get_api_headers('john@example.com', 'cat'))
+        token = json.loads(response.get_data(as_text=True))['token']
+
+        # once the token version is cached users are not queried
+        self.client.get('/api/v1/posts/',
+                        headers=self.get_api_headers(token, ''))
+        with QueryCounter() as counter:
+            response = self.client.post(
+                '/api/v1/posts/',
+                headers=self.get_api_headers(token, ''),
+                data=json.dumps({'body': 'body of the post'}))
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse([s for s in counter.statements
+                          if s.startswith('SELECT') and 'FROM users' in s])
+        self.assertEqual(Post.query.first().author, u)
+
+        # changing the role of the user invalidates the token
+        u.role = Role.query.filter_by(name='Moderator').first()
+        db.session.commit()
+        response = self.client.get(
+            '/api/v1/posts/',
+            headers=self.get_api_headers(token, ''))
+        self.assertEqual(response.status_code, 401)
+
+        # and so does changing the permissions of the role
+        response = self.client.post(
+            '/api/v1/tokens/',
+            headers=self.get_api_headers('john@example.com', 'cat'))
+        token = json.loads(response.get_data(as_text=True))['token']
+        response = self.client.get(
+            '/api/v1/posts/',
+            headers=self.get_api_headers(token, ''))
+        self.assertEqual(response.status_code, 200)
+        u.role.remove_permission(Permission.WRITE)
+        db.session.commit()
+        response = self.client.get(
+            '/api/v1/posts/',
+            headers=self.get_api_headers(token, ''))
+        self.assertEqual(response.status_code, 401)
+
     def test_anonymous(self):
         response = self.client.get(
             '/api/v1/posts/',
@@ -262,3 +315,277 @@ class APITestCase(unittest.TestCase):
         json_response = json.loads(response.get_data(as_text=True))
         self.assertIsNotNone(json_response.get('comments'))
         self.assertEqual(json_response.get('count', 0), 2)
+
+    def test_cursor_pagination(self):
+        # add a user with more posts than fit in a page
+        r = Role.query.filter_by(name='User').first()
+        self.assertIsNotNone(r)
+        u = User(email='john@example.com', password='cat', confirmed=True,
+                 role=r)
+        db.session.add(u)
+        t = datetime(2017, 1, 1)
+        for i in range(25):
+            # two posts share each timestamp to exercise the id tiebreaker
+            db.session.add(Post(body='post {}'.format(i), author=u,
+                                timestamp=t + timedelta(minutes=i // 2)))
+        db.session.commit()
+        expected = [p.id for p in Post.query.order_by(
+            Post.timestamp.desc(), Post.id.desc())]
+
+        # walk forward through the pages
+        headers = self.get_api_headers('john@example.com', 'cat')
+        seen = []
+        urls = []
+        url = '/api/v1/users/{}/posts/?cursor='.format(u.id)
+        while url:
+            response = self.client.get(url, headers=headers)
+            self.assertEqual(response.status_code, 200)
+            json_response = json.loads(response.get_data(as_text=True))
+            self.assertNotIn('count', json_response)
+            seen.extend(int(p['url'].split('/')[-1])
+                        for p in json_response['posts'])
+            urls.append(url)
+            url = json_response['next']
+        self.assertEqual(seen, expected)
+        self.assertEqual(len(urls), 2)
+
+        # walk back from the last page
+        response = self.client.get(urls[-1], headers=headers)
+        json_response = json.loads(response.get_data(as_text=True))
+        response = self.client.get(json_response['prev'], headers=headers)
+        json_response = json.loads(response.get_data(as_text=True))
+        self.assertEqual([int(p['url'].split('/')[-1])
+                          for p in json_response['posts']], expected[:20])
+        self.assertIsNone(json_response['prev'])
+
+        # the count is only computed on request
+        response = self.client.get('/api/v1/posts/?cursor=&count=1',
+                                   headers=headers)
+        json_response = json.loads(response.get_data(as_text=True))
+        self.assertEqual(json_response['count'], 25)
+        self.assertIn('count=1', json_response['next'])
+
+        # timelines page the same way
+        response = self.client.get(
+            '/api/v1/users/{}/timeline/?cursor='.format(u.id),
+            headers=headers)
+        json_response = json.loads(response.get_data(as_text=True))
+        self.assertEqual([int(p['url'].split('/')[-1])
+                          for p in json_response['posts']], expected[:20])
+
+        # bad cursor
+        response = self.client.get('/api/v1/posts/?cursor=bad',
+                                   headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+        # well-formed cursors with values of the wrong type
+        for key in ([[1], 1], [{'t': '2017-01-01T00:00:00.000000'}, 'x'],
+                    [{'t': '2017-01-01T00:00:00.000000'}, True],
+                    [{'t': '2017-01-01T00:00:00.000000'}, None]):
+            cursor = encode_cursor('next', key)
+            response = self.client.get(
+                '/api/v1/posts/?cursor=' + cursor, headers=headers)
+            self.assertEqual(response.status_code, 400)
+        response = self.client.get(
+            '/api/v1/posts/export?cursor=' + encode_cursor('next', [True]),
+            headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_conditional_get(self):
+        # add a user and a post
+        r = Role.query.filter_by(name='User').first()
+        self.assertIsNotNone(r)
+        u = User(email='john@example.com', password='cat', confirmed=True,
+                 role=r)
+        db.session.add(u)
+        db.session.commit()
+        headers = self.get_api_headers('john@example.com', 'cat')
+        response = self.client.post(
+            '/api/v1/posts/', headers=headers,
+            data=json.dumps({'body': 'body of the post'}))
+        url = response.headers.get('Location')
+
+        # resources carry validators
+        response = self.client.get(url, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers.get('ETag')
+        self.assertIsNotNone(etag)
+        self.assertFalse(etag.startswith('W/'))
+        last_modified = response.headers.get('Last-Modified')
+        self.assertIsNotNone(last_modified)
+
+        # an unchanged resource is answered with a 304
+        conditional_headers = dict(headers, **{'If-None-Match': etag})
+        response = self.client.get(url, headers=conditional_headers)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.get_data(), b'')
+        self.assertEqual(response.headers.get('ETag'), etag)
+        response = self.client.get(url, headers=dict(headers, **{
+            'If-Modified-Since': last_modified}))
+        self.assertEqual(response.status_code, 304)
+
+        # comments change the post and the comment listings
+        response = self.client.get(url + '/comments/', headers=headers)
+        comments_etag = response.headers.get('ETag')
+        response = self.client.get('/api/v1/comments/', headers=headers)
+        all_comments_etag = response.headers.get('ETag')
+        response = self.client.post(
+            url + '/comments/', headers=headers,
+            data=json.dumps({'body': 'Good post!'}))
+        self.assertEqual(response.status_code, 201)
+        comment_url = response.headers.get('Location')
+        response = self.client.get(url, headers=conditional_headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers.get('ETag'), etag)
+        response = self.client.get(url + '/comments/', headers=dict(
+            headers, **{'If-None-Match': comments_etag}))
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get('/api/v1/comments/', headers=dict(
+            headers, **{'If-None-Match': all_comments_etag}))
+        self.assertEqual(response.status_code, 200)
+
+        # moderating a comment changes it
+        response = self.client.get(comment_url, headers=headers)
+        comment_etag = response.headers.get('ETag')
+        c = Comment.query.first()
+        c.disabled = True
+        db.session.commit()
+        response = self.client.get(comment_url, headers=dict(
+            headers, **{'If-None-Match': comment_etag}))
+        self.assertEqual(response.status_code, 200)
+
+        # users
+        user_url = '/api/v1/users/{}'.format(u.id)
+        response = self.client.get(user_url, headers=headers)
+        user_etag = response.headers.get('ETag')
+        response = self.client.get(user_url, headers=dict(
+            headers, **{'If-None-Match': user_etag}))
+        self.assertEqual(response.status_code, 304)
+
+        # missing resources are not affected
+        response = self.client.get('/api/v1/posts/12345', headers=headers)
+        self.assertEqual(response.status_code, 404)
+        self.assertIsNone(response.headers.get('ETag'))
+
+    def test_export(self):
+        # add a user with some posts
+        r = Role.query.filter_by(name='User').first()
+        self.assertIsNotNone(r)
+        u = User(email='john@example.com', password='cat', confirmed=True,
+                 role=r)
+        db.session.add(u)
+        for i in range(5):
+            db.session.add(Post(body='post {}'.format(i), author=u))
+        db.session.commit()
+        headers = self.get_api_headers('john@example.com', 'cat')
+        self.app.config['FLASKY_EXPORT_BATCH_SIZE'] = 2
+
+        # posts are streamed one JSON document per line, in id order
+        response = self.client.get('/api/v1/posts/export', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        self.assertIsNone(response.headers.get('Content-Length'))
+        lines = response.get_data(as_text=True).splitlines()
+        posts = [json.loads(line) for line in lines]
+        self.assertEqual([p['body'] for p in posts],
+                         ['post {}'.format(i) for i in range(5)])
+
+        # an interrupted export resumes after the last line received
+        response = self.client.get(
+            '/api/v1/posts/export?cursor=' + posts[2]['cursor'],
+            headers=headers)
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual([json.loads(line)['body'] for line in lines],
+                         ['post 3', 'post 4'])
+
+        # only rows changed since a point in time
+        since = datetime.utcnow()
+        p = Post.query.filter_by(body='post 1').first()
+        p.body = 'post 1, edited'
+        db.session.commit()
+        response = self.client.get(
+            '/api/v1/posts/export?since=' + since.isoformat(),
+            headers=headers)
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual([json.loads(line)['body'] for line in lines],
+                         ['post 1, edited'])
+
+        # users and comments
+        response = self.client.get('/api/v1/users/export', headers=headers)
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual(json.loads(lines[0])['post_count'], 5)
+        response = self.client.get('/api/v1/comments/export',
+                                   headers=headers)
+        self.assertEqual(response.get_data(), b'')
+
+        # bad arguments
+        response = self.client.get('/api/v1/posts/export?since=yesterday',
+                                   headers=headers)
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/v1/posts/export?cursor=bad',
+                                   headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_batches(self):
+        # add two users
+        r = Role.query.filter_by(name='User').first()
+        self.assertIsNotNone(r)
+        u1 = User(email='john@example.com', username='john',
+                  password='cat', confirmed=True, role=r)
+        u2 = User(email='susan@example.com', username='susan',
+                  password='dog', confirmed=True, role=r)
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        headers = self.get_api_headers('john@example.com', 'cat')
+
+        # create posts in one request; invalid ones are reported
+        response = self.client.post(
+            '/api/v1/posts/batch', headers=headers,
+            data=json.dumps([{'body': 'first'}, {'body': ''},
+                             {'body': 'second'}, 'third']))
+        self.assertEqual(response.status_code, 200)
+        results = json.loads(response.get_data(as_text=True))['results']
+        self.assertEqual([r['status'] for r in results], [201, 400, 201, 400])
+        self.assertEqual(results[0]['post']['body'], 'first')
+        self.assertEqual(results[1]['message'], 'post does not have a body')
+        self.assertEqual(Post.query.count(), 2)
+        self.assertEqual(u1.post_count, 2)
+
+        # and comments
+        post_url = results[0]['post']['url']
+        response = self.client.post(
+            post_url + '/comments/batch', headers=headers,
+            data=json.dumps([{'body': 'Good'}, {'body': 'post'}]))
+        results = json.loads(response.get_data(as_text=True))['results']
+        self.assertEqual([r['status'] for r in results], [201, 201])
+        self.assertEqual(results[1]['comment']['post_url'], post_url)
+        self.assertEqual(Comment.query.count(), 2)
+
+        # fetch several resources with a single query
+        with QueryCounter() as counter:
+            response = self.client.get(
+                '/api/v1/users/?ids={},12345,{}'.format(u2.id, u1.id),
+                headers=headers)
+        self.assertEqual(response.status_code, 200)
+        json_response = json.loads(response.get_data(as_text=True))
+        self.assertEqual([u['username'] for u in json_response['users']],
+                         ['susan', 'john'])
+        self.assertEqual(json_response['missing'], [12345])
+        self.assertEqual(len([s for s in counter.statements
+                              if 'users.id IN' in s]), 1)
+        response = self.client.get(
+            '/api/v1/posts/?ids={}'.format(Post.query.first().id),
+            headers=headers)
+        json_response = json.loads(response.get_data(as_text=True))
+        self.assertEqual(len(json_response['posts']), 1)
+
+        # bad requests
+        self.app.config['FLASKY_API_BATCH_LIMIT'] = 2
+        for url in ('/api/v1/users/', '/api/v1/users/?ids=a',
+                    '/api/v1/posts/?ids=1,2,3'):
+            response = self.client.get(url, headers=headers)
+            self.assertEqual(response.status_code, 400)
+        response = self.client.post(
+            '/api/v1/posts/batch', headers=headers,
+            data=json.dumps({'body': 'not a list'}))
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,48 @@
+import unittest
+from app import create_app, db
+from app.fake import generate
+from app.models import Role
+from benchmarks import runner
+
+
+class BenchmarkTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.config['FLASKY_SERVER_TIMING'] = True
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+
+    def tearDown(self):
+        # the generated users were last seen long ago
+        self.app.extensions['presence'].flush()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_client(self):
+        generate(users=10, follows=3, posts=20, comments=30)
+        db.session.remove()
+        bench = runner.Benchmark(self.app, requests=4, warmup=1)
+        results = bench.run_client()
+        self.assertEqual(sorted(results), sorted(
+            scenario.name for scenario in runner.SCENARIOS))
+        for name, stats in results.items():
+            self.assertEqual(stats['requests'], 4, name)
+            self.assertEqual(stats['errors'], 0, name)
+            self.assertGreater(stats['queries_per_request'], 0, name)
+            self.assertLessEqual(stats['p50_ms'], stats['p99_ms'])
+
+        report = runner.report(bench, {}, {'client': results}, {})
+        self.assertEqual(report['settings']['requests'], 4)
+        lines = runner.compare(report, report)
+        self.assertEqual(len(lines), len(runner.SCENARIOS))
+        self.assertIn('p50_ms +0.0%', lines[0])
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(runner.percentile(values, 50), 50)
+        self.assertEqual(runner.percentile(values, 99), 99)
+        self.assertEqual(runner.percentile([7], 95), 7)
+        self.assertIsNone(runner.percentile([], 50))
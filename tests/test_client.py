@@ -1,7 +1,7 @@
 import re
 import unittest
 from app import create_app, db
-from app.models import User, Role
+from app.models import User, Role, Post, Comment
 
 class FlaskClientTestCase(unittest.TestCase):
     def setUp(self):
@@ -60,3 +60,75 @@ class FlaskClientTestCase(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertTrue('You have been logged out' in response.get_data(
             as_text=True))
+
+    def test_conditional_post_page(self):
+        u = User(email='john@example.com', username='john', password='cat',
+                 confirmed=True)
+        p = Post(body='body of the post', author=u)
+        db.session.add(p)
+        db.session.commit()
+        url = '/post/{}'.format(p.id)
+
+        # anonymous visitors get a weak ETag
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers.get('ETag')
+        self.assertTrue(etag.startswith('W/'))
+        self.assertIn('Cookie', response.headers.get('Vary'))
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+        # a new comment, or a change to one of the authors, changes the page
+        c = Comment(body='Good post!', author=u, post=p)
+        db.session.add(c)
+        db.session.commit()
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers.get('ETag')
+        u.name = 'John Doe'
+        db.session.commit()
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+
+        # the page is not cached for logged in users
+        self.client.post('/auth/login', data={
+            'email': 'john@example.com',
+            'password': 'cat'
+        })
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.headers.get('ETag'))
+
+    def test_post_fragments(self):
+        u = User(email='john@example.com', username='john', password='cat',
+                 confirmed=True)
+        p = Post(body='body of the post', author=u)
+        db.session.add(p)
+        db.session.commit()
+        cache = self.app.extensions['fragment_cache']
+
+        # the post is rendered once and then served from the cache
+        response = self.client.get('/')
+        self.assertIn('body of the post', response.get_data(as_text=True))
+        response = self.client.get('/user/john')
+        self.assertIn('body of the post', response.get_data(as_text=True))
+        self.assertEqual(cache.stats()['hits'], 1)
+
+        # edits and new comments change the fragment
+        p.body = 'edited body'
+        db.session.commit()
+        data = self.client.get('/').get_data(as_text=True)
+        self.assertIn('edited body', data)
+        db.session.add(Comment(body='Good post!', author=u, post=p))
+        db.session.commit()
+        data = self.client.get('/').get_data(as_text=True)
+        self.assertIn('1 Comments', data)
+        self.assertNotIn('Edit</span>', data)
+
+        # the author gets a version with an edit link
+        self.client.post('/auth/login', data={
+            'email': 'john@example.com',
+            'password': 'cat'
+        })
+        data = self.client.get('/').get_data(as_text=True)
+        self.assertIn('Edit</span>', data)
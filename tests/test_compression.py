@@ -0,0 +1,115 @@
+import gzip
+import json
+import unittest
+import zlib
+from base64 import b64encode
+from werkzeug.test import Client
+from werkzeug.wrappers import BaseResponse, Response
+from app import create_app, db
+from app.compression import CompressionMiddleware
+from app.models import User, Role, Post
+
+
+class CompressionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def get_api_headers(self, username, password, **kwargs):
+        headers = {
+            'Authorization': 'Basic ' + b64encode(
+                (username + ':' + password).encode('utf-8')).decode('utf-8'),
+            'Accept': 'application/json',
+            'Content-Type': 'application/json'
+        }
+        headers.update(kwargs)
+        return headers
+
+    def test_api_responses(self):
+        u = User(email='john@example.com', password='cat', confirmed=True)
+        for i in range(20):
+            db.session.add(Post(body='post number {}'.format(i), author=u))
+        db.session.commit()
+
+        # clients that do not ask for compression get the plain body
+        response = self.client.get(
+            '/api/v1/posts/',
+            headers=self.get_api_headers('john@example.com', 'cat'))
+        self.assertIsNone(response.headers.get('Content-Encoding'))
+        self.assertEqual(response.headers.get('Vary'), 'Accept-Encoding')
+        plain = response.get_data()
+
+        response = self.client.get(
+            '/api/v1/posts/',
+            headers=self.get_api_headers('john@example.com', 'cat', **{
+                'Accept-Encoding': 'gzip, deflate'}))
+        self.assertEqual(response.headers.get('Content-Encoding'), 'gzip')
+        self.assertIsNone(response.headers.get('Content-Length'))
+        data = response.get_data()
+        self.assertLess(len(data), len(plain))
+        self.assertEqual(gzip.decompress(data), plain)
+
+        # small responses are sent as they are
+        post_url = json.loads(plain.decode('utf-8'))['posts'][0]['url']
+        response = self.client.get(
+            post_url,
+            headers=self.get_api_headers('john@example.com', 'cat', **{
+                'Accept-Encoding': 'gzip'}))
+        self.assertIsNone(response.headers.get('Content-Encoding'))
+
+        stats = self.app.extensions['compression'].stats()
+        self.assertEqual(stats['responses'], 1)
+        self.assertEqual(stats['bytes_in'], len(plain))
+        self.assertLess(stats['ratio'], 1)
+
+    def test_middleware(self):
+        body = [b'x' * 1000, b'y' * 1000]
+
+        def generate():
+            for chunk in body:
+                yield chunk
+
+        def app(environ, start_response):
+            status = int(environ['PATH_INFO'].strip('/') or 200)
+            headers = {'ETag': '"abc"'}
+            if environ.get('QUERY_STRING') == 'encoded':
+                headers['Content-Encoding'] = 'gzip'
+            if environ.get('QUERY_STRING') == 'image':
+                return Response(body, status=status, headers=headers,
+                                mimetype='image/png')(environ,
+                                                      start_response)
+            return Response(generate(), status=status, headers=headers,
+                            mimetype='text/plain')(environ, start_response)
+
+        middleware = CompressionMiddleware(app, min_size=10,
+                                           levels={'gzip': {'*': 1}})
+        client = Client(middleware, BaseResponse)
+        headers = {'Accept-Encoding': 'gzip;q=1.0, identity;q=0.5'}
+
+        # streamed bodies are compressed chunk by chunk
+        response = client.get('/', headers=headers)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(response.headers['ETag'], 'W/"abc"')
+        chunks = list(response.response)
+        self.assertGreater(len([c for c in chunks if c]), 1)
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.assertEqual(decompressor.decompress(chunks[0]), b'x' * 1000)
+        self.assertEqual(gzip.decompress(b''.join(chunks)), b''.join(body))
+
+        # responses that must not be compressed
+        for url, query in (('/', 'encoded'), ('/', 'image'), ('/204', '')):
+            response = client.get(url, query_string=query, headers=headers)
+            self.assertFalse(response.get_data().startswith(b'\x1f\x8b'))
+        response = client.get('/', headers={'Accept-Encoding': 'gzip;q=0'})
+        self.assertIsNone(response.headers.get('Content-Encoding'))
+        response = client.head('/', headers=headers)
+        self.assertIsNone(response.headers.get('Content-Encoding'))
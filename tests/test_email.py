@@ -0,0 +1,180 @@
+import socket
+import threading
+import unittest
+from app import create_app, db
+from app.email import MailWorkerPool, send_email
+from app.exceptions import MailQueueFull
+from app.models import User, Role
+
+
+class SMTPStandIn(object):
+    """In-process SMTP server that records the messages it receives.
+
+    It implements just enough of the protocol for ``smtplib`` to deliver
+    messages, and accepts every command it does not know.
+    """
+    def __init__(self):
+        self.socket = socket.socket()
+        self.socket.bind(('127.0.0.1', 0))
+        self.socket.listen(5)
+        self.socket.settimeout(0.05)
+        self.port = self.socket.getsockname()[1]
+        self.messages = []
+        self.connections = 0
+        self.running = True
+        self.thread = threading.Thread(target=self.serve)
+        self.thread.start()
+
+    def serve(self):
+        while self.running:
+            try:
+                conn, addr = self.socket.accept()
+            except socket.timeout:
+                continue
+            self.connections += 1
+            thread = threading.Thread(target=self.handle, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+        self.socket.close()
+
+    def handle(self, conn):
+        conn.settimeout(None)
+        with conn, conn.makefile('rb') as f:
+            def reply(line):
+                conn.sendall(line.encode('ascii') + b'\r\n')
+
+            reply('220 localhost')
+            mailfrom, rcpttos = None, []
+            for line in f:
+                command = line.decode('ascii', 'replace').strip()
+                verb = command[:4].upper()
+                if verb == 'MAIL':
+                    mailfrom = command.split(':', 1)[1].strip()
+                elif verb == 'RCPT':
+                    rcpttos.append(command.split(':', 1)[1].strip())
+                elif verb == 'DATA':
+                    reply('354 End data with <CR><LF>.<CR><LF>')
+                    data = []
+                    for line in f:
+                        if line == b'.\r\n':
+                            break
+                        # undo dot stuffing
+                        data.append(line[1:] if line.startswith(b'.')
+                                    else line)
+                    self.messages.append(
+                        (mailfrom, rcpttos, b''.join(data).decode('utf-8')))
+                    mailfrom, rcpttos = None, []
+                elif verb == 'QUIT':
+                    reply('221 Bye')
+                    return
+                reply('250 OK')
+
+
+class EmailTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.state = self.app.extensions['mail']
+        self.state.suppress = False
+        self.state.server = '127.0.0.1'
+        self.state.use_tls = False
+        self.pool = None
+
+    def tearDown(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def use_pool(self, **kwargs):
+        self.pool = MailWorkerPool(self.app, **kwargs)
+        self.app.extensions['mail_queue'] = self.pool
+        return self.pool
+
+    def test_connection_is_reused(self):
+        server = SMTPStandIn()
+        try:
+            self.state.port = server.port
+            self.use_pool(workers=1, idle_timeout=1)
+            user = User(username='john')
+            futures = [send_email('user{}@example.com'.format(i),
+                                  'New User', 'mail/new_user', user=user)
+                       for i in range(5)]
+            for future in futures:
+                self.assertTrue(future.result(timeout=5))
+        finally:
+            self.pool.shutdown()
+            server.stop()
+        self.assertEqual(len(server.messages), 5)
+        self.assertEqual(server.connections, 1)
+        self.assertEqual(self.pool.stats()['sent'], 5)
+        self.assertIn('User john has joined.', server.messages[0][2])
+
+    def test_retry_with_backoff(self):
+        s = socket.socket()
+        s.bind(('127.0.0.1', 0))
+        self.state.port = s.getsockname()[1]
+        s.close()
+        self.use_pool(workers=1, retries=2, backoff=0.01)
+        future = send_email('john@example.com', 'New User', 'mail/new_user',
+                            user=User(username='john'))
+        self.assertIsInstance(future.exception(timeout=5), OSError)
+        self.assertEqual(self.pool.stats()['retried'], 2)
+        self.assertEqual(self.pool.stats()['failed'], 1)
+
+    def test_backpressure(self):
+        # without workers nothing drains the queue
+        self.use_pool(workers=0, queue_size=1, put_timeout=0.01)
+        user = User(username='john')
+        send_email('john@example.com', 'New User', 'mail/new_user',
+                   user=user)
+        with self.assertRaises(MailQueueFull):
+            send_email('john@example.com', 'New User', 'mail/new_user',
+                       user=user)
+
+    def test_full_queue_in_views(self):
+        Role.insert_roles()
+        self.use_pool(workers=0, queue_size=1, put_timeout=0.01)
+        send_email('john@example.com', 'New User', 'mail/new_user',
+                   user=User(username='john'))
+        client = self.app.test_client(use_cookies=True)
+        response = client.post('/auth/register', data={
+            'email': 'susan@example.com',
+            'username': 'susan',
+            'password': 'cat',
+            'password2': 'cat'
+        }, follow_redirects=True)
+        self.assertEqual(response.status_code, 200)
+        data = response.get_data(as_text=True)
+        self.assertIn('We could not send you an email right now', data)
+        self.assertIn('Log in to request a new confirmation email', data)
+        self.assertIsNotNone(User.query.filter_by(username='susan').first())
+
+        response = client.post('/auth/login', data={
+            'email': 'susan@example.com',
+            'password': 'cat'
+        })
+        response = client.get('/auth/confirm', follow_redirects=True)
+        self.assertEqual(response.status_code, 200)
+        data = response.get_data(as_text=True)
+        self.assertIn('We could not send you an email right now', data)
+        self.assertNotIn('A new confirmation email has been sent', data)
+
+        # the reset request answers the same whether the address has an
+        # account or not, and the dropped message is counted
+        dropped = self.app.extensions['mail_queue'].stats()['dropped']
+        client = self.app.test_client(use_cookies=True)
+        responses = [client.post('/auth/reset', data={'email': email})
+                     for email in ('susan@example.com', 'nobody@example.com')]
+        self.assertEqual([r.status_code for r in responses], [302, 302])
+        self.assertEqual(responses[0].headers['Location'],
+                         responses[1].headers['Location'])
+        self.assertEqual(self.app.extensions['mail_queue'].stats()['dropped'],
+                         dropped + 1)
@@ -0,0 +1,110 @@
+import unittest
+from app import create_app, db, search_index
+from app.fake import Generator, generate, PASSWORD
+from app.models import User, Follow, Post, Comment, Role, Timeline
+
+
+class FakeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_generate(self):
+        info = generate(users=20, follows=4, posts=50, comments=80, seed=42,
+                        batch_size=7)
+        self.assertEqual(info['users'], User.query.count())
+        self.assertEqual(info['follows'], Follow.query.count())
+        self.assertEqual(info['posts'], Post.query.count())
+        self.assertEqual(info['comments'], Comment.query.count())
+
+        # the rows are usable through the models
+        user = User.query.order_by(User.followed_count.desc()).first()
+        self.assertTrue(user.verify_password(PASSWORD))
+        self.assertTrue(user.is_following(user))
+        self.assertTrue(user.can(0))
+        self.assertEqual(user.followed_count, user.followed.count())
+        self.assertEqual(user.post_count, user.posts.count())
+        self.assertEqual(
+            Timeline.query.filter_by(user_id=user.id).count(),
+            user.followed_posts.count())
+        post = Post.query.first()
+        self.assertIn('<p>', post.body_html)
+        self.assertEqual(post.comment_count, post.comments.count())
+        word = post.body.split()[1].strip('*.')
+        self.assertIn(('post', post.id), [
+            (kind, item.id) for kind, item in
+            search_index.search(word, per_page=100).results])
+        bodies = [post.body for post in Post.query.order_by(Post.id)]
+
+        # the same seed gives the same data
+        db.drop_all()
+        db.create_all()
+        Role.insert_roles()
+        self.assertEqual(generate(users=20, follows=4, posts=50,
+                                  comments=80, seed=42), info)
+        self.assertEqual(
+            [post.body for post in Post.query.order_by(Post.id)], bodies)
+
+    def test_without_roles(self):
+        Role.query.delete()
+        db.session.commit()
+        generate(users=2, follows=1, posts=1, comments=1)
+        self.assertEqual(User.query.first().role,
+                         Role.query.filter_by(default=True).first())
+
+    def test_append(self):
+        generator = Generator(batch_size=5)
+        first = generator.users(3)
+        second = generator.users(4)
+        user_ids = list(first) + list(second)
+        self.assertEqual(user_ids,
+                         [user.id for user in User.query.order_by(User.id)])
+        self.assertEqual(generator.follows(second, user_ids, 0), 4)
+        self.assertEqual(generator.comments(10, first, []), range(0))
+
+        generator = Generator(batch_size=5, distinct_bodies=3)
+        post_ids = generator.posts(20, user_ids)
+        self.assertEqual(len(post_ids), 20)
+        self.assertEqual(db.session.query(Post.body).distinct().count(), 3)
+
+    def test_finish_appended_rows(self):
+        generate(users=10, follows=3, posts=20, comments=20, batch_size=4)
+        old_post = Post.query.first()
+        word = old_post.body.split()[1].strip('*.')
+        # rows finish would restore if it rebuilt everything
+        db.session.execute(Timeline.__table__.delete().where(
+            Timeline.user_id == 1))
+        db.session.execute('DELETE FROM posts_search')
+        db.session.commit()
+
+        generator = Generator(seed=1, batch_size=4)
+        old_ids = range(1, 11)
+        user_ids = generator.users(5)
+        generator.follows(user_ids, list(old_ids) + list(user_ids), 3)
+        post_ids = generator.posts(10, list(old_ids) + list(user_ids))
+        generator.comments(10, user_ids, post_ids)
+        generator.finish()
+
+        # only the new posts were fanned out to the existing users
+        self.assertTrue(all(row.post_id in post_ids for row in
+                            Timeline.query.filter_by(user_id=1)))
+        for user in User.query.filter(User.id.in_(user_ids)):
+            self.assertEqual(
+                Timeline.query.filter_by(user_id=user.id).count(),
+                user.followed_posts.count())
+        self.assertNotIn(('post', old_post.id), [
+            (kind, item.id) for kind, item in
+            search_index.search(word, per_page=100).results])
+        post = Post.query.get(post_ids[0])
+        word = post.body.split()[1].strip('*.')
+        self.assertIn(('post', post.id), [
+            (kind, item.id) for kind, item in
+            search_index.search(word, per_page=100).results])
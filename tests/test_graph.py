@@ -0,0 +1,147 @@
+import json
+import threading
+import time
+import unittest
+from unittest import mock
+from base64 import b64encode
+from app import create_app, db, follow_graph
+from app.models import User, Role
+
+
+class FollowGraphTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.users = {}
+        for name in ('john', 'susan', 'david', 'mary', 'alice', 'bob'):
+            self.users[name] = User(email=name + '@example.com',
+                                    username=name, password='cat',
+                                    confirmed=True)
+        db.session.add_all(self.users.values())
+        db.session.commit()
+        self.follow('john', 'susan', 'david')
+        self.follow('susan', 'mary', 'alice')
+        self.follow('david', 'mary', 'john')
+        self.follow('alice', 'bob')
+        follow_graph.rebuild()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def follow(self, follower, *followed):
+        for name in followed:
+            self.users[follower].follow(self.users[name])
+        db.session.commit()
+
+    def recommend(self, name):
+        by_id = {u.id: name for name, u in self.users.items()}
+        return [(by_id[id], mutual) for id, mutual in
+                follow_graph.recommend(self.users[name].id)]
+
+    def test_snapshot(self):
+        snapshot = follow_graph.snapshot
+        john, susan, david, mary = [self.users[name].id for name in
+                                    ('john', 'susan', 'david', 'mary')]
+        self.assertEqual(list(snapshot.following(john)),
+                         sorted([susan, david]))
+        self.assertEqual(list(snapshot.following(mary)), [])
+        self.assertEqual(list(snapshot.following(10000)), [])
+        self.assertEqual(snapshot.follower_count(mary), 2)
+        self.assertEqual(len(snapshot.targets), 7)
+
+    def test_rollback(self):
+        snapshot = follow_graph.snapshot
+        john, bob = self.users['john'].id, self.users['bob'].id
+        self.users['john'].follow(self.users['bob'])
+        db.session.flush()
+        db.session.rollback()
+        self.assertNotIn(bob, snapshot.following(john))
+        self.assertEqual(snapshot.log, [])
+        self.follow('john', 'bob')
+        self.assertIn(bob, snapshot.following(john))
+
+    def test_first_load(self):
+        self.app.extensions['follow_graph'] = None
+        loaded = threading.Event()
+        followed = threading.Event()
+        load = follow_graph.load
+
+        def slow_load(app):
+            snapshot = load(app)
+            loaded.set()
+            followed.wait(5)
+            return snapshot
+
+        with mock.patch.object(follow_graph, 'load', slow_load):
+            # no recommendations until the snapshot is ready, and follows
+            # committed after it was read are not lost
+            self.assertEqual(self.recommend('john'), [])
+            loaded.wait(5)
+            self.follow('john', 'mary')
+            followed.set()
+            for i in range(100):
+                if self.app.extensions['follow_graph'] is not None:
+                    break
+                time.sleep(0.05)
+        self.assertEqual(self.recommend('john'), [('alice', 1)])
+
+    def test_recommendations(self):
+        # mary is followed by two of the users john follows, alice by one
+        self.assertEqual(self.recommend('john'), [('mary', 2), ('alice', 1)])
+        self.assertEqual(self.recommend('bob'), [])
+
+        # follows made after the snapshot was loaded are applied to it
+        self.follow('john', 'mary')
+        self.assertEqual(self.recommend('john'), [('alice', 1)])
+        self.users['john'].unfollow(self.users['david'])
+        db.session.commit()
+        self.assertEqual(self.recommend('john'), [('alice', 1)])
+        self.follow('john', 'alice')
+        self.assertEqual(self.recommend('john'), [('bob', 1)])
+
+        # follows made while a new snapshot loads are kept
+        snapshot = follow_graph.snapshot
+        load = follow_graph.load
+
+        def load_and_follow(app):
+            new_snapshot = load(app)
+            self.follow('bob', 'susan')
+            return new_snapshot
+
+        with mock.patch.object(follow_graph, 'load', load_and_follow):
+            follow_graph.rebuild()
+        self.assertIsNot(follow_graph.snapshot, snapshot)
+        # mary has more followers
+        self.assertEqual(self.recommend('bob'), [('mary', 1), ('alice', 1)])
+        self.assertEqual(self.recommend('john'), [('bob', 1)])
+
+    def test_views(self):
+        client = self.app.test_client(use_cookies=True)
+        client.post('/auth/login', data={
+            'email': 'john@example.com',
+            'password': 'cat'
+        })
+        response = client.get('/user/john')
+        data = response.get_data(as_text=True)
+        self.assertIn('Who to follow', data)
+        self.assertIn('Followed by 2 people you follow', data)
+        response = client.get('/user/susan')
+        self.assertNotIn('Who to follow', response.get_data(as_text=True))
+
+        response = client.get(
+            '/api/v1/users/{}/recommendations/'.format(self.users['john'].id),
+            headers={
+                'Authorization': 'Basic ' + b64encode(
+                    b'john@example.com:cat').decode('utf-8'),
+                'Accept': 'application/json'})
+        self.assertEqual(response.status_code, 200)
+        recommendations = json.loads(
+            response.get_data(as_text=True))['recommendations']
+        self.assertEqual([(r['user']['username'], r['mutual_follows'])
+                          for r in recommendations],
+                         [('mary', 2), ('alice', 1)])
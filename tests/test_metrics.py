@@ -0,0 +1,130 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from app import create_app, db
+from app.models import User, Role, Post
+from app.metrics import Registry, merge, exposition, prune
+
+
+class MetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_endpoint(self):
+        u = User(email='john@example.com', username='john', password='cat')
+        db.session.add(Post(body='body of the post', author=u))
+        db.session.commit()
+        self.client.get('/')
+        self.client.get('/')
+        self.client.get('/user/john')
+        self.client.get('/wrong/url')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/plain')
+        data = response.get_data(as_text=True)
+        self.assertIn('flasky_requests_total{endpoint="main.index",'
+                      'method="GET",status="200"} 2', data)
+        self.assertIn('flasky_requests_total{endpoint="none",'
+                      'method="GET",status="404"} 1', data)
+        self.assertIn('# TYPE flasky_request_duration_seconds histogram',
+                      data)
+        self.assertIn('flasky_request_duration_seconds_count'
+                      '{endpoint="main.index"} 2', data)
+        self.assertIn('flasky_db_queries_per_request_bucket'
+                      '{endpoint="main.index",le="+Inf"} 2', data)
+        self.assertIn('flasky_template_render_seconds_count'
+                      '{template="index.html"} 2', data)
+        self.assertIn('flasky_cache_hits_total{cache="fragment_cache"} 2',
+                      data)
+        self.assertIn('flasky_worker_threads{{pid="{}"}}'.format(
+            os.getpid()), data)
+
+        # counters do not go back when a cache is cleared
+        self.app.extensions['fragment_cache'].clear()
+        data = self.client.get('/metrics').get_data(as_text=True)
+        self.assertIn('flasky_cache_hits_total{cache="fragment_cache"} 2',
+                      data)
+
+        # only the allowed networks can scrape the metrics
+        response = self.client.get('/metrics', environ_base={
+            'REMOTE_ADDR': '192.0.2.1'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_multiple_processes(self):
+        directory = tempfile.mkdtemp()
+        try:
+            registry = self.app.extensions['metrics']
+            registry.directory = directory
+            self.client.get('/')
+
+            # a worker that has exited left its totals behind
+            other = Registry()
+            other.counter('flasky_requests_total', 'Requests handled.',
+                          ('endpoint', 'method', 'status')).inc(
+                3, endpoint='main.index', method='GET', status=200)
+            other.gauge('flasky_worker_threads', 'Threads.').set(7)
+            snapshot = other.snapshot()
+            snapshot['pid'] = 2 ** 22 + 1
+            with open(os.path.join(directory, 'metrics-other.json'),
+                      'w') as f:
+                json.dump(snapshot, f)
+
+            data = self.client.get('/metrics').get_data(as_text=True)
+            self.assertIn('flasky_requests_total{endpoint="main.index",'
+                          'method="GET",status="200"} 4', data)
+            self.assertNotIn(str(2 ** 22 + 1), data)
+            self.assertTrue(os.path.exists(os.path.join(
+                directory, 'metrics-{}.json'.format(os.getpid()))))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_compression(self):
+        response = self.client.get('/', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers.get('Content-Encoding'), 'gzip')
+        response.get_data()
+        stats = self.app.extensions['compression'].stats()
+        data = self.client.get('/metrics').get_data(as_text=True)
+        self.assertIn('flasky_compression_responses_total 1', data)
+        self.assertIn('flasky_compression_bytes_in_total {}'.format(
+            stats['bytes_in']), data)
+        self.assertIn('flasky_compression_bytes_out_total {}'.format(
+            stats['bytes_out']), data)
+        self.assertIn('flasky_compression_cpu_seconds_total', data)
+
+    def test_prune(self):
+        directory = tempfile.mkdtemp()
+        try:
+            for name, pid in (('dead', 2 ** 22 + 1), ('self', os.getpid()),
+                              ('parent', os.getppid())):
+                with open(os.path.join(directory, 'metrics-{}.json'.format(
+                        name)), 'w') as f:
+                    json.dump({'pid': pid, 'metrics': {}}, f)
+            prune(directory)
+            self.assertEqual(os.listdir(directory), ['metrics-parent.json'])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_exposition(self):
+        registry = Registry()
+        registry.histogram('latency', 'Latency.', ('path',),
+                           buckets=(0.1, 1)).observe(0.5, path='/"x"')
+        self.assertEqual(exposition(merge([registry.snapshot()])),
+                         '# HELP latency Latency.\n'
+                         '# TYPE latency histogram\n'
+                         'latency_bucket{path="/\\"x\\"",le="0.1"} 0\n'
+                         'latency_bucket{path="/\\"x\\"",le="1.0"} 1\n'
+                         'latency_bucket{path="/\\"x\\"",le="+Inf"} 1\n'
+                         'latency_sum{path="/\\"x\\""} 0.5\n'
+                         'latency_count{path="/\\"x\\""} 1\n')
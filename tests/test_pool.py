@@ -0,0 +1,89 @@
+import sqlite3
+import unittest
+from sqlalchemy import exc
+from app import create_app, db
+from app.models import Role
+from app.pool import PoolMonitor, MonitoredQueuePool
+
+
+class PoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    @staticmethod
+    def connect():
+        return sqlite3.connect(':memory:', check_same_thread=False)
+
+    def make_pool(self, monitor, **kwargs):
+        return MonitoredQueuePool(self.connect, monitor=monitor,
+                                  events=monitor.events(), **kwargs)
+
+    def test_overflow_and_timeout(self):
+        monitor = PoolMonitor()
+        pool = self.make_pool(monitor, pool_size=1, max_overflow=1,
+                              timeout=0.01)
+        first = pool.connect()
+        second = pool.connect()
+        with self.assertRaises(exc.TimeoutError):
+            pool.connect()
+        stats = monitor.stats()
+        self.assertEqual(stats['checked_out'], 2)
+        self.assertEqual(stats['checkouts'], 2)
+        self.assertEqual(stats['overflows'], 1)
+        self.assertEqual(stats['timeouts'], 1)
+        self.assertGreaterEqual(stats['wait_time'], 0.01)
+        first.close()
+        second.close()
+        self.assertEqual(monitor.stats()['checked_out'], 0)
+
+        # connections kept in the pool are not overflows
+        pool.connect().close()
+        self.assertEqual(monitor.stats()['overflows'], 1)
+
+        # the monitor survives the pool being recreated
+        pool = pool.recreate()
+        pool.connect().close()
+        self.assertEqual(monitor.stats()['checkouts'], 4)
+
+    def test_pre_ping(self):
+        monitor = PoolMonitor(ping_after=-1)
+        pool = self.make_pool(monitor, pool_size=1)
+        connection = pool.connect()
+        dbapi_connection = connection.connection
+        connection.close()
+        self.assertEqual(monitor.stats()['disconnects'], 0)
+
+        # a connection closed while in the pool is replaced on checkout
+        dbapi_connection.close()
+        connection = pool.connect()
+        self.assertIsNot(connection.connection, dbapi_connection)
+        self.assertEqual(connection.execute('SELECT 1').fetchone(), (1,))
+        dbapi_connection = connection.connection
+        connection.close()
+        self.assertEqual(monitor.stats()['disconnects'], 1)
+
+        # without pre-ping the dead connection is handed out
+        monitor.pre_ping = False
+        dbapi_connection.close()
+        connection = pool.connect()
+        with self.assertRaises(sqlite3.ProgrammingError):
+            connection.cursor()
+
+    def test_metrics(self):
+        self.client.get('/')
+        self.assertIn('primary', self.app.extensions['db_pools'])
+        data = self.client.get('/metrics').get_data(as_text=True)
+        self.assertIn('flasky_db_pool_checkouts_total{database="primary"}',
+                      data)
+        self.assertIn('flasky_db_pool_checked_out{database="primary",pid=',
+                      data)
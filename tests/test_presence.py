@@ -0,0 +1,86 @@
+import time
+import unittest
+from datetime import datetime, timedelta
+from app import create_app, db
+from app.models import User, Role
+from tests.utils import QueryCounter
+
+
+class PresenceTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.tracker = self.app.extensions['presence']
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_coalesced_updates(self):
+        long_ago = datetime.utcnow() - timedelta(hours=1)
+        u1 = User(email='john@example.com', password='cat',
+                  last_seen=long_ago)
+        u2 = User(email='susan@example.org', password='dog',
+                  last_seen=long_ago)
+        u3 = User(email='david@example.net', password='dog')
+        db.session.add_all([u1, u2, u3])
+        db.session.commit()
+
+        # recently seen users are not recorded
+        for u in (u1, u2, u3):
+            db.session.refresh(u)
+        with QueryCounter() as counter:
+            for i in range(3):
+                self.tracker.touch(u1)
+                self.tracker.touch(u2)
+                self.tracker.touch(u3)
+        self.assertEqual(counter.count, 0)
+        self.assertEqual(sorted(self.tracker.pending), [u1.id, u2.id])
+
+        # one flush writes all the pending timestamps
+        self.assertEqual(self.tracker.flush(), 2)
+        self.assertEqual(self.tracker.pending, {})
+        db.session.expire_all()
+        self.assertTrue(u1.last_seen > long_ago)
+        self.assertTrue(u2.last_seen > long_ago)
+
+        # stale copies of the users do not cause further writes
+        u1.last_seen = long_ago
+        self.tracker.touch(u1)
+        self.assertEqual(self.tracker.pending, {})
+
+    def test_background_flush(self):
+        long_ago = datetime.utcnow() - timedelta(hours=1)
+        u = User(email='john@example.com', password='cat',
+                 last_seen=long_ago)
+        db.session.add(u)
+        db.session.commit()
+
+        # the flusher thread runs without an application context
+        self.tracker.interval = 0.01
+        self.tracker.touch(u)
+        deadline = time.time() + 5
+        while self.tracker.writes == 0 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.tracker.writes, 1)
+        self.assertEqual(self.tracker.pending, {})
+        db.session.expire_all()
+        self.assertTrue(u.last_seen > long_ago)
+
+    def test_request_does_not_write_user(self):
+        u = User(email='john@example.com', username='john', password='cat',
+                 confirmed=True)
+        db.session.add(u)
+        db.session.commit()
+        client = self.app.test_client(use_cookies=True)
+        client.post('/auth/login', data={'email': 'john@example.com',
+                                         'password': 'cat'})
+        self.tracker.flush()
+        with QueryCounter() as counter:
+            client.get('/')
+        self.assertFalse([s for s in counter.statements
+                          if s.startswith('UPDATE users')])
@@ -0,0 +1,74 @@
+import unittest
+from datetime import datetime, timedelta
+from app import create_app, db
+from app.models import User, Role, Post, Comment
+from tests.utils import QueryCountMixin
+
+
+class QueryCountTestCase(QueryCountMixin, unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.client = self.app.test_client(use_cookies=True)
+
+        # a moderator who follows a crowd of authors
+        r = Role.query.filter_by(name='Moderator').first()
+        self.user = User(email='john@example.com', username='john',
+                         password='cat', confirmed=True, role=r)
+        db.session.add(self.user)
+        t = datetime(2017, 1, 1)
+        for i in range(25):
+            author = User(email='user{}@example.com'.format(i),
+                          username='user{}'.format(i), password='dog',
+                          confirmed=True)
+            db.session.add(author)
+            self.user.follow(author)
+            post = Post(body='post {}'.format(i), author=author,
+                        timestamp=t + timedelta(minutes=i))
+            db.session.add(post)
+            for j in range(i % 3):
+                db.session.add(Comment(body='comment', post=post,
+                                       author=self.user,
+                                       timestamp=t + timedelta(minutes=j)))
+        db.session.commit()
+        self.post = post
+        self.client.post('/auth/login', data={
+            'email': 'john@example.com',
+            'password': 'cat'
+        })
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_index(self):
+        self.assertMaxQueries(5, self.get, '/')
+
+    def test_followed_index(self):
+        self.client.set_cookie('localhost', 'show_followed', '1')
+        self.assertMaxQueries(5, self.get, '/')
+
+    def test_user(self):
+        self.assertMaxQueries(7, self.get, '/user/user24')
+
+    def test_post(self):
+        for i in range(20):
+            db.session.add(Comment(body='comment', post=self.post,
+                                   author=User.query.get(i + 2)))
+        db.session.commit()
+        self.assertMaxQueries(6, self.get, '/post/{}'.format(self.post.id))
+
+    def test_moderate(self):
+        self.assertMaxQueries(5, self.get, '/moderate')
+
+    def test_followers(self):
+        self.assertMaxQueries(5, self.get, '/followed_by/john')
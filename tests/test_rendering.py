@@ -0,0 +1,73 @@
+import unittest
+from app import create_app, db, renderer
+from app.cache import LRUCache
+from app.models import User, Role, Post, Comment
+
+
+class RenderingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_lru_cache(self):
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.stats()['hits'], 2)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_lru_cache_ttl(self):
+        cache = LRUCache(ttl=-1)
+        cache.set('a', 1)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+    def test_identical_bodies_are_rendered_once(self):
+        u = User(email='john@example.com', password='cat')
+        p1 = Post(body='some *text*', author=u)
+        p2 = Post(body='some *text*', author=u)
+        self.assertEqual(p1.body_html, '<p>some <em>text</em></p>')
+        self.assertEqual(p2.body_html, p1.body_html)
+        self.assertEqual(renderer.stats()['misses'], 1)
+        self.assertEqual(renderer.stats()['hits'], 1)
+
+        # comments allow a different set of tags
+        c = Comment(body='some *text*', author=u, post=p1)
+        self.assertEqual(c.body_html, 'some <em>text</em>')
+        self.assertEqual(renderer.stats()['misses'], 2)
+
+    def test_unchanged_body_is_not_rendered(self):
+        u = User(email='john@example.com', password='cat')
+        p = Post(body='first', author=u)
+        db.session.add(p)
+        db.session.commit()
+        stats = renderer.stats()
+        p.body = 'first'
+        self.assertEqual(renderer.stats(), stats)
+        p.body = 'second'
+        self.assertEqual(p.body_html, '<p>second</p>')
+        self.assertEqual(renderer.stats()['misses'], stats['misses'] + 1)
+
+    def test_render_many(self):
+        bodies = ['some *text*', '# title\n\nhttp://example.com',
+                  '<script>alert(1)</script> **bold**', 'some *text*']
+        expected = []
+        for body in bodies:
+            expected.append(renderer.render(body, Post.allowed_tags))
+            renderer.cache.clear()
+        hits = renderer.stats()['hits']
+        self.assertEqual(renderer.render_many(bodies, Post.allowed_tags),
+                         expected)
+        self.assertEqual(renderer.stats()['hits'], hits + 1)
@@ -0,0 +1,114 @@
+import os
+import shutil
+import tempfile
+import unittest
+from base64 import b64encode
+from app import create_app, db
+from app.models import User, Role, Post
+
+
+class ReplicaTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.primary = os.path.join(self.directory, 'primary.sqlite')
+        self.replica = os.path.join(self.directory, 'replica.sqlite')
+        self.app = create_app('testing')
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = \
+            'sqlite:///' + self.primary
+        self.app.config['SQLALCHEMY_BINDS'] = {
+            'replica': 'sqlite:///' + self.replica}
+        self.app.config['FLASKY_READ_REPLICAS'] = ['replica']
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.user = User(email='john@example.com', username='john',
+                         password='cat', confirmed=True)
+        db.session.add(self.user)
+        db.session.commit()
+        self.replicate()
+        self.client = self.app.test_client(use_cookies=True)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.directory)
+
+    def replicate(self):
+        db.session.commit()
+        shutil.copyfile(self.primary, self.replica)
+        db.get_engine(self.app, bind='replica').dispose()
+
+    def add_post(self, body):
+        post = Post(body=body, author=self.user)
+        db.session.add(post)
+        db.session.commit()
+        id = post.id
+        # requests share the session of the test, start from a new one
+        db.session.remove()
+        return id
+
+    def test_routing(self):
+        self.add_post('not replicated yet')
+        # outside of requests and in write requests queries go to the
+        # primary, in read-only requests to the replica
+        self.assertEqual(Post.query.count(), 1)
+        with self.app.test_request_context('/', method='POST'):
+            self.assertEqual(Post.query.count(), 1)
+        with self.app.test_request_context('/'):
+            self.assertEqual(Post.query.count(), 0)
+        self.replicate()
+        with self.app.test_request_context('/'):
+            self.assertEqual(Post.query.count(), 1)
+
+    def test_read_your_writes(self):
+        response = self.client.post('/auth/login', data={
+            'email': 'john@example.com',
+            'password': 'cat'
+        })
+        self.assertEqual(response.status_code, 302)
+        id = self.add_post('written by someone else')
+        response = self.client.get('/post/{}'.format(id))
+        self.assertEqual(response.status_code, 404)
+
+        # the author sees their post right after writing it
+        response = self.client.post('/', data={'body': 'my own post'},
+                                    follow_redirects=True)
+        data = response.get_data(as_text=True)
+        self.assertIn('my own post', data)
+        self.assertIn('written by someone else', data)
+        response = self.client.get('/user/john')
+        self.assertIn('my own post', response.get_data(as_text=True))
+
+        # back to the replica once the replication lag has passed
+        self.app.extensions['db_writers'].clear()
+        response = self.client.get('/')
+        self.assertNotIn('my own post', response.get_data(as_text=True))
+        self.replicate()
+        response = self.client.get('/')
+        self.assertIn('my own post', response.get_data(as_text=True))
+
+    def test_api_read_your_writes(self):
+        client = self.app.test_client(use_cookies=False)
+        headers = {
+            'Authorization': 'Basic ' + b64encode(
+                b'john@example.com:cat').decode('utf-8'),
+            'Accept': 'application/json',
+            'Content-Type': 'application/json'
+        }
+        response = client.post('/api/v1/posts/', headers=headers,
+                               data='{"body": "posted through the api"}')
+        self.assertEqual(response.status_code, 201)
+        self.assertIsNone(response.headers.get('Set-Cookie'))
+        url = response.headers.get('Location')
+        db.session.remove()
+
+        # the client keeps no cookies, it is recognized by its credentials
+        response = client.get(url, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.headers.get('Set-Cookie'))
+        db.session.remove()
+        self.app.extensions['db_writers'].clear()
+        response = client.get(url, headers=headers)
+        self.assertEqual(response.status_code, 404)
@@ -0,0 +1,120 @@
+import json
+import unittest
+from base64 import b64encode
+from app import create_app, db, search_index
+from app.models import User, Role, Post, Comment
+
+
+class SearchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.client = self.app.test_client()
+        self.u = User(email='john@example.com', username='john',
+                      password='cat', confirmed=True)
+        db.session.add(self.u)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def get_api_headers(self, username, password):
+        return {
+            'Authorization': 'Basic ' + b64encode(
+                (username + ':' + password).encode('utf-8')).decode('utf-8'),
+            'Accept': 'application/json',
+            'Content-Type': 'application/json'
+        }
+
+    def ids(self, pagination):
+        return [(kind, item.id) for kind, item in pagination.results]
+
+    def test_index_updates(self):
+        p1 = Post(body='a post about *running* shoes', author=self.u)
+        p2 = Post(body='shoes, shoes and more shoes', author=self.u)
+        db.session.add_all([p1, p2])
+        db.session.commit()
+        c = Comment(body='I like running too', post=p1, author=self.u)
+        db.session.add(c)
+        db.session.commit()
+
+        # stemmed, ranked matches across posts and comments
+        self.assertEqual(self.ids(search_index.search('shoe')),
+                         [('post', p2.id), ('post', p1.id)])
+        self.assertEqual(self.ids(search_index.search('runs')),
+                         [('comment', c.id), ('post', p1.id)])
+        self.assertEqual(self.ids(search_index.search('running shoes')),
+                         [('post', p1.id)])
+        self.assertEqual(self.ids(search_index.search('"* (')), [])
+
+        # edits, moderation and deletes are reflected immediately
+        p1.body = 'a post about hats'
+        c.disabled = True
+        db.session.delete(p2)
+        db.session.commit()
+        self.assertEqual(self.ids(search_index.search('shoes')), [])
+        self.assertEqual(self.ids(search_index.search('running')), [])
+        self.assertEqual(self.ids(search_index.search('hats')),
+                         [('post', p1.id)])
+
+        # rebuild from scratch
+        db.session.execute('DELETE FROM posts_search')
+        db.session.commit()
+        self.assertEqual(self.ids(search_index.search('hats')), [])
+        search_index.rebuild(chunk_size=1)
+        self.assertEqual(self.ids(search_index.search('hats')),
+                         [('post', p1.id)])
+
+    def test_like_backend(self):
+        self.app.config['FLASKY_SEARCH_BACKEND'] = 'like'
+        self.app.extensions['search'] = None
+        p1 = Post(body='my_file and 100% wool', author=self.u)
+        p2 = Post(body='myxfile and 100 wool', author=self.u)
+        db.session.add_all([p1, p2])
+        db.session.commit()
+        self.assertEqual(self.ids(search_index.search('my_file')),
+                         [('post', p1.id)])
+        self.assertEqual(self.ids(search_index.search('MYXFILE')),
+                         [('post', p2.id)])
+        # wildcards in terms are matched literally
+        query = search_index.backend.select(Post, 'post', ['0%'])
+        self.assertEqual([row.id for row in db.session.execute(query)],
+                         [p1.id])
+
+    def test_views(self):
+        for i in range(25):
+            db.session.add(Post(body='post number {}'.format(i),
+                                author=self.u))
+        db.session.commit()
+        headers = self.get_api_headers('john@example.com', 'cat')
+
+        # keyset paging through the API
+        seen = []
+        url = '/api/v1/search?q=number&count=1'
+        while url:
+            response = self.client.get(url, headers=headers)
+            self.assertEqual(response.status_code, 200)
+            json_response = json.loads(response.get_data(as_text=True))
+            self.assertEqual(json_response['count'], 25)
+            seen.extend(r['post']['body'] for r in json_response['results'])
+            url = json_response['next']
+        self.assertEqual(sorted(seen),
+                         sorted('post number {}'.format(i)
+                                for i in range(25)))
+        response = self.client.get('/api/v1/search?q=number&cursor=bad',
+                                   headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+        # HTML results
+        response = self.client.get('/search?q=number+7')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('post number 7', response.get_data(as_text=True))
+        self.assertNotIn('post number 8', response.get_data(as_text=True))
+        response = self.client.get('/search?q=number&type=comment')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('post number', response.get_data(as_text=True))
@@ -35,8 +35,7 @@ class SeleniumTestCase(unittest.TestCase):
             # create the database and populate with some fake data
             db.create_all()
             Role.insert_roles()
-            fake.users(10)
-            fake.posts(10)
+            fake.generate(users=10, follows=2, posts=10, comments=0)
 
             # add an administrator user
             admin_role = Role.query.filter_by(name='Administrator').first()
@@ -0,0 +1,95 @@
+import json
+import unittest
+from base64 import b64encode
+from app import create_app, db
+from app.models import User, Role, Post
+
+
+class ServerTimingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.client = self.app.test_client(use_cookies=True)
+        admin = Role.query.filter_by(name='Administrator').first()
+        self.u = User(email='john@example.com', username='john',
+                      password='cat', confirmed=True, role=admin)
+        db.session.add(Post(body='body of the *post*', author=self.u))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def timings(self, response):
+        header = response.headers.get('Server-Timing')
+        if header is None:
+            return None
+        return {entry.split(';')[0]: entry for entry in header.split(', ')}
+
+    def test_header(self):
+        # only administrators see the breakdown by default
+        response = self.client.get('/')
+        self.assertIsNone(self.timings(response))
+        self.client.post('/auth/login', data={
+            'email': 'john@example.com',
+            'password': 'cat'
+        })
+        timings = self.timings(self.client.get('/'))
+        for name in ('auth', 'db', 'template', 'total'):
+            self.assertIn(name, timings)
+        self.assertRegex(timings['template'], r'desc="1 calls";dur=[\d.]+$')
+
+        # API requests time authentication and serialization
+        headers = {
+            'Authorization': 'Basic ' + b64encode(
+                b'john@example.com:cat').decode('utf-8'),
+            'Accept': 'application/json'
+        }
+        response = self.client.get('/api/v1/posts/', headers=headers)
+        timings = self.timings(response)
+        self.assertIn('auth', timings)
+        self.assertIn('serialize', timings)
+
+        # or everyone when enabled
+        self.client.get('/auth/logout')
+        self.app.config['FLASKY_SERVER_TIMING'] = True
+        response = self.client.post('/api/v1/posts/', headers=dict(
+            headers, **{'Content-Type': 'application/json'}),
+            data=json.dumps({'body': 'new *post*'}))
+        self.assertIn('markdown', self.timings(response))
+
+    def test_slow_requests(self):
+        self.app.config['FLASKY_SLOW_REQUEST_TIME'] = 0
+        self.client.get('/user/john?page=1')
+        self.client.post('/auth/login', data={
+            'email': 'john@example.com',
+            'password': 'cat'
+        })
+        self.client.get('/auth/confirm/secret-token?next=/')
+        log = list(self.app.extensions['slow_requests'])
+        # tokens in the URL are not kept
+        self.assertEqual([(r['path'], r['args']) for r in log],
+                         [('/user/<username>', ['page']),
+                          ('/auth/login', []),
+                          ('/auth/confirm/<token>', ['next'])])
+        self.assertIn('db', log[0]['timings'])
+        response = self.client.get('/slow-requests')
+        self.assertEqual(response.status_code, 200)
+        data = response.get_data(as_text=True)
+        self.assertIn('/user/&lt;username&gt;?page', data)
+        self.assertNotIn('secret-token', data)
+
+        # the log is bounded
+        for i in range(150):
+            self.client.get('/user/john')
+        self.assertEqual(len(self.app.extensions['slow_requests']), 100)
+
+        # and can be turned off
+        self.app.extensions['slow_requests'].clear()
+        self.app.config['FLASKY_SLOW_REQUEST_LOG_SIZE'] = 0
+        self.client.get('/user/john')
+        self.assertEqual(len(self.app.extensions['slow_requests']), 0)
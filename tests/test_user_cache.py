@@ -0,0 +1,67 @@
+import unittest
+from app import create_app, db
+from app.models import User, Role, user_cache
+from tests.utils import QueryCounter
+
+
+class UserCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        u = User(email='john@example.com', username='john', password='cat',
+                 confirmed=True)
+        db.session.add(u)
+        db.session.commit()
+        self.id = u.id
+        db.session.remove()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_lookups(self):
+        self.assertEqual(user_cache.get_by_username('john').id, self.id)
+        db.session.remove()
+        with QueryCounter() as counter:
+            u1 = user_cache.get(self.id)
+            u2 = user_cache.get_by_username('john')
+            u3 = user_cache.get_by_email('john@example.com')
+        self.assertEqual(counter.count, 0)
+        self.assertTrue(u1 is u2 is u3)
+        self.assertEqual(u1.username, 'john')
+        self.assertTrue(u1.verify_password('cat'))
+        self.assertIn(u1, db.session)
+        self.assertEqual(u1.followed.count(), 1)
+        self.assertIsNone(user_cache.get_by_username('susan'))
+        # lookups by username or email hit the cache twice
+        self.assertEqual(user_cache.stats()['hits'], 5)
+
+    def test_invalidation(self):
+        u = user_cache.get(self.id)
+        u.username = 'johnny'
+        db.session.commit()
+        db.session.remove()
+        self.assertIsNone(user_cache.get_by_username('john'))
+        self.assertEqual(user_cache.get_by_username('johnny').id, self.id)
+        self.assertFalse(user_cache.get(self.id).is_administrator())
+
+        # role changes are seen immediately
+        u = user_cache.get(self.id)
+        u.role = Role.query.filter_by(name='Administrator').first()
+        db.session.commit()
+        db.session.remove()
+        self.assertTrue(user_cache.get(self.id).is_administrator())
+
+    def test_profile_page(self):
+        client = self.app.test_client()
+        client.get('/user/john')
+        with QueryCounter() as counter:
+            response = client.get('/user/john')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([s for s in counter.statements
+                          if s.startswith('SELECT users.')])
+        self.assertEqual(client.get('/user/susan').status_code, 404)
@@ -2,7 +2,9 @@ import unittest
 import time
 from datetime import datetime
 from app import create_app, db
-from app.models import User, AnonymousUser, Role, Permission, Follow
+from app.models import User, AnonymousUser, Role, Permission, Follow, \
+    Post, Comment, Timeline, role_table
+from tests.utils import QueryCounter
 
 
 class UserModelTestCase(unittest.TestCase):
@@ -131,6 +133,39 @@ class UserModelTestCase(unittest.TestCase):
         self.assertTrue(u.can(Permission.MODERATE))
         self.assertTrue(u.can(Permission.ADMIN))
 
+    def test_role_table(self):
+        u = User(email='john@example.com', password='cat')
+        db.session.add(u)
+        db.session.commit()
+        db.session.expire_all()
+        with QueryCounter() as counter:
+            self.assertTrue(u.can(Permission.WRITE))
+            self.assertFalse(u.is_administrator())
+            v = User(email='susan@example.com', password='dog')
+            self.assertEqual(v.role.name, 'User')
+        self.assertFalse([s for s in counter.statements
+                          if 'FROM roles' in s])
+
+        # role edits are seen immediately
+        r = Role.query.filter_by(name='User').first()
+        r.add_permission(Permission.MODERATE)
+        db.session.commit()
+        self.assertTrue(u.can(Permission.MODERATE))
+
+        # the snapshot is dropped when the transaction ends, even if it was
+        # reloaded from rows that were flushed and then rolled back
+        r.remove_permission(Permission.MODERATE)
+        db.session.flush()
+        self.assertTrue(u.can(Permission.MODERATE))
+        role_table.invalidate()
+        self.assertFalse(u.can(Permission.MODERATE))
+        db.session.rollback()
+        self.assertTrue(u.can(Permission.MODERATE))
+
+        # a newly assigned role takes effect before it is flushed
+        u.role = Role.query.filter_by(name='Administrator').first()
+        self.assertTrue(u.is_administrator())
+
     def test_anonymous_user(self):
         u = AnonymousUser()
         self.assertFalse(u.can(Permission.FOLLOW))
@@ -207,6 +242,143 @@ class UserModelTestCase(unittest.TestCase):
         db.session.commit()
         self.assertTrue(Follow.query.count() == 1)
 
+    def test_timeline(self):
+        u1 = User(email='john@example.com', password='cat')
+        u2 = User(email='susan@example.org', password='dog')
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        p1 = Post(body='first post', author=u2,
+                  timestamp=datetime(2017, 1, 1))
+        db.session.add(p1)
+        db.session.commit()
+        self.assertEqual(u1.followed_posts.all(), [])
+        self.assertEqual(u2.followed_posts.all(), [p1])
+        u1.follow(u2)
+        db.session.commit()
+        self.assertEqual(u1.followed_posts.all(), [p1])
+        p2 = Post(body='second post', author=u2,
+                  timestamp=datetime(2017, 1, 2))
+        db.session.add(p2)
+        db.session.commit()
+        self.assertEqual(u1.followed_posts.all(), [p2, p1])
+        u1.unfollow(u2)
+        db.session.commit()
+        self.assertEqual(u1.followed_posts.all(), [])
+        self.assertEqual(u2.followed_posts.all(), [p2, p1])
+        u1.follow(u2)
+        db.session.commit()
+        Timeline.query.delete()
+        db.session.commit()
+        Timeline.rebuild()
+        self.assertEqual(u1.followed_posts.all(), [p2, p1])
+        self.assertEqual(Timeline.query.count(), 4)
+
+        # stale rows are replaced one chunk of users at a time
+        db.session.add(Timeline(user_id=u1.id, post_id=p2.id + 1))
+        db.session.commit()
+        Timeline.rebuild(chunk_size=1)
+        self.assertEqual(u1.followed_posts.all(), [p2, p1])
+        self.assertEqual(u2.followed_posts.all(), [p2, p1])
+        self.assertEqual(Timeline.query.count(), 4)
+
+    def test_counters(self):
+        u1 = User(email='john@example.com', password='cat')
+        u2 = User(email='susan@example.org', password='dog')
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        self.assertEqual(u1.followers_count, 1)
+        self.assertEqual(u1.followed_count, 1)
+        p = Post(body='a post', author=u1)
+        db.session.add(p)
+        db.session.commit()
+        c1 = Comment(body='a comment', author=u2, post=p)
+        c2 = Comment(body='another comment', author=u2, post=p)
+        u2.follow(u1)
+        db.session.add_all([c1, c2])
+        db.session.commit()
+        self.assertEqual(u1.post_count, 1)
+        self.assertEqual(u1.followers_count, 2)
+        self.assertEqual(u2.followed_count, 2)
+        self.assertEqual(u2.comment_count, 2)
+        self.assertEqual(p.comment_count, 2)
+        u2.unfollow(u1)
+        db.session.delete(c1)
+        db.session.commit()
+        self.assertEqual(u1.followers_count, 1)
+        self.assertEqual(u2.followed_count, 1)
+        self.assertEqual(u2.comment_count, 1)
+        self.assertEqual(p.comment_count, 1)
+
+        # repair drifted counters
+        db.session.execute(User.__table__.update().values(
+            post_count=10, comment_count=10, followers_count=10,
+            followed_count=10))
+        db.session.execute(Post.__table__.update().values(comment_count=10))
+        db.session.commit()
+        User.recount()
+        Post.recount()
+        self.assertEqual([u1.post_count, u1.comment_count,
+                          u1.followers_count, u1.followed_count],
+                         [1, 0, 1, 1])
+        self.assertEqual([u2.post_count, u2.comment_count,
+                          u2.followers_count, u2.followed_count],
+                         [0, 1, 1, 1])
+        self.assertEqual(p.comment_count, 1)
+
+    def test_counter_updates(self):
+        u1 = User(email='john@example.com', password='cat')
+        u2 = User(email='susan@example.org', password='dog')
+        p = Post(body='a post', author=u1)
+        db.session.add_all([u1, u2, p])
+        db.session.commit()
+        # only the counters that are published change updated_at
+        u1_updated_at, p_updated_at = u1.updated_at, p.updated_at
+        u2.follow(u1)
+        db.session.add(Comment(body='a comment', author=u1, post=p))
+        db.session.commit()
+        self.assertEqual(u1.updated_at, u1_updated_at)
+        self.assertGreater(p.updated_at, p_updated_at)
+        db.session.add(Post(body='another post', author=u1))
+        db.session.commit()
+        self.assertGreater(u1.updated_at, u1_updated_at)
+
+    def test_deploy_tasks(self):
+        # roles that are up to date are left alone
+        with QueryCounter() as counter:
+            self.assertFalse(Role.insert_roles())
+        self.assertEqual(counter.count, 1)
+        role = Role.query.filter_by(name='User').first()
+        role.permissions = 0
+        db.session.commit()
+        self.assertTrue(Role.insert_roles())
+        self.assertEqual(role.permissions, Permission.FOLLOW +
+                         Permission.COMMENT + Permission.WRITE)
+
+        u1 = User(email='john@example.com', password='cat')
+        u2 = User(email='susan@example.org', password='dog')
+        p = Post(body='post', author=u1)
+        db.session.add_all([u1, u2, p])
+        db.session.commit()
+        with QueryCounter() as counter:
+            self.assertEqual(User.add_self_follows(), 0)
+        self.assertEqual(counter.count, 1)
+
+        # users created before self-follows were introduced
+        db.session.execute(Follow.__table__.delete().where(
+            Follow.follower_id == Follow.followed_id))
+        db.session.execute(Timeline.__table__.delete())
+        db.session.execute(User.__table__.update().values(
+            followers_count=0, followed_count=0))
+        db.session.commit()
+        self.assertEqual(User.add_self_follows(chunk_size=1), 2)
+        for u in (u1, u2):
+            self.assertTrue(u.is_following(u))
+            self.assertEqual(u.followers_count, 1)
+            self.assertEqual(u.followed_count, 1)
+        self.assertEqual(u1.followed_posts.all(), [p])
+        self.assertEqual(u2.followed_posts.all(), [])
+        self.assertEqual(User.add_self_follows(), 0)
+
     def test_to_json(self):
         u = User(email='john@example.com', password='cat')
         db.session.add(u)
@@ -0,0 +1,34 @@
+from app import db
+
+
+class QueryCounter(object):
+    """Context manager that records the SQL statements issued through the
+    application's engine while it is active."""
+    def __init__(self):
+        self.statements = []
+
+    def __enter__(self):
+        db.event.listen(db.engine, 'before_cursor_execute', self._record)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        db.event.remove(db.engine, 'before_cursor_execute', self._record)
+
+    def _record(self, conn, cursor, statement, parameters, context,
+                executemany):
+        self.statements.append(statement)
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+
+class QueryCountMixin(object):
+    def assertMaxQueries(self, max_queries, func, *args, **kwargs):
+        with QueryCounter() as counter:
+            result = func(*args, **kwargs)
+        self.assertLessEqual(
+            counter.count, max_queries,
+            '{} queries issued, expected at most {}:\n{}'.format(
+                counter.count, max_queries, '\n'.join(counter.statements)))
+        return result